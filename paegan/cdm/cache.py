@@ -0,0 +1,405 @@
+import os
+import re
+import glob
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+# The files a DiskSlabCache writes, and the only ones it counts or deletes
+# in its directory
+_slab_file = re.compile(r"^[0-9a-f]{40}\.slab\.npz$")
+
+def _nbytes(data):
+    nbytes = data.nbytes
+    if np.ma.isMaskedArray(data) and data.mask is not np.ma.nomask:
+        nbytes += data.mask.nbytes
+    return nbytes
+
+class SlabCache(object):
+    """
+        In memory cache of hyperslabs read from a dataset, least recently
+        used first out once the cached arrays exceed max_bytes.
+
+        Slabs are keyed by variable name and the (start, stop) of every
+        axis.  A request is answered by the slab read for exactly those
+        bounds or, failing that, by any cached slab of the same variable
+        that contains them.
+
+        A backing cache (such as a DiskSlabCache) is consulted on misses,
+        and receives every slab put here.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, backing=None):
+        self.max_bytes = max_bytes
+        self.backing = backing
+        self._slabs = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name, bounds):
+        """
+            The hyperslab of variable name covering bounds (a (start, stop)
+            tuple per axis), or None when no cached slab contains it.
+        """
+        bounds = tuple(bounds)
+        with self._lock:
+            key = (name, bounds)
+            if key not in self._slabs:
+                key = None
+                for cached in reversed(self._slabs):
+                    if cached[0] == name and len(cached[1]) == len(bounds) and \
+                       all(c[0] <= b[0] and b[1] <= c[1] for c, b in zip(cached[1], bounds)):
+                        key = cached
+                        break
+            if key is None:
+                self.misses += 1
+        if key is None:
+            if self.backing is None:
+                return None
+            slab = self.backing.get(name, bounds)
+            if slab is not None:
+                self._keep(name, bounds, slab)
+            return slab
+        with self._lock:
+            self.hits += 1
+            slab = self._slabs.pop(key)
+            self._slabs[key] = slab
+        if key[1] == bounds:
+            return slab
+        return slab[tuple(slice(b[0] - c[0], b[1] - c[0]) for c, b in zip(key[1], bounds))]
+
+    def put(self, name, bounds, slab):
+        """
+            Keep slab as the hyperslab of variable name covering bounds,
+            evicting the least recently used slabs to stay within max_bytes.
+            Slabs larger than max_bytes on their own are not kept.
+        """
+        if self.backing is not None:
+            self.backing.put(name, bounds, slab)
+        self._keep(name, bounds, slab)
+
+    def _keep(self, name, bounds, slab):
+        nbytes = _nbytes(slab)
+        if nbytes > self.max_bytes:
+            return
+        key = (name, tuple(bounds))
+        with self._lock:
+            if key in self._slabs:
+                self.nbytes -= _nbytes(self._slabs.pop(key))
+            self._slabs[key] = slab
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                old_key, old_slab = self._slabs.popitem(last=False)
+                self.nbytes -= _nbytes(old_slab)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._slabs.clear()
+            self.nbytes = 0
+
+    def get_stats(self):
+        return {"hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions,
+                "slabs" : len(self._slabs), "nbytes" : self.nbytes, "max_bytes" : self.max_bytes}
+
+    def __len__(self):
+        return len(self._slabs)
+
+    stats = property(get_stats, None)
+
+
+def dataset_version(source, nc=None):
+    """
+        Something that changes whenever the dataset at source changes: the
+        size and modification time of a local file, or of every file a
+        glob pattern of an aggregation matches.  None when nothing like
+        that is known, as for remote DAP endpoints (which report no
+        modification time) or already open netCDF4 objects, and then
+        nothing of the dataset is cached on disk.  nc is not needed.
+    """
+    if not isinstance(source, basestring):
+        return None
+    if os.path.isfile(source):
+        paths = [source]
+    elif "://" in source:
+        return None
+    else:
+        paths = sorted(glob.glob(source))
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        parts.append("%d:%r" % (st.st_size, st.st_mtime))
+    if len(parts) == 0:
+        return None
+    return "|".join(parts)
+
+class DiskSlabCache(object):
+    """
+        Hyperslabs of one dataset kept as .slab.npz files in directory, so
+        they survive restarts.  Files are named by a hash of the dataset source
+        (path or URL), its dataset_version, the variable name and the
+        (start, stop) of every axis, so a changed dataset never serves
+        stale slabs.  Once the files exceed max_bytes the least recently
+        used (by file modification time, refreshed on every hit) are
+        deleted.  Several processes may share a directory, and other files
+        in it (such as CoordinateCache sidecars) are left alone.
+
+        Without a version (see dataset_version, or pass one such as the
+        ETag of a remote dataset) nothing is read or written.
+
+        The size of the directory is counted once, and then kept up to
+        date with the files this cache writes, so the directory is only
+        listed again when that count goes over max_bytes.
+    """
+    def __init__(self, directory, source, nc=None, max_bytes=2 * 1024 * 1024 * 1024, version=None):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.source = str(source)
+        self.max_bytes = max_bytes
+        if version is None:
+            version = dataset_version(source, nc)
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nbytes = sum(e[1] for e in self._entries())
+
+    def _path(self, name, bounds):
+        key = repr((self.source, self.version, str(name), tuple((int(a), int(b)) for a, b in bounds)))
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".slab.npz")
+
+    def get(self, name, bounds):
+        if self.version is None:
+            return None
+        path = self._path(name, bounds)
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                data = stored['data']
+                if 'mask' in stored.files:
+                    data = np.ma.masked_array(data, mask=stored['mask'])
+                elif 'masked' in stored.files:
+                    data = np.ma.masked_array(data)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, name, bounds, slab):
+        if self.version is None or slab.dtype.kind == 'O' or _nbytes(slab) > self.max_bytes:
+            return
+        arrays = {'data' : np.ma.getdata(slab)}
+        if np.ma.getmask(slab) is not np.ma.nomask:
+            arrays['mask'] = np.ma.getmask(slab)
+        elif np.ma.isMaskedArray(slab):
+            arrays['masked'] = np.asarray(True)
+        path = self._path(name, bounds)
+        # Write elsewhere and rename, readers never see a partial file
+        handle, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                np.savez(f, **arrays)
+            size = os.path.getsize(tmp)
+            if os.path.exists(path):
+                self._nbytes -= os.path.getsize(path)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._nbytes += size
+        if self._nbytes > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if _slab_file.match(filename):
+                try:
+                    st = os.stat(os.path.join(self.directory, filename))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, filename))
+        return entries
+
+    def _evict(self):
+        # Other processes may have added or removed files since
+        entries = self._entries()
+        total = sum(e[1] for e in entries)
+        for mtime, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, filename))
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self._nbytes = total
+
+    def get_nbytes(self):
+        """
+            Bytes of slabs in the directory, as last counted.
+        """
+        return self._nbytes
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if _slab_file.match(filename):
+                os.remove(os.path.join(self.directory, filename))
+        self._nbytes = 0
+
+    def get_stats(self):
+        return {"hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions,
+                "nbytes" : self.nbytes, "max_bytes" : self.max_bytes}
+
+    nbytes = property(get_nbytes, None)
+    stats = property(get_stats, None)
+
+
+def _copy_entry(entry):
+    if entry is None:
+        return None
+    return dict((k, v.copy() if isinstance(v, np.ndarray) else v) for k, v in entry.items())
+
+def _pack(value, name, arrays):
+    """
+        A JSON description of value, whose arrays are added to arrays
+        under names starting with name (see _unpack).
+    """
+    if value is None or isinstance(value, (bool, str, type(u""))):
+        return {"value" : value}
+    if isinstance(value, (tuple, list)):
+        return {"items" : [_pack(v, "%s.%d" % (name, i), arrays) for i, v in enumerate(value)]}
+    data = np.ma.getdata(value)
+    if not isinstance(data, np.ndarray) and not np.isscalar(data):
+        raise TypeError("Only arrays, numbers, strings and sequences of them can be cached, not %s" % type(value))
+    data = np.asarray(data)
+    if data.dtype.kind == 'O':
+        raise TypeError("Object arrays can not be cached")
+    arrays[name] = data
+    packed = {"array" : name, "scalar" : data.ndim == 0 and not isinstance(value, np.ndarray)}
+    if np.ma.getmask(value) is not np.ma.nomask:
+        arrays[name + ".mask"] = np.ma.getmask(value)
+        packed["mask"] = name + ".mask"
+    return packed
+
+def _unpack(packed, arrays):
+    if "items" in packed:
+        return tuple(_unpack(p, arrays) for p in packed["items"])
+    if "array" not in packed:
+        return packed["value"]
+    data = arrays[packed["array"]]
+    if "mask" in packed:
+        return np.ma.masked_array(data, mask=arrays[packed["mask"]])
+    if packed["scalar"]:
+        return data[()]
+    return data
+
+class CoordinateCache(object):
+    """
+        Coordinate arrays of one dataset, and the small structures derived
+        from them (bbox, sorted time and depth axes), saved with numpy.savez
+        to a sidecar file so that later processes can skip reading them.
+        Search indexes and polygons are not stored, the coordinate objects
+        rebuild them from the arrays when first needed.  The file records
+        the dataset source and its dataset_version (size and mtime of local
+        files) and is ignored once either changes.  Without a version the
+        entries are only kept in memory.
+
+        Entries are plain dictionaries of arrays, numbers and strings (or
+        tuples of them) keyed by tuples such as ('grid', xname, yname),
+        ('time', tname) and ('depth', zname).  The file holds nothing that
+        has to be unpickled to be read.
+    """
+    def __init__(self, path, source, nc=None, version=None):
+        self.path = path
+        self.source = str(source)
+        if version is None:
+            version = dataset_version(source, nc)
+        self.version = version
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        entries = dict()
+        if self.version is None:
+            return entries
+        try:
+            with np.load(self.path, allow_pickle=False) as stored:
+                arrays = dict((name, stored[name]) for name in stored.files)
+            layout = json.loads(str(arrays.pop("layout")))
+            if layout["source"] == self.source and layout["version"] == self.version:
+                for key, fields in layout["entries"]:
+                    entries[tuple(key)] = dict((f, _unpack(p, arrays)) for f, p in fields.items())
+        except Exception:
+            # Missing, unreadable or written by an incompatible version
+            pass
+        return entries
+
+    def get(self, key):
+        """
+            A copy of the entry stored under key (so that the coordinate
+            objects built from it can be restricted in place), or None.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return _copy_entry(self._entries.get(key, None))
+
+    def put(self, key, entry):
+        """
+            Store a copy of entry under key.  Raises TypeError for values
+            other than arrays, numbers, strings and tuples of them.
+        """
+        for field, value in entry.items():
+            _pack(value, field, dict())
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            self._entries[key] = _copy_entry(entry)
+            self._save()
+
+    def _save(self):
+        if self.version is None:
+            return
+        arrays = dict()
+        entries = []
+        for key, entry in self._entries.items():
+            name = "%d" % len(entries)
+            entries.append([list(key), dict((f, _pack(v, "%s.%s" % (name, f), arrays)) for f, v in entry.items())])
+        layout = {"source" : self.source, "version" : self.version, "entries" : entries}
+        arrays["layout"] = np.asarray(json.dumps(layout))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # Write elsewhere and rename, readers never see a partial file
+        handle, tmp = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                np.savez(f, **arrays)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def clear(self):
+        with self._lock:
+            self._entries = dict()
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -1,15 +1,26 @@
 import numpy as np
+import os, hashlib, threading
 import netCDF4, datetime, copy
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from paegan.cdm.timevar import Timevar
 from paegan.cdm.depthvar import Depthvar
 from paegan.cdm.gridvar import Gridobj
 from paegan.cdm.variable import Coordinates as cachevar
 from paegan.cdm.variable import SubCoordinates as subs
+from paegan.cdm.variable import CoordinateDescriptor
+from paegan.cdm.cache import SlabCache, DiskSlabCache, CoordinateCache
+from paegan.cdm.prefetch import ReadAhead, FieldWindow
 from paegan.location4d import Location4D
-from paegan.utils.asainterpolate import CfGeoInterpolator
+from paegan.utils.asainterpolate import CfGeoInterpolator, StructuredInterpolator, ScatteredInterpolator
 
 from paegan.logger import logger
 
+try:
+    basestring
+except NameError:
+    basestring = str
+
 _possiblet = ["time", "TIME", "Time",
               "t", "T",
               "ocean_time", "OCEAN_TIME",
@@ -58,40 +69,8 @@ _possibley = ["y", "Y",
               "lat_psi", "LAT_PSI",
              ]
 
-def _sub_by_nan(data, ind):
-        """
-            Funtction to subset a dimension variable by replacing values
-            that do not appear in the index with np.nan, in order to
-            preserve the lazy data access on the full array's in the backend.
-        """
-        if len(ind) > 0:
-            xtmp = -1 * np.ones_like(data)
-            xtmp[ind[0]:ind[-1]+1] = ind
-            xbool = range(len(data)) != xtmp
-            data[xbool] = np.nan
-        else:
-            data = np.nan * np.ones_like(data)
-        return data
-
-
-def _sub_by_nan2(data, ind):
-        """
-            Funtction to subset a dimension variable by replacing values
-            that do not appear in the index with np.nan, in order to
-            preserve the lazy data access on the full array's in the backend.
-        """
-        if (len(ind[0]) > 0) & (len(ind[1]) > 0):
-            xtmp = -1 * np.ones_like(data[1, :])
-            xtmp[ind[1][0]:ind[1][-1]+1] = ind[1]
-            xbool = range(len(data[1])) != xtmp
-            ytmp = -1 * np.ones_like(data[:, 1])
-            ytmp[ind[0][0]:ind[0][-1]+1] = ind[0]
-            ybool = range(len(data[0])) != ytmp
-            data[ybool, xbool] = np.nan
-        else:
-            data = np.nan * np.ones_like(data)
-        return data
-
+# griddata names for the interpolation methods
+_griddata_methods = {"bilinear": "linear", "trilinear": "linear"}
 
 class CommonDataset(object):
 
@@ -204,10 +183,48 @@ class CommonDataset(object):
         return dataobj
 
 
+def _largest_step(values):
+    """
+    The largest difference between neighbouring values along any axis.
+    """
+    values = np.asarray(values, dtype='float64')
+    steps = [np.nanmax(np.abs(np.diff(values, axis=axis))) for axis in range(values.ndim)
+             if values.shape[axis] > 1]
+    if len(steps) == 0:
+        return 0.
+    return float(np.nanmax(steps))
+
+def _digest(*arrays):
+    """
+    A hash of the shapes and values of arrays.
+    """
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(np.asarray(array, dtype='float64'))
+        digest.update(repr(array.shape).encode('utf-8'))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+class _NetCDFHandle(object):
+    """
+    The netCDF4 object of a dataset, shared by the views of it (see
+    Dataset._copy), and a lock serializing the reads of it, since netCDF4
+    and HDF5 are not safe to use from several threads at once.
+    """
+    def __init__(self, nc=None):
+        self.nc = nc
+        self.lock = threading.RLock()
+
 class Dataset(object):
     def __init__(self, filepath, datasettype, xname='lon', yname='lat',
                  zname='z', tname='time'):
         self._coordcache = dict()
+        self._coordobjects = dict()
+        self._restrictions = []
+        self._descriptorcache = dict()
+        self._slabcache = None
+        self._coordinatecache = None
+        self._interpolationplans = OrderedDict()
         self._datasettype = datasettype
 
         self._possiblet = _possiblet
@@ -229,7 +246,22 @@ class Dataset(object):
         self._current_variables = list(self.nc.variables.keys())
 
     def _copy(self):
-        raise NotImplementedError
+        """
+        A view of this dataset for the restrict methods to narrow down.  It
+        shares the open netCDF handle, the caches and the coordinate
+        objects; restrictions replace the coordinate objects they change
+        with restricted ones (see _restricted), so neither the view nor
+        this dataset sees the other's restrictions.  Closing either closes
+        the shared handle, which the others open again when next used
+        (see get_nc).
+        """
+        new = object.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        new._coordcache = dict((var, copy.copy(coords)) for var, coords in self._coordcache.items())
+        new._coordobjects = copy.copy(self._coordobjects)
+        new._descriptorcache = copy.copy(self._descriptorcache)
+        new._current_variables = copy.copy(self._current_variables)
+        return new
 
     """
 
@@ -238,10 +270,11 @@ class Dataset(object):
     """
     def getvariableinfo(self):
         variables = {}
-        for var in self._current_variables:
-            variables[var] = {}
-            for attr in self.nc.variables[var].ncattrs():
-                variables[var][attr] = getattr(self.nc.variables[var], attr)
+        with self.lock:
+            for var in self._current_variables:
+                variables[var] = {}
+                for attr in self.nc.variables[var].ncattrs():
+                    variables[var][attr] = getattr(self.nc.variables[var], attr)
         return variables
 
     def lon2ind(self, var=None, **kwargs):
@@ -262,52 +295,278 @@ class Dataset(object):
     def get_xyind_from_point(self, var, point, **kwargs):
         raise NotImplementedError
 
+    def get_xyind_from_points(self, var, lon, lat, **kwargs):
+        raise NotImplementedError
+
+    def get_nc(self):
+        """
+        The open netCDF4 object, shared with the views of this dataset.
+        When a view (or the dataset it came from) has closed it, it is
+        opened again here on next use.
+        """
+        handle = self.__dict__.get('_handle', None)
+        if handle is None:
+            return None
+        if handle.nc is None:
+            with handle.lock:
+                if handle.nc is None:
+                    handle.nc = CommonDataset.nc_object(self._filepath)
+        return handle.nc
+
+    def get_lock(self):
+        """
+        The lock serializing every use of the netCDF handle (reads, and
+        the coordinate and attribute lookups), shared with the views of
+        this dataset.  Hold it around any direct use of nc while other
+        threads may be reading, such as during iter_values, field_window
+        or get_many_values with workers.
+        """
+        handle = self.__dict__.get('_handle', None)
+        if handle is None:
+            raise ValueError("the dataset is closed, see opennc")
+        return handle.lock
+
+    nc = property(get_nc, None)
+    lock = property(get_lock, None)
+
     def opennc(self):
+        handle = self.__dict__.get('_handle', None)
         try:
             # Open if if it None
-            assert self.nc is not None
+            assert handle is not None and handle.nc is not None
             # Raises an exception when the dataset has alrady been closed
-            self.nc.__str__()
-        except StandardError:
-            self.nc = CommonDataset.nc_object(self._filepath)
-            self.metadata = self.nc.__dict__
+            handle.nc.__str__()
+        except Exception:
+            if handle is None:
+                handle = self._handle = _NetCDFHandle()
+            handle.nc = CommonDataset.nc_object(self._filepath)
+            self.metadata = handle.nc.__dict__
 
     def closenc(self):
+        handle = self.__dict__.get('_handle', None)
         try:
             # close will raise an error if the Dataset is already closed
-            self.nc.close()
-        except StandardError:
+            handle.nc.close()
+        except Exception:
             pass
         finally:
+            if handle is not None:
+                # Views still holding the handle open the file again
+                handle.nc = None
+            self._handle = None
             self.metadata = None
-            self.nc = None
+
+    def enable_slab_cache(self, max_bytes=256 * 1024 * 1024, directory=None,
+                          disk_bytes=2 * 1024 * 1024 * 1024, version=None):
+        """
+        Keep the hyperslabs read by get_values in memory (up to max_bytes,
+        least recently used out first) and answer later requests that fall
+        inside them without reading again.  Datasets returned by the
+        restrict methods share the cache.
+
+        With a directory the slabs are also written there (up to
+        disk_bytes), so later runs against an unchanged dataset read them
+        from local disk instead.  Only local files (and aggregations of
+        them) are known to be unchanged, see dataset_version; for a DAP
+        endpoint pass a version that changes along with it (such as its
+        ETag or Last-Modified header), or no slabs are written.
+        """
+        disk = None
+        if directory is not None:
+            disk = DiskSlabCache(directory, self._filepath, max_bytes=disk_bytes, version=version)
+            if disk.version is None:
+                disk = None
+        self._slabcache = SlabCache(max_bytes=max_bytes, backing=disk)
+        return self._slabcache
+
+    def disable_slab_cache(self):
+        self._slabcache = None
+
+    def get_slab_cache(self):
+        return self._slabcache
+
+    slabcache = property(get_slab_cache, None)
+
+    def enable_coordinate_cache(self, path=None, directory=None, version=None):
+        """
+        Keep the coordinate arrays, bbox and sorted axes this dataset
+        builds in a sidecar file, and build the coordinate objects of later
+        processes from it while the dataset is unchanged (same size and
+        modification time).  The search indexes and bounding polygons are
+        rebuilt from the arrays when first needed.
+
+        The sidecar is path, or a file named after the dataset in
+        directory, or by default the dataset path plus '.coords.npz'
+        (only for local files).  As with enable_slab_cache, a DAP endpoint
+        needs a version to be cached on disk.
+        """
+        if path is None:
+            if directory is not None:
+                name = hashlib.sha1(str(self._filepath).encode('utf-8')).hexdigest()
+                path = os.path.join(directory, name + ".coords.npz")
+            elif os.path.isfile(str(self._filepath)):
+                path = str(self._filepath) + ".coords.npz"
+            else:
+                raise ValueError("A path or directory is needed to cache the coordinates of %s" % self._filepath)
+        self._coordinatecache = CoordinateCache(path, self._filepath, version=version)
+        return self._coordinatecache
+
+    def disable_coordinate_cache(self):
+        self._coordinatecache = None
+
+    def _restricted(self, attr, restrict):
+        """
+        A copy of this dataset with restrict(dataset, var, coord) added to
+        its restrictions of the attr ('time', 'z' or 'xy') coordinates.
+        Nothing is computed until a coordinate object is asked for (see
+        _coordinate), so restricting is cheap however many variables the
+        dataset holds, and chained restrictions are resolved together.
+
+        restrict must return a new object (such as the restrict method of
+        the coordinate object gives) rather than modify the one it is
+        handed, which may be shared with the dataset this one was copied
+        from.
+        """
+        new = self._copy()
+        new._restrictions = self._restrictions + [(attr, restrict)]
+        for coords in new._coordcache.values():
+            setattr(coords, attr, None)
+        return new
+
+    def _coordinate(self, var, attr, key, build, use_cache=True):
+        """
+        var's attr coordinate object for key, such as ('time', tname) or
+        ('grid', xname, yname), with the pending restrictions applied.
+        It is built and restricted once and shared by every variable using
+        those coordinate variables, and datasets restricted further from
+        this one carry on from it.
+        """
+        with self.lock:
+            if use_cache is not True:
+                return build(*key[1:])
+            coord, applied = self._coordobjects.get(key, (None, 0))
+            if coord is None:
+                coord = build(*key[1:])
+            for restriction in self._restrictions[applied:]:
+                if restriction[0] == attr:
+                    # The restriction looks up var's coordinate object as it
+                    # stands so far through the usual methods
+                    setattr(self._coordcache[var], attr, coord)
+                    coord = restriction[1](self, var, coord)
+            self._coordobjects[key] = (coord, len(self._restrictions))
+            return coord
+
+    def _restricted_coordinate(self, var, attr):
+        """
+        var's coordinate object attr ('time', 'z' or 'xy') when there are
+        restrictions of it, otherwise None (without building anything).
+        The index windows restrictions leave are looked up through here.
+        """
+        if not any(restriction[0] == attr for restriction in self._restrictions):
+            return None
+        if attr == "time":
+            return self.gettimevar(var)
+        elif attr == "z":
+            return self.getdepthvar(var)
+        return self.getgridobj(var)
+
+    def _window_or_all(self, var, attr, size):
+        """
+        The indices a restriction left on var's 'time' or 'z' coordinate,
+        or every index up to size when it is not restricted.
+        """
+        coord = self._restricted_coordinate(var, attr)
+        if coord is not None and coord.window is not None:
+            return coord.window
+        return np.arange(0, size+1)
+
+    def _new_timevar(self, name):
+        cache = self._coordinatecache
+        entry = None
+        if cache is not None:
+            entry = cache.get(("time", name))
+        if entry is not None:
+            return Timevar(self.nc, name, units=entry["units"], data=entry["data"], axis=entry["axis"])
+        timevar = Timevar(self.nc, name)
+        if cache is not None:
+            cache.put(("time", name), {"data" : np.asarray(timevar), "axis" : timevar.axis,
+                                       "units" : "%s since %s" % (timevar._units, timevar.origin.isoformat())})
+        return timevar
+
+    def _new_depthvar(self, name):
+        cache = self._coordinatecache
+        entry = None
+        if cache is not None:
+            entry = cache.get(("depth", name))
+        if entry is not None:
+            return Depthvar(self.nc, name, data=entry["data"], axis=entry["axis"])
+        depthvar = Depthvar(self.nc, name)
+        if cache is not None:
+            cache.put(("depth", name), {"data" : np.asarray(depthvar), "axis" : depthvar.axis})
+        return depthvar
+
+    def _new_gridobj(self, xname, yname):
+        cache = self._coordinatecache
+        entry = None
+        if cache is not None:
+            entry = cache.get(("grid", xname, yname))
+        if entry is not None:
+            return Gridobj(self.nc, xname, yname, **entry)
+        gridobj = Gridobj(self.nc, xname, yname)
+        if cache is not None:
+            entry = {"xarray" : gridobj._xarray, "yarray" : gridobj._yarray}
+            try:
+                entry["bbox"] = tuple(gridobj.bbox)
+            except Exception:
+                # Not defined for every kind of grid (see Gridobj.get_bbox)
+                pass
+            cache.put(("grid", xname, yname), entry)
+        return gridobj
 
     def gettimestep(self, var=None):
+        """
+        Seconds between the first two times of var, or None when there are
+        fewer than two.
+        """
         assert var in self._current_variables
         time = self.gettimevar(var)
-        return time[np.isnan(time)==False].timestep
+        return time.timestep
 
     def gettimebounds(self, var=None, **kwargs):
+        """
+        The first and last times of var, or None when a restriction left
+        none.
+        """
         assert var in self._current_variables
         time = self.gettimevar(var)
+        if time.axis[1].size == 0:
+            return None
         if "units" in kwargs:
             u = kwargs.get("units")
-            bounds = (netCDF4.num2date(np.min(time[np.isnan(time)==False]),units=u),
-                      netCDF4.num2date(np.max(time[np.isnan(time)==False]),units=u))
+            values = np.asarray(time)[time.axis[1]]
+            bounds = (netCDF4.num2date(np.min(values),units=u),
+                      netCDF4.num2date(np.max(values),units=u))
         else:
-            bounds = (np.min(time[np.isnan(time)==False].dates), np.max(time[np.isnan(time)==False].dates))
+            datenum, inds, values = time.axis
+            dt64 = time.datetime64
+            bounds = (time.datetime642date(dt64[inds[0]]), time.datetime642date(dt64[inds[-1]]))
         return bounds
 
     def getdepthbounds(self, var=None, **kwargs):
         assert var in self._current_variables
         depths = self.getdepthvar(var)
+        meters, inds, values = depths.axis
+        if inds.size == 0:
+            # A restriction left no depths
+            return None
         if "units" in kwargs:
             if kwargs["units"] == "m":
-                bounds = (np.nanmin(depths.get_m), np.nanmax(depths.get_m))
+                bounds = (np.nanmin(values), np.nanmax(values))
             else:
                 bounds = ()
         else:
-            bounds = (np.nanmin(depths), np.nanmax(depths))
+            values = np.asarray(depths)[inds]
+            bounds = (np.nanmin(values), np.nanmax(values))
         return bounds
 
     def getbbox(self, var=None, **kwargs):
@@ -337,7 +596,7 @@ class Dataset(object):
         if timevar is None:
             names = self.get_coord_names(var)
             if names['tname'] is not None:
-                timevar = Timevar(self.nc, names["tname"])
+                timevar = self._coordinate(var, "time", ("time", names["tname"]), self._new_timevar, use_cache)
             else:
                 timevar = None
             if use_cache is True:
@@ -356,7 +615,7 @@ class Dataset(object):
         if depthvar is None:
             names = self.get_coord_names(var)
             if names['zname'] is not None:
-                depthvar = Depthvar(self.nc, names["zname"])
+                depthvar = self._coordinate(var, "z", ("depth", names["zname"]), self._new_depthvar, use_cache)
             else:
                 depthvar = None
             if use_cache is True:
@@ -374,7 +633,7 @@ class Dataset(object):
         if gridobj is None:
             names = self.get_coord_names(var)
             if names['xname'] is not None and names['yname'] is not None:
-                gridobj = Gridobj(self.nc, names["xname"], names["yname"])
+                gridobj = self._coordinate(var, "xy", ("grid", names["xname"], names["yname"]), self._new_gridobj)
             else:
                 gridobj = None
             self._coordcache[var].add_xy(gridobj)
@@ -385,14 +644,22 @@ class Dataset(object):
         time = self.gettimevar(var, use_cache)
         if convert:
             bounds = netCDF4.date2num(bounds, time._units + " since " + time.origin.isoformat())
-        inds = np.where(np.logical_and(time.dates >= bounds[0].replace(tzinfo=time.dates[0].tzinfo), time.dates <= bounds[1].replace(tzinfo=time.dates[0].tzinfo)))
+            values = np.asarray(time, dtype='float64')
+        else:
+            bounds = time.date2datetime64(bounds)
+            values = time.datetime64
+        window = time.window
+        if window is None:
+            inds = np.where(np.logical_and(values >= bounds[0], values <= bounds[1]))
+        else:
+            values = values[window]
+            inds = (window[np.logical_and(values >= bounds[0], values <= bounds[1])],)
         return inds
 
     def get_zind_from_bounds(self, var, bounds, use_cache=True):
         assert var in self._current_variables
         depths = self.getdepthvar(var, use_cache)
-        inds = np.where(np.logical_and(depths >= bounds[0], depths <= bounds[1]))
-        return inds
+        return depths.bounds_index(bounds)
 
     def get_nearest_tind(self, var, point, use_cache=True):
         assert var in self._current_variables
@@ -420,10 +687,46 @@ class Dataset(object):
 
     def get_coord_names(self, var=None, **kwargs):
         assert var in self._current_variables
+        if len(kwargs) == 0:
+            return dict(self.get_coord_descriptor(var).names)
+        with self.lock:
+            return self._find_coord_names(var, **kwargs)
+
+    def get_coord_descriptor(self, var=None):
+        """
+        Coordinate names, dimensions, shape and the positions of the
+        time, z, x and y dimensions within var, resolved once per variable
+        and kept until the variable is dropped by restrict_vars.
+        """
+        assert var in self._current_variables
+        descriptor = self._descriptorcache.get(var, None)
+        if descriptor is None:
+            with self.lock:
+                ncvar = self.nc.variables[var]
+                names = self._find_coord_names(var)
+                # find how the shapes match up to var
+                # (should i use dim names or just sizes to figure out?)
+                # I'm going to use dim names
+                dims = ncvar.dimensions
+                positions = dict()
+                for i, common_name in [("tname", "time"), ("zname", "z"), ("xname", "x"), ("yname", "y")]:
+                    name = names[i]
+                    positions[common_name] = None
+                    if name is not None:
+                        positions[common_name] = []
+                        cdims = self.nc.variables[name].dimensions
+                        for cdim in cdims:
+                            if cdim in dims:
+                                positions[common_name].append(dims.index(cdim))
+                descriptor = CoordinateDescriptor(names, dims, tuple(ncvar.shape), positions)
+                self._descriptorcache[var] = descriptor
+        return descriptor
+
+    def _find_coord_names(self, var=None, **kwargs):
         ncvar = self.nc.variables[var]
         try:
             coordinates = ncvar.coordinates.split()
-        except StandardError:
+        except Exception:
             coordinates = []
         # If the coordinate names not in kwargs, then figure
         # out the remaining coordinate names
@@ -474,7 +777,7 @@ class Dataset(object):
                 for cdim in cdims:
                     try:
                         total.append(dims.index(cdim))
-                    except StandardError:
+                    except Exception:
                         pass
         total = np.unique(np.asarray(total))
 
@@ -522,7 +825,7 @@ class Dataset(object):
                     sn = self.nc.variables[var].standard_name
                     if standard_name == sn:
                         var_matches.append(var)
-                except StandardError:
+                except Exception:
                     pass
         else:
             pass
@@ -535,62 +838,38 @@ class Dataset(object):
 
     def sub_coords(self, var, zbounds=None, bbox=None, timebounds=None, zinds=None, timeinds=None):
         assert var in self._current_variables
-        ncvar = self.nc.variables[var]
         coord_dict = self.get_coord_dict(var)
-        names = self.get_coord_names(var)
-        dims = ncvar.dimensions
+        descriptor = self.get_coord_descriptor(var)
+        names = descriptor.names
         x, y, z, time = None, None, None, None
-        positions = dict()
-        for i in names:
-            name = names[i]
-            if i == "tname":
-                common_name = "time"
-            elif i == "zname":
-                common_name = "z"
-            elif i == "xname":
-                common_name = "x"
-            elif i == "yname":
-                common_name = "y"
-            else:
-                common_name = None
-            if common_name is not None:
-                positions[common_name] = None
-                if name is not None:
-                    positions[common_name] = []
-                    cdims = self.nc.variables[name].dimensions
-                    for cdim in cdims:
-                        try:
-                            positions[common_name].append(dims.index(cdim))
-                        except StandardError:
-                            pass
         if names['tname'] is not None:
             #tname = names['tname']
             if timebounds is not None:
                 timeinds = self.get_tind_from_bounds(var, timebounds)[0]
             elif timeinds is None:
-                timeinds = np.arange(0, ncvar.shape[positions["time"][0]]+1)
+                timeinds = self._window_or_all(var, "time", descriptor.size("time"))
             time = coord_dict['time'][timeinds[0]:timeinds[-1]+1]
         if names['zname'] is not None:
             #zname = names['zname']
             if zbounds is not None:
                 zinds = self.get_zind_from_bounds(var, zbounds)[0]
             elif zinds is None:
-                zinds = np.arange(0, ncvar.shape[positions["z"][0]]+1)
+                zinds = self._window_or_all(var, "z", descriptor.size("z"))
             z = coord_dict['z'][zinds[0]:zinds[-1]+1]
-        xinds, yinds = self.get_xyind_from_bbox(var, bbox)
         xy = coord_dict['xy']
+        if bbox is not None:
+            xinds, yinds = self.get_xyind_from_bbox(var, bbox)
+            xinds = xinds[0]
+            yinds = yinds[0]
+        elif xy is not None:
+            xinds = xy.xwindow
+            yinds = xy.ywindow
         if names['xname'] is not None:
             #xname = names['xname']
-            if len(xy._xarray.shape) == 2:
-                x = xy._xarray[xinds[0][0]:xinds[0][-1]+1, xinds[1][0]:xinds[1][-1]+1]
-            elif len(xy._xarray.shape) == 1:
-                x = xy._xarray[np.squeeze(xinds)]
+            x = xy._xarray[np.ix_(*xinds)]
         if names['yname'] is not None:
             #yname = names['yname']
-            if len(xy._yarray.shape) == 2:
-                y = xy._yarray[yinds[0][0]:yinds[0][-1]+1, yinds[1][0]:yinds[1][-1]+1]
-            elif len(xy._yarray.shape) == 1:
-                y = xy._yarray[np.squeeze(yinds)]
+            y = xy._yarray[np.ix_(*yinds)]
         return subs(x=x, y=y, z=z, time=time)
 
     def get_indices(self, var, zbounds=None, bbox=None, timebounds=None, zinds=None, timeinds=None,
@@ -603,130 +882,10 @@ class Dataset(object):
 
         """
         assert var in self._current_variables
-        ncvar = self.nc.variables[var]
-        names = self.get_coord_names(var)
-        # find how the shapes match up to var
-        # (should i use dim names or just sizes to figure out?)
-        # I'm going to use dim names
-        dims = ncvar.dimensions
-        positions = dict()
-        ndim = ncvar.ndim
-        for i in names:
-            name = names[i]
-            if i == "tname":
-                common_name = "time"
-            elif i == "zname":
-                common_name = "z"
-            elif i == "xname":
-                common_name = "x"
-            elif i == "yname":
-                common_name = "y"
-            else:
-                common_name = None
-            if common_name is not None:
-                positions[common_name] = None
-                if name is not None:
-                    positions[common_name] = []
-                    cdims = self.nc.variables[name].dimensions
-                    for cdim in cdims:
-                        try:
-                            positions[common_name].append(dims.index(cdim))
-                        except StandardError:
-                            pass
+        descriptor = self.get_coord_descriptor(var)
+        shape = descriptor.shape
+        positions = descriptor.positions
 
-        if positions["time"] is not None:
-            if timebounds is not None:
-                tinds = self.get_tind_from_bounds(var, timebounds)
-            else:
-                if timeinds is None:
-                    if point is not None:
-                        tinds = np.asarray([self.get_nearest_tind(var, point)])
-                    else:
-                        tinds = np.asarray([np.arange(0, ncvar.shape[positions["time"][0]]+1)])
-                else:
-                    tinds = timeinds
-        if positions["z"] is not None:
-            if zbounds is not None:
-                zinds = self.get_zind_from_bounds(var, zbounds)
-            else:
-                if zinds is None:
-                    if point is not None:
-                        zinds = np.asarray([self.get_nearest_zind(var, point)])
-                    else:
-                        zinds = np.asarray([np.arange(0, ncvar.shape[positions["z"][0]]+1)])
-                else:
-                    pass
-        if bbox is not None:
-            xinds, yinds = self.get_xyind_from_bbox(var, bbox)
-            xinds = xinds[0]
-            yinds = yinds[0]
-        else:
-            if point is not None:
-                num = kwargs.get("num", 1)
-                xinds, yinds = self.get_xyind_from_point(var, point, num=num)
-            else:
-                xinds = np.asarray([np.arange(0, ncvar.shape[pos]+1) for pos in positions["x"]])
-                yinds = np.asarray([np.arange(0, ncvar.shape[pos]+1) for pos in positions["y"]])
-
-        indices = [None for i in range(ndim)]
-        for name in positions:
-            if positions[name] is not None:
-                if name == "time":
-                    for i, position in enumerate(positions[name]):
-                        indices[position] = tinds[i]
-                elif name == "z":
-                    for i, position in enumerate(positions[name]):
-                        indices[position] = zinds[i]
-                elif name == "y":
-                    for i, position in enumerate(positions[name]):
-                        indices[position] = yinds[i]
-                elif name == "x":
-                    for i, position in enumerate(positions[name]):
-                        indices[position] = xinds[i]
-
-        return indices
-
-    def get_values(self, var, zbounds=None, bbox=None, timebounds=None, zinds=None, timeinds=None,
-                   point=None, use_local=False, **kwargs):
-        """
-
-        Get smallest chunck of data that encompasses the 4-d
-        bounding box limits of the data completely.
-
-
-        """
-        assert var in self._current_variables
-        ncvar = self.nc.variables[var]
-        names = self.get_coord_names(var)
-        # find how the shapes match up to var
-        # (should i use dim names or just sizes to figure out?)
-        # I'm going to use dim names
-        dims = ncvar.dimensions
-        ndim = ncvar.ndim
-        positions = dict()
-
-        for i in names:
-            name = names[i]
-            if i == "tname":
-                common_name = "time"
-            elif i == "zname":
-                common_name = "z"
-            elif i == "xname":
-                common_name = "x"
-            elif i == "yname":
-                common_name = "y"
-            else:
-                common_name = None
-            if common_name is not None:
-                positions[common_name] = None
-                if name is not None:
-                    positions[common_name] = []
-                    cdims = self.nc.variables[name].dimensions
-                    for cdim in cdims:
-                        try:
-                            positions[common_name].append(dims.index(cdim))
-                        except StandardError:
-                            pass
         # get t inds, z inds, xy inds
         # tinds = [[1,],]
         # zinds = [[1,],]
@@ -740,7 +899,7 @@ class Dataset(object):
                     if point is not None:
                         tinds = np.asarray([self.get_nearest_tind(var, point)])
                     else:
-                        tinds = np.asarray([np.arange(0, ncvar.shape[positions["time"][0]]+1)])
+                        tinds = [self._window_or_all(var, "time", descriptor.size("time"))]
                 else:
                     if isinstance(timeinds, list) or isinstance(timeinds, tuple):
                         tinds = np.asarray(timeinds)
@@ -756,7 +915,7 @@ class Dataset(object):
                     if point is not None:
                         zinds = np.asarray([self.get_nearest_zind(var, point)])
                     else:
-                        zinds = np.asarray([np.arange(0, ncvar.shape[positions["z"][0]]+1)])
+                        zinds = [self._window_or_all(var, "z", descriptor.size("z"))]
                 else:
                     if isinstance(zinds, list) or isinstance(zinds, tuple):
                         zinds = np.asarray(zinds)
@@ -771,16 +930,21 @@ class Dataset(object):
         else:
             if point is not None:
                 num = kwargs.get("num", 1)
-                xinds, yinds = self.get_xyind_from_point(var, point, num=num)
+                method = kwargs.get("method", "vincenty")
+                xinds, yinds = self.get_xyind_from_point(var, point, num=num, method=method)
             else:
-                xinds = np.asarray([np.arange(0, ncvar.shape[pos]+1) for pos in positions["x"]])
-                yinds = np.asarray([np.arange(0, ncvar.shape[pos]+1) for pos in positions["y"]])
-        #if len(tinds) > 0 and len(zinds) > 0 and \
-        #    len(xinds) > 0 and len(yinds) > 0:
+                grid = self._restricted_coordinate(var, "xy")
+                if grid is not None and grid._xwindow is not None:
+                    # What a restriction left
+                    xinds = list(grid._xwindow)
+                    yinds = list(grid._ywindow)
+                else:
+                    xinds = [np.arange(0, shape[pos]+1) for pos in positions["x"]]
+                    yinds = [np.arange(0, shape[pos]+1) for pos in positions["y"]]
+
         # Now take time inds, z inds, x and y inds and put them
         # into the request in the right places:
-
-        indices = [None for i in range(ndim)]
+        indices = [None for i in range(descriptor.ndim)]
         for name in positions:
             if positions[name] is not None:
                 if name == "time":
@@ -796,6 +960,25 @@ class Dataset(object):
                     for i, position in enumerate(positions[name]):
                         indices[position] = xinds[i]
 
+        return indices
+
+    def get_values(self, var, zbounds=None, bbox=None, timebounds=None, zinds=None, timeinds=None,
+                   point=None, use_local=False, **kwargs):
+        """
+
+        Get smallest chunck of data that encompasses the 4-d
+        bounding box limits of the data completely.
+
+        var may also be a list of variables, see get_many_values.
+
+        """
+        if isinstance(var, list) or isinstance(var, tuple):
+            return self.get_many_values(var, zbounds=zbounds, bbox=bbox, timebounds=timebounds,
+                                        zinds=zinds, timeinds=timeinds, point=point,
+                                        use_local=use_local, **kwargs)
+        indices = self.get_indices(var, zbounds=zbounds, bbox=bbox, timebounds=timebounds,
+                                   zinds=zinds, timeinds=timeinds, point=point, use_local=use_local, **kwargs)
+
         # logger.info("Getting data for %s with indexes: %s" % (var, str(indices)))
         if np.all([ i.size > 0 for i in indices ]):
             data = self._get_data(var, indices, use_local)
@@ -804,7 +987,269 @@ class Dataset(object):
             raise ValueError("no data inside the domian specified")
         return data
 
+    def get_many_values(self, variables, zbounds=None, bbox=None, timebounds=None, zinds=None,
+                        timeinds=None, point=None, use_local=False, workers=1, **kwargs):
+        """
+
+        get_values for several variables over the same request, returned
+        as a dict of arrays keyed by variable.  The indices are resolved
+        once per set of variables sharing coordinates (see
+        CoordinateDescriptor.key), so fetching u, v, temp and salt costs
+        about one index resolution and four reads.
+
+        workers > 1 hands the reads to that many threads.  netCDF4 and
+        HDF5 are not thread safe, so the reads take turns on the dataset's
+        lock and only the work between them runs side by side.
+
+        """
+        indices = self._shared_indices(variables, zbounds=zbounds, bbox=bbox, timebounds=timebounds,
+                                       zinds=zinds, timeinds=timeinds, point=point,
+                                       use_local=use_local, **kwargs)
+
+        def read(var):
+            return var, self._get_data(var, indices[var], use_local)
+
+        if workers > 1 and len(variables) > 1:
+            pool = ThreadPool(min(workers, len(variables)))
+            try:
+                values = pool.map(read, variables)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            values = [read(var) for var in variables]
+        return dict(values)
+
+    def _shared_indices(self, variables, **kwargs):
+        """
+        get_indices(var, **kwargs) for every variable, resolved once per
+        set of variables sharing coordinates, as a dict keyed by variable.
+        """
+        resolved = dict()
+        indices = dict()
+        for var in variables:
+            key = self.get_coord_descriptor(var).key
+            if key not in resolved:
+                resolved[key] = self.get_indices(var, **kwargs)
+            indices[var] = resolved[key]
+            if not np.all([ np.size(i) > 0 for i in indices[var] ]):
+                raise ValueError("no data inside the domian specified")
+        return indices
+
+    def get_values_at_points(self, var, lon, lat, depth=None, time=None, use_local=False, **kwargs):
+        """
+
+        Values of var at the grid node, depth level and time step nearest
+        to each of many points, as one array aligned with lon and lat.
+        depth (in the units of the depth variable) and time (datetimes)
+        are needed when var has those dimensions, as a single value or one
+        per point.
+
+        The nearest indices of all the points are found at once (see
+        Gridobj.nearest_xy_indices, Depthvar.nearest_index and
+        Timevar.nearest_index), then the points are grouped by time step
+        and depth level and each group is read with one ReadPlan.
+
+        method = geodesy for the nearest node on CGRID and ncell grids,
+            as in get_values with a point
+        positive = 'up' or 'down', the convention depth is given in
+            (see Depthvar.nearest_index)
+        time_method = 'nearest' (default) for the nearest time step, or
+            'linear' to blend the steps either side of each time (see
+            Timevar.bracket_index), reading every step needed once
+
+        """
+        assert var in self._current_variables
+        descriptor = self.get_coord_descriptor(var)
+        positions = descriptor.positions
+        lon = np.atleast_1d(np.asarray(lon, dtype='float64')).ravel()
+        lat = np.atleast_1d(np.asarray(lat, dtype='float64')).ravel()
+        count = lon.size
+        if count == 0:
+            return np.ma.masked_all((0,), dtype=self.nc.variables[var].dtype)
+
+        def per_point(inds, name):
+            inds = np.asarray(inds, dtype='int64').ravel()
+            if inds.size == 1:
+                inds = np.repeat(inds, count)
+            if inds.size != count:
+                raise ValueError("no %s inside the domain specified" % name)
+            return inds
+
+        point_inds = [None for i in range(descriptor.ndim)]
+        spatial = []
+        if positions["x"] is not None or positions["y"] is not None:
+            method = kwargs.get("method", "vincenty")
+            xinds, yinds = self.get_xyind_from_points(var, lon, lat, method=method)
+            for name, inds in [("x", xinds), ("y", yinds)]:
+                for i, position in enumerate(positions[name] or []):
+                    point_inds[position] = inds[i]
+                    spatial.append(position)
+        if positions["z"] is not None:
+            if depth is None:
+                raise ValueError("%s has a depth dimension, depths are needed" % var)
+            zinds = self.getdepthvar(var).nearest_index(depth, positive=kwargs.get("positive", None))
+            for position in positions["z"]:
+                point_inds[position] = per_point(zinds, "depth")
+        if positions["time"] is not None:
+            if time is None:
+                raise ValueError("%s has a time dimension, times are needed" % var)
+            if isinstance(time, datetime.datetime):
+                time = [time]
+            timevar = self.gettimevar(var)
+            if kwargs.get("time_method", "nearest") == "linear":
+                earlier, later, weight = timevar.bracket_index(list(time))
+                earlier, later = per_point(earlier, "time"), per_point(later, "time")
+                weight = np.resize(weight, count)
+                # Both steps of every point are read together, then blended
+                doubled = [inds if inds is None else np.concatenate((inds, inds)) for inds in point_inds]
+                for position in positions["time"]:
+                    doubled[position] = np.concatenate((earlier, later))
+                values = self._get_point_values(var, doubled, spatial, use_local)
+                return values[:count] * (1. - weight) + values[count:] * weight
+            tinds = timevar.nearest_index(list(time))
+            for position in positions["time"]:
+                point_inds[position] = per_point(tinds, "time")
+        return self._get_point_values(var, point_inds, spatial, use_local)
+
+    def _get_point_values(self, var, point_inds, spatial, use_local=False):
+        """
+        The values of var at points given by an index array per dimension
+        (point_inds), reading each distinct combination of the indices of
+        the non spatial dimensions once.
+        """
+        descriptor = self.get_coord_descriptor(var)
+        spatial = sorted(set(spatial))
+        count = 0
+        for i, inds in enumerate(point_inds):
+            if inds is None:
+                raise ValueError("can not tell where the points lie along %s of %s" % (descriptor.dims[i], var))
+            count = inds.size
+
+        # Group the points by their time step and depth level
+        keys = [i for i in range(descriptor.ndim) if i not in spatial]
+        if len(keys) > 0:
+            groups, inverse = np.unique(np.column_stack([point_inds[i] for i in keys]), axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+        else:
+            groups, inverse = np.zeros((1, 0), dtype='int64'), np.zeros(count, dtype='int64')
+        order = np.argsort(inverse, kind='mergesort')
+        starts = np.searchsorted(inverse[order], np.arange(len(groups) + 1))
+
+        values = None
+        for g, group in enumerate(groups):
+            members = order[starts[g]:starts[g+1]]
+            if members.size == 0:
+                continue
+            selection = [None for i in range(descriptor.ndim)]
+            for key, ind in zip(keys, group):
+                selection[key] = int(ind)
+            for i in spatial:
+                selection[i] = np.unique(point_inds[i][members])
+            data = self._get_data(var, selection, use_local)
+            data = data[tuple(np.searchsorted(selection[i], point_inds[i][members]) for i in spatial)]
+            if values is None:
+                values = np.ma.masked_all((count,), dtype=data.dtype)
+            values[members] = data
+        return values
+
+    def iter_values(self, var, steps=1, readahead=1, zbounds=None, bbox=None, timebounds=None,
+                    zinds=None, timeinds=None, point=None, use_local=False, **kwargs):
+        """
+
+        Iterate over what get_values would return for the same request in
+        blocks of up to 'steps' time steps, yielding (datetimes of the
+        steps, array of the block) tuples.  The next 'readahead' blocks are
+        read on a background thread while the caller works on the current
+        one (see paegan.cdm.prefetch.ReadAhead), and only those blocks are
+        held in memory, however long the time range.  The background reads
+        hold the dataset's lock, so the caller may keep reading from the
+        dataset (or its views) meanwhile.
+
+        """
+        assert var in self._current_variables
+        descriptor = self.get_coord_descriptor(var)
+        if descriptor.positions["time"] is None:
+            raise ValueError("%s has no time dimension to iterate over" % var)
+        indices = self.get_indices(var, zbounds=zbounds, bbox=bbox, timebounds=timebounds,
+                                   zinds=zinds, timeinds=timeinds, point=point, use_local=use_local, **kwargs)
+        if not np.all([ np.size(i) > 0 for i in indices ]):
+            raise ValueError("no data inside the domian specified")
+        position = descriptor.positions["time"][0]
+        tinds = np.atleast_1d(indices[position]).astype('int64')
+        tinds = tinds[tinds < descriptor.size("time")]
+        time = self.gettimevar(var)
+
+        def read(block):
+            selection = list(indices)
+            selection[position] = block
+            return self._get_data(var, selection, use_local)
+
+        blocks = [tinds[i:i+steps] for i in range(0, tinds.size, steps)]
+        for block, data in ReadAhead(read, blocks, depth=readahead):
+            yield time.datetime642date(time.datetime64[block]), data
+
+    def field_window(self, variables, ahead=2, backward=False, zbounds=None, bbox=None,
+                     timebounds=None, zinds=None, timeinds=None, use_local=False, **kwargs):
+        """
+
+        A paegan.cdm.prefetch.FieldWindow over the time steps of the
+        request (by default every step of the, possibly restricted,
+        dataset), for stepping a model through time.  window.get(tind)
+        returns a dict of the fields of the variables at time index tind,
+        over the requested bbox and depths, while the next 'ahead' steps
+        (earlier ones when backward is True) are read in the background.
+        window.steps lists the time indices in walking order.
+
+        The variables must share their time variable.  The background reads
+        hold the dataset's lock like iter_values.  Close the window when
+        done with it.
+
+        """
+        if isinstance(variables, str):
+            variables = [variables]
+        tnames = set(self.get_coord_names(var)["tname"] for var in variables)
+        if len(tnames) != 1 or None in tnames:
+            raise ValueError("the variables of a field window must share a time variable")
+        indices = self._shared_indices(variables, zbounds=zbounds, bbox=bbox, timebounds=timebounds,
+                                       zinds=zinds, timeinds=timeinds, use_local=use_local, **kwargs)
+        descriptor = self.get_coord_descriptor(variables[0])
+        tinds = np.atleast_1d(indices[variables[0]][descriptor.positions["time"][0]]).astype('int64')
+        steps = [int(t) for t in tinds if t < descriptor.size("time")]
+        if backward:
+            steps = steps[::-1]
+
+        def read(step):
+            fields = dict()
+            for var in variables:
+                selection = list(indices[var])
+                selection[self.get_coord_descriptor(var).positions["time"][0]] = step
+                fields[var] = self._get_data(var, selection, use_local)
+            return fields
+
+        return FieldWindow(read, steps, ahead=ahead)
+
     def get_values_on_grid(self, var, lon, lat, **kwargs):
+        """
+
+        Values of var interpolated to the grid lon, lat (1-D axes or 2-D
+        arrays), and to the depths z and times t when given.
+
+        method = 'nearest' (default) or 'linear' interpolate each t and z
+            slice with the weights of an InterpolationPlan from the nodes
+            to lon, lat, then along z and t (see ScatteredInterpolator).
+            The last few plans are kept, so regridding more slices of the
+            same nodes to the same lon, lat reuses them.
+            'bilinear' or 'trilinear' weight the nodes around each point
+            of a rectilinear or curvilinear grid directly, and linearly
+            along z and t (see StructuredInterpolator).  ncell grids have
+            no cells to weight, so they are interpolated with 'linear'.
+            'cubic' interpolates the scattered nodes with scipy's griddata
+            (see CfGeoInterpolator).  So do the other methods when z or t
+            are not 1-D, such as s-coordinate or sigma layer depths, with
+            'bilinear' and 'trilinear' taken as 'linear'.
+
+        """
         z = kwargs.get('z', None)
         t = kwargs.get('t', None)
         tinds = None
@@ -814,21 +1259,49 @@ class Dataset(object):
             zbounds = z
         else:
             zbounds = (np.min(np.min(np.min(np.min(z)))), np.max(np.max(np.max(np.max(z)))),)
-        if t is None:
-            tbounds = t
-        else:
-            if True:
-                tbounds = None
-                timeinds = np.arange(t[0], t[-1]+1)
-            else:
-                tbounds = (t[0], t[-1])
+        # Every time step is read, and interpolated to t afterwards
+        tbounds = None
         method = kwargs.get('method', 'nearest')
+        scattered = self._datasettype == 'ncell'
+        if scattered and method in StructuredInterpolator.methods:
+            method = 'linear'
+        if method in StructuredInterpolator.methods + ScatteredInterpolator.methods and not scattered:
+            # Read the nodes around points on the edges of the bounds too
+            grid = self.getgridobj(var)
+            xstep, ystep = _largest_step(grid._xarray), _largest_step(grid._yarray)
+            bbox = [bbox[0] - xstep, bbox[1] - ystep, bbox[2] + xstep, bbox[3] + ystep]
+            if zbounds is not None:
+                zstep = _largest_step(self.getdepthvar(var))
+                zbounds = (zbounds[0] - zstep, zbounds[1] + zstep)
         raw_vals = self.get_values(var, zbounds=zbounds, bbox=bbox,
                                    timeinds=tinds, zinds=zinds, timebounds=tbounds)
         coords_struct = self.sub_coords(var, zbounds=zbounds, bbox=bbox,
                                         timeinds=tinds, zinds=zinds, timebounds=tbounds)
-        interpolator = CfGeoInterpolator(raw_vals, coords_struct.x, coords_struct.y,
-                                         z=coords_struct.z, t=coords_struct.time, method=method)
+        # The plans and the structured weights only interpolate along 1-D
+        # z and t, so s-coordinate or sigma layer depths go to griddata
+        axes = (coords_struct.z, coords_struct.time, z, t)
+        if any(np.ndim(axis) > 1 for axis in axes if axis is not None):
+            interpolator = CfGeoInterpolator(raw_vals, coords_struct.x, coords_struct.y,
+                                             z=coords_struct.z, t=coords_struct.time,
+                                             method=_griddata_methods.get(method, method))
+            return interpolator.interpgrid(lon, lat, t=t, z=z)
+        if method in ScatteredInterpolator.methods:
+            plans = self._interpolationplans
+            key = (method, scattered, _digest(coords_struct.x, coords_struct.y, lon, lat))
+            interpolator = ScatteredInterpolator(raw_vals, coords_struct.x, coords_struct.y,
+                                                 z=coords_struct.z, t=coords_struct.time, method=method,
+                                                 plan=plans.pop(key, None), scattered=scattered)
+            values = interpolator.interpgrid(lon, lat, t=t, z=z)
+            plans[key] = interpolator.plan
+            while len(plans) > 8:
+                plans.popitem(last=False)
+            return values
+        elif method in StructuredInterpolator.methods:
+            Interpolator = StructuredInterpolator
+        else:
+            Interpolator = CfGeoInterpolator
+        interpolator = Interpolator(raw_vals, coords_struct.x, coords_struct.y,
+                                    z=coords_struct.z, t=coords_struct.time, method=method)
         return interpolator.interpgrid(lon, lat, t=t, z=z)
 
     def _get_data(self, var, **kwargs):
@@ -856,14 +1329,10 @@ class Dataset(object):
     def restrict_time(self, times = None):
         assert times is not None
         assert len(times) == 2
-        new = self._copy()
-        for var in new._current_variables:
-            time_dimension = new.gettimevar(var)
-            if time_dimension is not None:
-                inds = new.get_tind_from_bounds(var, times)
-                time_dimension = _sub_by_nan(time_dimension, inds[0][0])
-                new._coordcache[var].t = time_dimension
-        return new
+        def restrict(ds, var, time_dimension):
+            inds = ds.get_tind_from_bounds(var, times)
+            return time_dimension.restrict(inds[0])
+        return self._restricted("time", restrict)
 
     def restrict_vars(self, varlist = None):
         assert varlist is not None
@@ -872,50 +1341,39 @@ class Dataset(object):
         if type(varlist) == str:
             varlist = (varlist,)
         for var in new._current_variables:
-            coord_names = coord_names + new.get_coord_names(var).values()
+            coord_names = coord_names + list(new.get_coord_names(var).values())
         for var in self._current_variables:
             if (not var in set(varlist)) and (not var in set(coord_names)):
                 new._current_variables.remove(var)
+                new._descriptorcache.pop(var, None)
         return new
 
     def restrict_depth(self, depths = None):
         assert depths is not None
         assert len(depths) == 2
-        new = self._copy()
-        for var in new._current_variables:
-            depth_dimension = new.getdepthvar(var)
-            if depth_dimension is not None:
-                inds = new.get_zind_from_bounds(var, depths)
-                depth_dimension = _sub_by_nan(depth_dimension, inds[0])
-                new._coordcache[var].z = depth_dimension
-        return new
+        def restrict(ds, var, depth_dimension):
+            inds = ds.get_zind_from_bounds(var, depths)
+            return depth_dimension.restrict(inds[0])
+        return self._restricted("z", restrict)
 
     def nearest_point(self, point):
         raise NotImplementedError
 
     def nearest_depth(self, depth):
-        new = self._copy()
         if type(depth) != Location4D:
             depth = Location4D(depth=depth, latitude=0, longitude=0)
-        for var in self._current_variables:
-            depth_dimension = new.getdepthvar(var)
-            if depth_dimension is not None:
-                ind = new.get_nearest_zind(var, depth)
-                depth_dimension = _sub_by_nan(depth_dimension, ind)
-                new._coordcache[var].z = depth_dimension
-        return new
+        def restrict(ds, var, depth_dimension):
+            ind = ds.get_nearest_zind(var, depth)
+            return depth_dimension.restrict(ind)
+        return self._restricted("z", restrict)
 
     def nearest_time(self, time):
-        new = self._copy()
         if type(time) != Location4D:
             time = Location4D(time=time, latitude=0, longitude=0)
-        for var in self._current_variables:
-            time_dimension = new.gettimevar(var)
-            if time_dimension is not None:
-                ind = new.get_nearest_tind(var, time)
-                time_dimension = _sub_by_nan(time_dimension, ind)
-                new._coordcache[var].t = time_dimension
-        return new
+        def restrict(ds, var, time_dimension):
+            ind = ds.get_nearest_tind(var, time)
+            return time_dimension.restrict(ind)
+        return self._restricted("time", restrict)
 
     def save_as_grid(self, filename, lon, lat, **kwargs):
         pass
@@ -26,44 +26,152 @@ class Depthvar(np.ndarray):
     def __new__(self, ncfile, name, units=None, **kwargs):
         if type(ncfile) is str:
             ncfile = netCDF4.Dataset(ncfile)
-        self._nc = ncfile
 
-        data = self._nc.variables[name][:]
+        if kwargs.get('data', None) is not None:
+            # Values already read, see Dataset.getdepthvar
+            data = np.asarray(kwargs['data'])
+        else:
+            data = ncfile.variables[name][:]
         if units == None:
             try:
-                self._units = self._nc.variables[name].units
-            except StandardError:
-                self._units = 'meters'
-        else:
-            self._units = units
+                units = ncfile.variables[name].units
+            except Exception:
+                units = 'meters'
+
+        positive = getattr(ncfile.variables[name], 'positive', None)
+        if positive is not None:
+            positive = positive.lower()
 
         # compatibility to CF convention v1.0/udunits names:
-        if self._units in ['m','meter','meters from the sea surface']:
-            self._units='meters'
-        if self._units in ['cm','centimeter']:
-            self._units='centimeters'
-        if self._units in ['mm','millimeter']:
-            self._units='millimeters'
-        if self._units in ['km','kilometer']:
-            self._units='kilometers'
-        if self._units in ['ft','feets']:
-            self._units='feet'
-        if self._units in ['yd','yard']:
-            self._units='yards'
-        if self._units in ['mile']:
-            self._units='miles'
-
-        return data.view(self)
-
-    def nearest_index(self, depth):
-        return np.where(abs(self.meters-depth) == np.nanmin(abs(self.meters-depth)))[0]
+        if units in ['m','meter','meters from the sea surface']:
+            units='meters'
+        if units in ['cm','centimeter']:
+            units='centimeters'
+        if units in ['mm','millimeter']:
+            units='millimeters'
+        if units in ['km','kilometer']:
+            units='kilometers'
+        if units in ['ft','feets']:
+            units='feet'
+        if units in ['yd','yard']:
+            units='yards'
+        if units in ['mile']:
+            units='miles'
+
+        # Set on the instance, every Depthvar has its own units and positive
+        depthvar = data.view(self)
+        depthvar._nc = ncfile
+        depthvar._units = units
+        depthvar._positive = positive
+        if kwargs.get('axis', None) is not None:
+            depthvar._axis = kwargs['axis']
+        return depthvar
+
+    def __array_finalize__(self, obj):
+        # Views and slices keep the units and positive of what they came from
+        attrs = getattr(obj, '__dict__', None) or {}
+        for attr in ('_nc', '_units', '_positive'):
+            if attr in attrs:
+                self.__dict__[attr] = attrs[attr]
+
+    def get_axis(self):
+        """
+        Depths in meters, computed once per Depthvar and cached.
+
+        Returns a tuple of (meters of every level, indices of the non NaN
+        levels within the window in ascending order, meters of those levels
+        in ascending order).  Call reset_axis after modifying the values in
+        place.
+        """
+        axis = self.__dict__.get('_axis', None)
+        if axis is None:
+            meters = np.asarray(self.get_m(), dtype='float64')
+            valid = self.window
+            if valid is None:
+                valid = np.arange(meters.size)
+            valid = valid[np.isfinite(meters[valid])]
+            order = np.argsort(meters[valid], kind='mergesort')
+            axis = (meters, valid[order], meters[valid][order])
+            self._axis = axis
+        return axis
+
+    def reset_axis(self):
+        self.__dict__.pop('_axis', None)
+
+    def get_window(self):
+        """
+        Sorted indices of the levels this Depthvar was restricted to, or
+        None when it is not restricted.
+        """
+        return self.__dict__.get('_window', None)
+
+    def restrict(self, inds):
+        """
+        A Depthvar over the same values restricted to the levels inds
+        (within any window this one already has).  Only the window of
+        indices is stored, the values are shared and never masked.
+        """
+        window = np.unique(np.asarray(inds, dtype='int64').ravel())
+        if self.window is not None:
+            window = np.intersect1d(self.window, window)
+        meters, inds, values = self.axis
+        keep = np.isin(inds, window)
+        depthvar = self.view()
+        depthvar._window = window
+        depthvar._axis = (meters, inds[keep], values[keep])
+        return depthvar
+
+    def _to_axis(self, depth, positive):
+        """
+        Depths given with the 'up' or 'down' convention of positive,
+        expressed with the convention of this variable.
+        """
+        depth = np.asarray(depth, dtype='float64')
+        if positive is not None and self._positive is not None and positive.lower() != self._positive:
+            depth = -depth
+        return depth
+
+    def nearest_index(self, depth, positive=None):
+        """
+        Index of the level nearest to each depth (in meters), found with a
+        binary search of the cached levels.  depth may be a single value or
+        an array.  If positive ('up' or 'down') is given and the variable
+        has a positive attribute, depths are flipped to the variable's
+        convention first.
+
+        Returns an array with one index per depth.
+        """
+        depth = np.atleast_1d(self._to_axis(depth, positive))
+        meters, inds, values = self.axis
+        if values.size == 0:
+            return np.zeros(depth.shape, dtype='int64')[:0]
+        last = values.size - 1
+        right = np.clip(np.searchsorted(values, depth, side='left'), 0, last)
+        left = np.clip(right - 1, 0, last)
+        pick = np.where(np.abs(depth - values[left]) <= np.abs(values[right] - depth), left, right)
+        return inds[pick]
+
+    def bounds_index(self, bounds, positive=None):
+        """
+        Indices of the levels between the two bounds (inclusive, in the
+        units of the variable), found with binary searches of the cached
+        levels.  positive works the same as in nearest_index.
+
+        Returns a tuple like np.where does.
+        """
+        fac = self._unit2meters[self._units] * self._meters2unit['meters']
+        lower, upper = np.sort(self._to_axis(bounds, positive)) * fac
+        meters, inds, values = self.axis
+        start = np.searchsorted(values, lower, side='left')
+        stop = np.searchsorted(values, upper, side='right')
+        return (np.sort(inds[start:stop]),)
 
     def nearest(self, depth):
         """
         find nearest depth,
         input and output are meters
         """
-        return self.meters[self.nearest_index(depth)][0]
+        return self.axis[0][self.nearest_index(depth)][0]
 
     def get_mm(self):
         fac = self._unit2meters[self._units] * self._meters2unit['millimeters']
@@ -85,3 +193,5 @@ class Depthvar(np.ndarray):
     kilometers = property(get_km, None, doc="kilometers")
     centimeters = property(get_cm, None, doc="centimeters")
     millimeters = property(get_mm, None, doc="millimeters")
+    axis = property(get_axis, None, doc="cached sorted levels in meters")
+    window = property(get_window, None, doc="indices of the levels restricted to")
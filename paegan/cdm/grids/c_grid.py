@@ -1,8 +1,8 @@
-import copy
-
 import numpy as np
 
-from paegan.cdm.dataset import Dataset, _sub_by_nan2
+from paegan.cdm import readplan
+from paegan.cdm.dataset import Dataset
+from paegan.location4d import Location4D
 
 
 class CGridDataset(Dataset):
@@ -14,36 +14,20 @@ class CGridDataset(Dataset):
     def __init__(self, *args,**kwargs):
         super(CGridDataset,self).__init__(*args, **kwargs)
 
-    def _copy(self):
-        new = CGridDataset(self._filepath, self._datasettype)
-        new._coordcache = copy.copy(self._coordcache)
-        new._current_variables = copy.copy(self._current_variables)
-        return new
-
     def restrict_bbox(self, bbox = None, **kwargs):
         assert bbox != None
         assert len(bbox) == 4
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                inds, inds = new.get_xyind_from_bbox(var, bbox)
-                grid._xarray = _sub_by_nan2(grid._xarray, inds)
-                grid._yarray = _sub_by_nan2(grid._yarray, inds)
-                new._coordcache[var].xy = grid
-        return new
+        def restrict(ds, var, grid):
+            inds, inds = ds.get_xyind_from_bbox(var, bbox)
+            return grid.restrict(inds[0], inds[0])
+        return self._restricted("xy", restrict)
 
     def nearest_point(self, point):
         assert type(point) == Location4D
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                inds, inds = new.get_xyind_from_point(var, point)
-                grid._xarray = _sub_by_nan2(grid._xarray, inds)
-                grid._yarray = _sub_by_nan2(grid._yarray, inds)
-                new._coordcache[var].xy = grid
-        return new
+        def restrict(ds, var, grid):
+            inds, inds = ds.get_xyind_from_point(var, point)
+            return grid.restrict(inds, inds)
+        return self._restricted("xy", restrict)
 
     def get_xyind_from_bbox(self, var, bbox, **kwargs):
         grid = self.getgridobj(var)
@@ -54,36 +38,31 @@ class CGridDataset(Dataset):
         mincol = np.min(inds[1])
         maxrow = np.max(inds[0])
         maxcol = np.max(inds[1])
-        inds = (np.arange(minrow, maxrow+1), np.arange(mincol, maxcol+1))
+        inds = [(np.arange(minrow, maxrow+1), np.arange(mincol, maxcol+1))]
         return inds, inds #xinds, yinds
 
     def get_xyind_from_point(self, var, point, **kwargs):
         grid = self.getgridobj(var)
         num = kwargs.get("num", None)
-        indexr, indexc = grid.near_xy(point=point, num=num)
-        inds = indexc, indexr
+        method = kwargs.get("method", "vincenty")
+        indexr, indexc = grid.near_xy(point=point, num=num, method=method)
+        inds = indexr, indexc
         return inds, inds
 
+    def get_xyind_from_points(self, var, lon, lat, **kwargs):
+        grid = self.getgridobj(var)
+        method = kwargs.get("method", "vincenty")
+        return grid.nearest_xy_indices(lon, lat, method=method)
+
     def _get_data(self, var, indarray, use_local=False):
-        ndims = len(indarray)
+        cache, name = None, None
         if use_local == False:
+            cache = self._slabcache
+            name = var
             var = self.nc.variables[var]
         else:
             pass
 
-        if ndims == 1:
-            data = var[indarray]
-        elif ndims == 2:
-            data = var[indarray[0], indarray[1]]
-        elif ndims == 3:
-            data = var[indarray[0], indarray[1], indarray[2]]
-        elif ndims == 4:
-            data = var[indarray[0], indarray[1], indarray[2],
-                       indarray[3]]
-        elif ndims == 5:
-            data = var[indarray[0], indarray[1], indarray[2],
-                       indarray[3], indarray[4]]
-        elif ndims == 6:
-            data = var[indarray[0], indarray[1], indarray[2],
-                       indarray[3], indarray[4], indarray[5]]
+        with self.lock:
+            data = readplan.read(var, indarray, cache=cache, name=name)
         return data
@@ -1,8 +1,8 @@
-import copy
-
 import numpy as np
 
-from paegan.cdm.dataset import Dataset, _sub_by_nan
+from paegan.cdm import readplan
+from paegan.cdm.dataset import Dataset
+from paegan.location4d import Location4D
 
 
 class NCellDataset(Dataset):
@@ -17,72 +17,48 @@ class NCellDataset(Dataset):
             self._is_topology = True
             self.topology_var_name = None
 
-    def _copy(self):
-        new = NCellDataset(self._filepath, self._datasettype)
-        new._coordcache = copy.copy(self._coordcache)
-        new._current_variables = copy.copy(self._current_variables)
-        return new
-
     def restrict_bbox(self, bbox = None, **kwargs):
         assert bbox != None
         assert len(bbox) == 4
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                inds, inds =  new.get_xyind_from_bbox(var, bbox)
-                grid._xarray = _sub_by_nan(grid._xarray, inds[0][0])
-                grid._yarray = _sub_by_nan(grid._yarray, inds[0][0])
-                new._coordcache[var].xy = grid
-        return new
+        def restrict(ds, var, grid):
+            inds, inds =  ds.get_xyind_from_bbox(var, bbox)
+            return grid.restrict(inds[0], inds[0])
+        return self._restricted("xy", restrict)
 
     def nearest_point(self, point):
         assert type(point) == Location4D
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                inds, inds = new.get_xyind_from_point(var, point)
-                grid._xarray = _sub_by_nan(grid._xarray, inds)
-                grid._yarray = _sub_by_nan(grid._yarray, inds)
-                new._coordcache[var].xy = grid
-        return new
+        def restrict(ds, var, grid):
+            inds, inds = ds.get_xyind_from_point(var, point)
+            return grid.restrict(inds, inds)
+        return self._restricted("xy", restrict)
 
     def get_xyind_from_bbox(self, var, bbox):
         grid = self.getgridobj(var)
         xbool = grid.get_xbool_from_bbox(bbox)
         ybool = grid.get_ybool_from_bbox(bbox)
-        inds = np.where(np.logical_and(xbool, ybool))
+        inds = [np.where(np.logical_and(xbool, ybool))]
         return inds, inds #xinds, yinds
 
     def get_xyind_from_point(self, var, point, **kwargs):
         num = kwargs.get("num", 1)
+        method = kwargs.get("method", "vincenty")
         grid = self.getgridobj(var)
-        inds, inds = grid.near_xy(point=point, num=num, ncell=True)
+        inds, inds = grid.near_xy(point=point, num=num, ncell=True, method=method)
         return inds, inds
 
+    def get_xyind_from_points(self, var, lon, lat, **kwargs):
+        grid = self.getgridobj(var)
+        method = kwargs.get("method", "vincenty")
+        return grid.nearest_xy_indices(lon, lat, method=method, ncell=True)
+
     def _get_data(self, var, indarray, use_local=False):
-        ndims = len(indarray)
+        cache, name = None, None
         if use_local == False:
+            cache = self._slabcache
+            name = var
             var =    self.nc.variables[var]
         else:
             pass
-        if ndims == 1:
-            data = var[:]
-            data = data[indarray]
-        elif ndims == 2:
-            data = var[:]
-            data = data[indarray[0], indarray[1]]
-        elif ndims == 3:
-            data = var[indarray[0], indarray[1], :]
-            data = data[:, :, indarray[2]]
-        elif ndims == 4:
-            data = var[indarray[0], indarray[1], indarray[2],
-                       indarray[3]]
-        elif ndims == 5:
-            data = var[indarray[0], indarray[1], indarray[2],
-                       indarray[3], indarray[4]]
-        elif ndims == 6:
-            data = var[indarray[0], indarray[1], indarray[2],
-                       indarray[3], indarray[4], indarray[5]]
+        with self.lock:
+            data = readplan.read(var, indarray, cache=cache, name=name)
         return data
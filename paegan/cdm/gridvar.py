@@ -1,13 +1,92 @@
+import copy
 import numpy as np
 import netCDF4
+from scipy.spatial import cKDTree
 from paegan.utils.asagreatcircle import AsaGreatCircle
 from paegan.location4d import Location4D
+from paegan.utils.asainterpolate import walk_cells
 from shapely.geometry import MultiLineString, LineString
 from shapely.ops import polygonize
 
+# Ellipsoidal distances differ from distances on the unit sphere by well
+# under this fraction, so any node that could be the ellipsoidal nearest
+# lies within (1 + _candidate_tolerance) of the spherical nearest.
+_candidate_tolerance = 0.01
+
+# Distances by the cheap AsaGreatCircle methods are within 0.8% of
+# 'vincenty', so two nodes can only swap places when their cheap distances
+# are within twice that of each other.
+_method_tolerance = 0.02
+
+def _great_distance(node_lats, node_lons, lat, lon, method='vincenty', num=1):
+    """
+        Distance from lat/lon to each node (broadcast against each other,
+        the nodes along the last axis) measured with method.  The cheap
+        methods only rank the nodes: those that could be among the num
+        nearest are measured again with 'vincenty', the others are
+        infinitely far.
+    """
+    node_lats, node_lons, lat, lon = np.broadcast_arrays(node_lats, node_lons, lat, lon)
+    distance = AsaGreatCircle.great_distance(start_lats=node_lats, start_lons=node_lons,
+                                             end_lats=lat, end_lons=lon, method=method)["distance"]
+    if method == 'vincenty':
+        return distance
+    k = min(num, distance.shape[-1])
+    cutoff = np.sort(distance, axis=-1)[..., k-1:k]
+    contenders = distance <= cutoff * (1. + _method_tolerance)
+    refined = np.full(distance.shape, np.inf)
+    refined[contenders] = AsaGreatCircle.great_distance(
+        start_lats=node_lats[contenders], start_lons=node_lons[contenders],
+        end_lats=lat[contenders], end_lons=lon[contenders])["distance"]
+    return refined
+
+def _lonlat_to_xyz(lon, lat):
+    """
+        Convert decimal degree longitudes and latitudes to cartesian
+        coordinates on the unit sphere, as an (n, 3) array.
+    """
+    lon = np.radians(np.asarray(lon, dtype='float64'))
+    lat = np.radians(np.asarray(lat, dtype='float64'))
+    coslat = np.cos(lat)
+    return np.column_stack((coslat * np.cos(lon), coslat * np.sin(lon), np.sin(lat)))
+
+def _windowed(array, window):
+    """
+        The part of array inside window (a tuple of index arrays, one per
+        axis, or None for all of it).
+    """
+    if window is None:
+        return array
+    return array[np.ix_(*window)]
+
+def _nearest_on_axis(values, targets):
+    """
+        Position in the 1-D values of the value nearest to each target,
+        found with binary searches of the sorted (non NaN) values.
+    """
+    valid = np.where(np.isfinite(values))[0]
+    order = valid[np.argsort(values[valid], kind='mergesort')]
+    ordered = values[order]
+    last = ordered.size - 1
+    right = np.clip(np.searchsorted(ordered, targets, side='left'), 0, last)
+    left = np.clip(right - 1, 0, last)
+    pick = np.where(np.abs(targets - ordered[left]) <= np.abs(ordered[right] - targets), left, right)
+    return order[pick]
+
+def _intersect_window(window, inds):
+    inds = tuple(np.unique(np.asarray(i, dtype='int64').ravel()) for i in inds)
+    if window is None:
+        return inds
+    return tuple(np.intersect1d(w, i) for w, i in zip(window, inds))
+
 class Gridobj:
     def __init__(self, nc, xname=None, yname=None,
         xunits=None, yunits=None, projected=False, **kwargs):
+        """
+            The x and y arrays are read from nc, unless they are passed in
+            already read as xarray and yarray (with the spatialindex, bbox
+            and boundingpolygon derived from them, if known).
+        """
         self._projected = projected
         if type(nc) is str:
             nc = netCDF4.Dataset(nc)
@@ -15,11 +94,22 @@ class Gridobj:
         self._nc = nc
         self._xname = xname
         self._yname = yname
-        self._ndim = self._nc.variables[self._xname].ndim
         self._ymesh = None
         self._xmesh = None
         self._type = None
+        self._xwindow = None
+        self._ywindow = None
+        self._spatialindex = kwargs.get("spatialindex", None)
+        self._bbox = kwargs.get("bbox", None)
+        self._boundingpolygon = kwargs.get("boundingpolygon", None)
 
+        if kwargs.get("xarray", None) is not None:
+            self._xarray = np.asarray(kwargs["xarray"])
+            self._yarray = np.asarray(kwargs["yarray"])
+            self._ndim = self._xarray.ndim
+            return
+
+        self._ndim = self._nc.variables[self._xname].ndim
         if self._xname != None:
             self._x_nc = self._nc.variables[self._xname]
             self._xarray = np.asarray(self._x_nc[:])
@@ -36,13 +126,19 @@ class Gridobj:
             self._yarray = np.asarray((),)
 
 
+    def _bool_in_window(self, array, window, lower, upper):
+        if window is None:
+            return np.logical_and(array<=upper, array>=lower)
+        inside = np.zeros(array.shape, dtype=bool)
+        values = _windowed(array, window)
+        inside[np.ix_(*window)] = np.logical_and(values<=upper, values>=lower)
+        return inside
+
     def get_xbool_from_bbox(self, bbox):
-        return np.logical_and(self._xarray<=bbox[2],
-                              self._xarray>=bbox[0])
+        return self._bool_in_window(self._xarray, self._xwindow, bbox[0], bbox[2])
 
     def get_ybool_from_bbox(self, bbox):
-        return np.logical_and(self._yarray<=bbox[3],
-                              self._yarray>=bbox[1])
+        return self._bool_in_window(self._yarray, self._ywindow, bbox[1], bbox[3])
 
     def getydata(self):
         pass
@@ -57,27 +153,30 @@ class Gridobj:
         pass
 
     def get_xmax(self):
-        return np.nanmax(np.nanmax(self._xarray))
+        return np.nanmax(np.nanmax(_windowed(self._xarray, self._xwindow)))
 
     def get_ymax(self):
-        return np.nanmax(np.nanmax(self._yarray))
+        return np.nanmax(np.nanmax(_windowed(self._yarray, self._ywindow)))
 
     def get_xmin(self):
-        return np.nanmin(np.nanmin(self._xarray))
+        return np.nanmin(np.nanmin(_windowed(self._xarray, self._xwindow)))
 
     def get_ymin(self):
-        return np.nanmin(np.nanmin(self._yarray))
+        return np.nanmin(np.nanmin(_windowed(self._yarray, self._ywindow)))
 
     def get_bbox(self):
         """
             TODO: Implement ncell bbox
         """
+        if self._bbox is not None:
+            return self._bbox
+        x = _windowed(self._xarray, self._xwindow)
         if self._ndim == 2:
-            xtmp = self._xarray[np.isnan(self._xarray)==False]
-            bbox = np.nanmin(self._xarray[:,0]), self.ymin, np.nanmax(self._xarray[:,-1]), self.ymax
+            bbox = np.nanmin(x[:,0]), self.ymin, np.nanmax(x[:,-1]), self.ymax
         else:
-            xtmp = self._xarray[np.isnan(self._xarray)==False]
+            xtmp = x[np.isnan(x)==False]
             bbox = xtmp[0], self.ymin, xtmp[-1], self.ymax
+        self._bbox = bbox
         return bbox
 
     def get_boundingpolygon(self):
@@ -91,26 +190,31 @@ class Gridobj:
             |         |
             x----1-----
         """
+        if self._boundingpolygon is not None:
+            return self._boundingpolygon
 
+        x = _windowed(self._xarray, self._xwindow)
+        y = _windowed(self._yarray, self._ywindow)
         if self._ndim == 2: # CGRID
-            nx,ny = self._xarray.shape
-            one = MultiLineString([((self._xarray[i][0],self._yarray[i][0]),(self._xarray[i+1][0],self._yarray[i+1][0])) for i in range(nx-1)])
-            two = MultiLineString([((self._xarray[nx-1][j],self._yarray[nx-1][j]),(self._xarray[nx-1][j+1],self._yarray[nx-1][j+1])) for j in range(ny-1)])
-            three = MultiLineString([((self._xarray[i][ny-1],self._yarray[i][ny-1]),(self._xarray[i-1][ny-1],self._yarray[i-1][ny-1])) for i in reversed(range(1,nx))])
-            four = MultiLineString([((self._xarray[0][j],self._yarray[0][j]),(self._xarray[0][j-1],self._yarray[0][j-1])) for j in reversed(range(1,ny))])
+            nx,ny = x.shape
+            one = MultiLineString([((x[i][0],y[i][0]),(x[i+1][0],y[i+1][0])) for i in range(nx-1)])
+            two = MultiLineString([((x[nx-1][j],y[nx-1][j]),(x[nx-1][j+1],y[nx-1][j+1])) for j in range(ny-1)])
+            three = MultiLineString([((x[i][ny-1],y[i][ny-1]),(x[i-1][ny-1],y[i-1][ny-1])) for i in reversed(range(1,nx))])
+            four = MultiLineString([((x[0][j],y[0][j]),(x[0][j-1],y[0][j-1])) for j in reversed(range(1,ny))])
             m = one.union(two).union(three).union(four)
         else: # RGRID
-            nx,ny = self._xarray.shape[0], self._yarray.shape[0]
-            one = LineString([(self._xarray[i], self._yarray[0]) for i in range(nx)])
-            two = LineString([(self._xarray[-1], self._yarray[i]) for i in range(ny)])
-            three = LineString([(self._xarray[i], self._yarray[-1]) for i in reversed(range(nx))])
-            four = LineString([(self._xarray[0], self._yarray[i]) for i in reversed(range(ny))])
+            nx,ny = x.shape[0], y.shape[0]
+            one = LineString([(x[i], y[0]) for i in range(nx)])
+            two = LineString([(x[-1], y[i]) for i in range(ny)])
+            three = LineString([(x[i], y[-1]) for i in reversed(range(nx))])
+            four = LineString([(x[0], y[i]) for i in reversed(range(ny))])
             m = MultiLineString([one,two,three,four])
 
         polygons = list(polygonize(m))
         # -- polygonize returns a list of polygons, including interior features, the largest in area "should" be the full feature
         assert len(polygons) > 0, "Could not determine a polygon"
         polygon = sorted(polygons, key=lambda x: x.area)[-1]
+        self._boundingpolygon = polygon
         return polygon
 
     def get_projectedbool(self):
@@ -119,23 +223,229 @@ class Gridobj:
     def get_xunits(self):
         try:
             units = self._nc.variables[self._xname].units
-        except StandardError:
+        except Exception:
             units = None
         return units
 
     def get_yunits(self):
         try:
             units = self._nc.variables[self._yname].units
-        except StandardError:
+        except Exception:
             units = None
         return units
 
     def bbox_to_wkt(self):
         pass
 
+    def get_xwindow(self):
+        """
+            Index arrays, one per axis of _xarray, of the part of the grid
+            this Gridobj was restricted to (all of it when not restricted).
+        """
+        if self._xwindow is None:
+            return tuple(np.arange(n) for n in self._xarray.shape)
+        return self._xwindow
+
+    def get_ywindow(self):
+        if self._ywindow is None:
+            return tuple(np.arange(n) for n in self._yarray.shape)
+        return self._ywindow
+
+    def restrict(self, xinds, yinds):
+        """
+            A Gridobj sharing this one's x and y arrays, restricted to the
+            index windows xinds and yinds (sequences with one index array
+            per axis of _xarray and _yarray) within any window this one
+            already has.  Nothing is copied or masked; the bbox, bounding
+            polygon, spatial index and nearest lookups only consider the
+            nodes inside the windows.
+        """
+        new = copy.copy(self)
+        new._xwindow = _intersect_window(self._xwindow, xinds)
+        new._ywindow = _intersect_window(self._ywindow, yinds)
+        new.reset_spatialindex()
+        return new
+
+    def get_spatialindex(self):
+        """
+            KD-tree over the unit sphere positions of the (non NaN) grid
+            nodes inside the window, for grids where _xarray and _yarray are the same shape
+            (CGRID and ncell).  It is built on first use and reused until
+            reset_spatialindex is called.
+
+            Returns a tuple of (tree, flat indices of the indexed nodes)
+        """
+        if self._spatialindex is None:
+            assert self._xarray.shape == self._yarray.shape
+            x = np.asarray(self._xarray, dtype='float64').ravel()
+            y = np.asarray(self._yarray, dtype='float64').ravel()
+            if self._xwindow is None:
+                nodes = np.arange(x.size)
+            else:
+                nodes = np.ravel_multi_index(np.ix_(*self._xwindow), self._xarray.shape).ravel()
+            nodes = nodes[np.logical_and(np.isfinite(x[nodes]), np.isfinite(y[nodes]))]
+            self._spatialindex = (cKDTree(_lonlat_to_xyz(x[nodes], y[nodes])), nodes)
+        return self._spatialindex
+
+    def reset_spatialindex(self):
+        """
+            Throw away the spatial index, bbox and bounding polygon, must
+            be called whenever _xarray, _yarray or the windows are changed.
+        """
+        self._spatialindex = None
+        self._bbox = None
+        self._boundingpolygon = None
+
+    def _nearest_nodes(self, lon, lat, num=1, method='vincenty'):
+        """
+            Find the num nearest grid nodes to a point.  Candidates are
+            ranked on the sphere using the spatial index and only the few
+            that could win are measured with the AsaGreatCircle method
+            ('vincenty' for ellipsoidal distance, or one of the cheaper
+            spherical methods, whose closest candidates are then measured
+            with 'vincenty' so the result is the same).
+
+            Returns the flat indices of the nearest nodes, nearest first.
+            When num is 1, every node tied at the minimum distance is returned.
+        """
+        tree, nodes = self.spatialindex
+        if nodes.size == 0:
+            return np.asarray([], dtype='int64')
+        num = min(num, nodes.size)
+        xyz = _lonlat_to_xyz(lon, lat)[0]
+        chords, candidates = tree.query(xyz, k=num)
+        radius = np.max(chords) * (1. + _candidate_tolerance) + 1e-12
+        candidates = np.asarray(tree.query_ball_point(xyz, radius), dtype='int64')
+        candidates = nodes[candidates]
+        distance = _great_distance(self._yarray.ravel()[candidates], self._xarray.ravel()[candidates],
+                                   lat, lon, method, num)
+        if num == 1:
+            return np.sort(candidates[distance == np.min(distance)])
+        order = np.argsort(distance, kind='mergesort')
+        return candidates[order[:num]]
+
+    def _nearest_nodes_many(self, lon, lat, method='vincenty', candidates=4):
+        """
+            Flat index of the nearest grid node to each of many points.
+            The candidates closest on the sphere are found with one query
+            of the spatial index and the nearest of them is picked with the
+            AsaGreatCircle method, all points at once.  Points with more
+            nodes than that inside the radius that could win (see
+            _nearest_nodes) are searched again one by one with all of them.
+        """
+        tree, nodes = self.spatialindex
+        count = lon.size
+        if nodes.size == 0:
+            raise ValueError("no grid nodes to search")
+        k = min(candidates, nodes.size)
+        chords, nearest = tree.query(_lonlat_to_xyz(lon, lat), k=k)
+        chords = np.asarray(chords).reshape(count, k)
+        nearest = nodes[np.asarray(nearest).reshape(count, k)]
+        if k == 1:
+            winners = nearest[:, 0]
+        else:
+            distance = _great_distance(self._yarray.ravel()[nearest], self._xarray.ravel()[nearest],
+                                       lat[:, np.newaxis], lon[:, np.newaxis], method)
+            winners = nearest[np.arange(count), np.argmin(distance, axis=1)]
+        if k < nodes.size:
+            radius = chords[:, 0] * (1. + _candidate_tolerance) + 1e-12
+            for i in np.nonzero(chords[:, -1] <= radius)[0]:
+                winners[i] = self._nearest_nodes(lon[i], lat[i], method=method)[0]
+        return winners
+
+    def nearest_xy_indices(self, lon, lat, method='vincenty', ncell=False):
+        """
+            The grid node nearest to each of many lon/lat points (within the
+            windows), without looping over the points.  On CGRID and ncell
+            grids the few candidates closest on the sphere are measured
+            with method ('vincenty', 'haversine' or 'equirectangular'), on
+            grids with 1-D axes each axis is searched on its own, as
+            near_xy does.
+
+            Returns a tuple of (xinds, yinds), each a tuple with one index
+            array per axis of _xarray and _yarray, holding one index per
+            point.
+        """
+        lon = np.atleast_1d(np.asarray(lon, dtype='float64')).ravel()
+        lat = np.atleast_1d(np.asarray(lat, dtype='float64')).ravel()
+        if ncell:
+            inds = (self._nearest_nodes_many(lon, lat, method),)
+            return inds, inds
+        elif self._ndim == 2:
+            inds = np.unravel_index(self._nearest_nodes_many(lon, lat, method), self._xarray.shape)
+            return inds, inds
+        xwindow, = self.xwindow
+        ywindow, = self.ywindow
+        xinds = xwindow[_nearest_on_axis(self._xarray[xwindow], lon)]
+        yinds = ywindow[_nearest_on_axis(self._yarray[ywindow], lat)]
+        return (xinds,), (yinds,)
+
+    def locate_cells(self, lon, lat, hint=None, steps=4):
+        """
+            The cell of a CGRID (2-D x and y) holding each of many lon/lat
+            points, and the fractional position of the point inside it
+            from inverting the bilinear mapping of the cell, all points at
+            once.  Only cells within the span of the windows are used.
+
+            hint = a (rows, cols) tuple of the cell each point was last
+                found in (as returned by an earlier call, -1 for none),
+                for points that move a little between calls such as
+                particles along trajectories.  Each point walks from its
+                hint to the neighbouring cells first, up to steps cells,
+                and only points that do not find their cell that way are
+                searched for with the spatial index.
+
+            Returns a tuple of (rows, cols, row fractions, column fractions,
+            found) arrays, rows and cols being the lower left corners of
+            the cells and -1 for points outside the grid.
+        """
+        if self._ndim != 2 or self._xarray.shape != self._yarray.shape:
+            raise ValueError("cells can only be located on grids with 2-D x and y")
+        lon = np.atleast_1d(np.asarray(lon, dtype='float64')).ravel()
+        lat = np.atleast_1d(np.asarray(lat, dtype='float64')).ravel()
+        x = np.asarray(self._xarray, dtype='float64')
+        y = np.asarray(self._yarray, dtype='float64')
+        rowwindow, colwindow = self.xwindow
+        if rowwindow.size == 0 or colwindow.size == 0:
+            bounds = (0, -1, 0, -1)
+        else:
+            bounds = (rowwindow.min(), rowwindow.max() - 1, colwindow.min(), colwindow.max() - 1)
+
+        rows = np.full(lon.shape, -1, dtype='int64')
+        cols = np.full(lon.shape, -1, dtype='int64')
+        fy = np.full(lon.shape, np.nan)
+        fx = np.full(lon.shape, np.nan)
+        found = np.zeros(lon.shape, dtype=bool)
+        if hint is not None:
+            rows[:] = np.asarray(hint[0], dtype='int64').ravel()
+            cols[:] = np.asarray(hint[1], dtype='int64').ravel()
+        hinted = np.flatnonzero((rows >= 0) & (cols >= 0))
+        if hinted.size > 0:
+            result = walk_cells(x, y, lon[hinted], lat[hinted], (rows[hinted], cols[hinted]), steps, bounds)
+            for array, values in zip((rows, cols, fy, fx, found), result):
+                array[hinted] = values
+
+        # The rest start from the cell at their nearest node
+        missing = np.flatnonzero(~found)
+        tree, nodes = self.spatialindex
+        if missing.size > 0 and nodes.size > 0:
+            nearest = nodes[tree.query(_lonlat_to_xyz(lon[missing], lat[missing]))[1]]
+            start = np.unravel_index(nearest, x.shape)
+            result = walk_cells(x, y, lon[missing], lat[missing], start, steps, bounds)
+            for array, values in zip((rows, cols, fy, fx, found), result):
+                array[missing] = values
+        return rows, cols, fy, fx, found
+
     def near_xy(self, **kwargs):
         """
-            TODO: Implement ncell near_xy
+            Find the nearest grid node(s) to a point or lat/lon.  For
+            CGRID and ncell grids this uses the spatial index, so each
+            query is a tree lookup instead of a distance over every node.
+
+            method = geodesy used to pick between the closest candidates,
+                'vincenty' (default), 'haversine' or 'equirectangular'
+                (see AsaGreatCircle).  The cheap methods only narrow the
+                candidates down, the last few are measured with 'vincenty'.
         """
         point = kwargs.get("point", None)
         if point == None:
@@ -143,35 +453,33 @@ class Gridobj:
             lon = kwargs.get("lon", None)
             point = Location4D(latitude=lat, longitude=lon)
         num = kwargs.get("num", 1)
+        if num is None:
+            num = 1
+        method = kwargs.get("method", "vincenty")
         ncell = kwargs.get("ncell", False)
         if ncell:
-            if num > 1:
-                pass
-            else:
-                distance = AsaGreatCircle.great_distance(
-                    start_lats=self._yarray, start_lons=self._xarray,
-                    end_lats=point.latitude, end_lons=point.longitude)["distance"]
-                inds = np.where(distance == np.nanmin(distance))
-                xinds, yinds = inds, inds
+            inds = (self._nearest_nodes(point.longitude, point.latitude, num, method),)
+            xinds, yinds = inds, inds
         else:
             if self._ndim == 2:
-                distance = AsaGreatCircle.great_distance(
-                    start_lats=self._yarray, start_lons=self._xarray,
-                    end_lats=point.latitude, end_lons=point.longitude)["distance"]
-                yinds, xinds = np.where(distance == np.nanmin(distance))
+                nodes = self._nearest_nodes(point.longitude, point.latitude, num, method)
+                yinds, xinds = np.unravel_index(nodes, self._xarray.shape)
             else:
                 #if self._xmesh == None and self._ymesh == None:
                 #    self._xmesh, self._ymesh = np.meshgrid(self._xarray, self._yarray)
+                xwindow, = self.xwindow
+                ywindow, = self.ywindow
+                minlat = np.abs(self._yarray[ywindow] - point.latitude)
+                minlon = np.abs(self._xarray[xwindow] - point.longitude)
                 if num > 1:
-                    minlat = np.abs(self._yarray - point.latitude)
-                    minlon = np.abs(self._xarray - point.longitude)
                     lat_cutoff = np.sort(minlat)[num-1]
                     lon_cutoff = np.sort(minlon)[num-1]
                 elif num == 1:
-                    lat_cutoff = np.nanmin(np.abs(self._yarray - point.latitude))
-                    lon_cutoff = np.nanmin(np.abs(self._xarray - point.longitude))
-                yinds = np.where(np.abs(self._yarray - point.latitude) <= lat_cutoff)
-                xinds = np.where(np.abs(self._xarray - point.longitude) <= lon_cutoff)
+                    lat_cutoff = np.nanmin(minlat)
+                    lon_cutoff = np.nanmin(minlon)
+                # Back to indices of the whole axes
+                yinds = (ywindow[np.where(minlat <= lat_cutoff)[0]],)
+                xinds = (xwindow[np.where(minlon <= lon_cutoff)[0]],)
 
         return yinds, xinds
 
@@ -185,6 +493,9 @@ class Gridobj:
     boundingpolygon = property(get_boundingpolygon, None)
     xunits = property(get_xunits, None)
     yunits = property(get_yunits, None)
+    spatialindex = property(get_spatialindex, None)
+    xwindow = property(get_xwindow, None)
+    ywindow = property(get_ywindow, None)
     _findy = findy
     _findx = findx
     _getxdata = getxdata
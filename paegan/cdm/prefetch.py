@@ -0,0 +1,148 @@
+import sys
+import threading
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+class ReadAhead(object):
+    """
+        Iterates over (item, read(item)) for every item in items, calling
+        read on a background thread up to 'depth' items ahead of the
+        caller, so the next read overlaps whatever the caller does with
+        the current result.  At most depth + 1 results are held at once.
+
+        An exception raised by read is raised again from the iteration,
+        for the item that raised it.  Stopping the iteration early (or
+        calling close) stops the background thread after its current read.
+    """
+    def __init__(self, read, items, depth=1):
+        self._read = read
+        self._items = list(items)
+        self._queue = Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _work(self):
+        for item in self._items:
+            if self._stop.is_set():
+                return
+            try:
+                result = (item, self._read(item), None)
+            except Exception:
+                result = (item, None, sys.exc_info()[1])
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(result, timeout=0.1)
+                    break
+                except Full:
+                    pass
+            if result[2] is not None:
+                return
+
+    def __iter__(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+        try:
+            for i in range(len(self._items)):
+                item, result, error = self._queue.get()
+                if error is not None:
+                    raise error
+                yield item, result
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+
+class FieldWindow(object):
+    """
+        The fields read by read(step) for a sequence of time steps, kept
+        for a window that slides along with the caller: the step last
+        asked for with get and the next 'ahead' steps, which are read on
+        a background thread while the caller works.  Steps outside the
+        window are dropped, so at most ahead + 1 steps are held.
+
+        'steps' are in the order the caller walks them, so for runs
+        backward in time they are given in reverse.  get may jump to any
+        step, the window simply moves there.
+    """
+    def __init__(self, read, steps, ahead=2):
+        self._read = read
+        self.steps = list(steps)
+        self.ahead = ahead
+        self._position = dict((step, i) for i, step in enumerate(self.steps))
+        self._fields = dict()
+        self._wanted = []
+        self._reading = None
+        self._cursor = 0
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._stop and len(self._wanted) == 0:
+                    self._condition.wait()
+                if self._stop:
+                    return
+                step = self._wanted.pop(0)
+                self._reading = step
+            try:
+                result = (self._read(step), None)
+            except Exception:
+                result = (None, sys.exc_info()[1])
+            with self._condition:
+                self._reading = None
+                if self._inside(step):
+                    self._fields[step] = result
+                self._condition.notify_all()
+
+    def _inside(self, step):
+        return 0 <= self._position[step] - self._cursor <= self.ahead
+
+    def get(self, step):
+        """
+            The fields of step, read now unless they were read ahead.
+            Moves the window to step.
+        """
+        if step not in self._position:
+            raise ValueError("step %s is not one of the steps of this window" % step)
+        with self._condition:
+            if self._stop:
+                raise ValueError("the window is closed")
+            self._cursor = self._position[step]
+            for cached in list(self._fields):
+                if not self._inside(cached):
+                    del self._fields[cached]
+            window = self.steps[self._cursor:self._cursor + self.ahead + 1]
+            self._wanted = [s for s in window if s not in self._fields and s != self._reading]
+            self._condition.notify_all()
+            while step not in self._fields:
+                if self._stop:
+                    raise ValueError("the window is closed")
+                self._condition.wait()
+            fields, error = self._fields[step]
+        if error is not None:
+            with self._condition:
+                # Try again on the next get
+                self._fields.pop(step, None)
+            raise error
+        return fields
+
+    def get_cached(self):
+        with self._condition:
+            return sorted(self._fields, key=lambda step: self._position[step])
+
+    def close(self):
+        with self._condition:
+            self._stop = True
+            self._fields.clear()
+            self._condition.notify_all()
+
+    cached = property(get_cached, None, doc="steps held, in walking order")
@@ -0,0 +1,191 @@
+import itertools
+
+import numpy as np
+
+# Rough cost of issuing one more read, in bytes of data that could have
+# been transferred instead.  Small for local files, much larger for DAP.
+request_overhead = 65536
+
+def _axis_indices(ind, size):
+    """
+        Normalize the index of one axis to an integer array of in range
+        positions.  None and slices select along the axis, a scalar selects
+        one position and drops the axis.  Negative indices count from the
+        end, indices past the end are dropped (so np.arange(0, size+1)
+        selects the whole axis).
+
+        Returns a tuple of (index array, scalar).
+    """
+    if ind is None:
+        return np.arange(size), False
+    if isinstance(ind, slice):
+        return np.arange(*ind.indices(size)), False
+    if np.ndim(ind) == 0:
+        ind = int(ind)
+        if ind < 0:
+            ind += size
+        if ind < 0 or ind >= size:
+            raise IndexError("index %d is out of bounds for axis with size %d" % (ind, size))
+        return np.asarray([ind]), True
+    ind = np.asarray(ind).ravel()
+    if ind.dtype == bool:
+        return np.where(ind[:size])[0], False
+    ind = ind.astype('int64')
+    ind = np.where(ind < 0, ind + size, ind)
+    return ind[(ind >= 0) & (ind < size)], False
+
+def _runs(unique):
+    """
+        Split sorted unique indices into evenly strided runs.
+
+        Returns a list of slices, one read per slice.
+    """
+    runs = []
+    count = unique.size
+    if count == 0:
+        return runs
+    diffs = np.diff(unique)
+    # Positions in diffs where the stride changes
+    changes = np.nonzero(diffs[1:] != diffs[:-1])[0] + 1
+    i = 0
+    while i < count:
+        if i == count - 1:
+            runs.append(slice(int(unique[i]), int(unique[i]) + 1, 1))
+            break
+        step = int(diffs[i])
+        k = np.searchsorted(changes, i, side='right')
+        last = int(changes[k]) if k < changes.size else count - 1
+        if step > 1 and last - i < 2:
+            # A strided pair is no better than two single reads, and taking
+            # one leaves the next element free to start a contiguous run
+            last = i
+            step = 1
+        runs.append(slice(int(unique[i]), int(unique[last]) + 1, step))
+        i = last + 1
+    return runs
+
+class ReadPlan(object):
+    """
+        How to read the orthogonal selection 'indices' (one entry per axis,
+        as the grid datasets pass to _get_data) from a variable of 'shape'.
+
+        Every axis is reduced to its sorted unique positions and those are
+        split into evenly strided runs, so the selection can be read as
+        one hyperslab per combination of runs instead of a fancy indexed
+        read.  When that takes many small reads the plan instead reads the
+        single hyperslab bounding the selection and subsets it in memory,
+        whichever is cheaper in bytes read plus 'overhead' bytes per read.
+    """
+    def __init__(self, shape, indices, itemsize=8, overhead=None):
+        if overhead is None:
+            overhead = request_overhead
+        indices = list(indices) + [None] * (len(shape) - len(indices))
+        self.shape = tuple(shape)
+        self.indices = []
+        self.scalars = []
+        self.unique = []
+        self.inverse = []
+        self.runs = []
+        for ind, size in zip(indices, self.shape):
+            ind, scalar = _axis_indices(ind, size)
+            unique, inverse = np.unique(ind, return_inverse=True)
+            self.indices.append(ind)
+            self.scalars.append(scalar)
+            self.unique.append(unique)
+            self.inverse.append(inverse.ravel())
+            self.runs.append(_runs(unique))
+
+        self.empty = any(u.size == 0 for u in self.unique)
+        self.requests = int(np.prod([len(r) for r in self.runs]))
+        selected = np.prod([u.size for u in self.unique])
+        bounding = np.prod([u[-1] - u[0] + 1 if u.size else 0 for u in self.unique])
+        self.slab = bool(self.requests > 1 and
+                         overhead + bounding * itemsize < self.requests * overhead + selected * itemsize)
+
+    def get_output_shape(self):
+        return tuple(i.size for i, s in zip(self.indices, self.scalars) if not s)
+
+    def read(self, var):
+        """
+            Read the selection from var (a netCDF4 variable or anything
+            else that takes tuples of slices).
+        """
+        if self.empty:
+            return np.empty(self.output_shape, dtype=var.dtype)
+
+        if self.slab:
+            return self.subset(var[self.bounding_slices])
+        else:
+            blocks = []
+            for runs in itertools.product(*self.runs):
+                blocks.append((runs, var[runs]))
+            masked = any(np.ma.isMaskedArray(block) for runs, block in blocks)
+            dtype = np.result_type(*[block.dtype for runs, block in blocks])
+            ushape = tuple(u.size for u in self.unique)
+            if masked:
+                data = np.ma.masked_all(ushape, dtype=dtype)
+            else:
+                data = np.empty(ushape, dtype=dtype)
+            for runs, block in blocks:
+                # Each run covers consecutive positions of the unique indices
+                target = []
+                for u, r in zip(self.unique, runs):
+                    start = np.searchsorted(u, r.start)
+                    target.append(slice(start, start + len(range(r.start, r.stop, r.step))))
+                data[tuple(target)] = block
+            return self._reorder(data, self.inverse)
+
+    def get_bounds(self):
+        """
+            (start, stop) of the hyperslab bounding the selection, per axis.
+        """
+        return tuple((int(u[0]), int(u[-1]) + 1) for u in self.unique)
+
+    def get_bounding_slices(self):
+        return tuple(slice(start, stop) for start, stop in self.bounds)
+
+    def subset(self, slab):
+        """
+            The selection, cut in memory out of the bounding hyperslab.
+        """
+        return self._reorder(slab, [u[inv] - u[0] for u, inv in zip(self.unique, self.inverse)])
+
+    def _reorder(self, data, positions):
+        # Back to the requested order, dropping the scalar axes
+        if any(not np.array_equal(p, np.arange(n)) for p, n in zip(positions, data.shape)):
+            data = data[np.ix_(*positions)]
+        if any(self.scalars):
+            data = data[tuple(0 if s else slice(None) for s in self.scalars)]
+        return data
+
+    output_shape = property(get_output_shape, None)
+    bounds = property(get_bounds, None)
+    bounding_slices = property(get_bounding_slices, None)
+
+def read(var, indices, overhead=None, cache=None, name=None):
+    """
+        Read the orthogonal selection 'indices' from the netCDF4 variable
+        var through a ReadPlan.
+
+        With a cache (see paegan.cdm.cache) the bounding hyperslab of the
+        selection is looked up under name first, and read and stored there
+        when it is missing.
+    """
+    try:
+        itemsize = np.dtype(var.dtype).itemsize
+    except TypeError:
+        itemsize = 8
+    plan = ReadPlan(var.shape, indices, itemsize=itemsize, overhead=overhead)
+    if cache is None or plan.empty:
+        return plan.read(var)
+
+    bounds = plan.bounds
+    slab = cache.get(name, bounds)
+    if slab is None:
+        slab = var[plan.bounding_slices]
+        cache.put(name, bounds, slab)
+    data = plan.subset(slab)
+    if np.may_share_memory(data, slab):
+        # Never hand out the cached array itself
+        data = data.copy()
+    return data
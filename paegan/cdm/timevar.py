@@ -7,7 +7,6 @@
 import numpy as np
 import netCDF4, datetime
 from dateutil.parser import parse
-import bisect
 import pytz
 
 # Same basedate as matplotlib: http://matplotlib.org/api/dates_api.html#matplotlib.dates.num2date
@@ -19,6 +18,85 @@ def date2num(python_datetime):
 def num2date(indatenum, inunits, tzinfo=None):
     return np.vectorize(lambda x: x.replace(tzinfo=tzinfo))(netCDF4.num2date(indatenum, inunits, 'proleptic_gregorian'))
 
+def _standard_units(units):
+    units = units.lower()
+    # compatibility to CF convention v1.0/udunits names:
+    if units in ['second','sec','secs','s']:
+        units='seconds'
+    if units in ['min','minute','mins']:
+        units='minutes'
+    if units in ['h','hs','hr','hrs','hour']:
+        units='hours'
+    if units in ['day','d','ds']:
+        units='days'
+    return units
+
+def _utc_naive(python_datetime):
+    if python_datetime.tzinfo is not None:
+        python_datetime = python_datetime.astimezone(pytz.utc).replace(tzinfo=None)
+    return python_datetime
+
+def _char_matrix(chars):
+    """
+    A character time variable (either a 2-D array of single characters, or
+    the 1-D array of strings netCDF4 returns when it decodes one) as a
+    2-D uint8 array with one row per time step.
+    """
+    chars = np.ma.getdata(chars)
+    if chars.dtype.kind == 'U':
+        chars = np.char.encode(chars, 'ascii')
+    chars = np.ascontiguousarray(chars)
+    return chars.view('uint8').reshape(chars.shape[0], -1)
+
+def _parse_char_times(chars, units):
+    """
+    Convert a character time variable into numbers in units.
+
+    Rows laid out as YYYY-MM-DD?HH:MM:SS, with '_', 'T' or ' ' as the
+    separator (WRF Times and ISO 8601) and optionally followed by 'Z' or
+    padding, are converted all at once with array arithmetic.  Any other
+    row is parsed on its own with dateutil.
+    """
+    rows = _char_matrix(chars)
+    count, width = rows.shape
+    dt64 = np.zeros(count, dtype='datetime64[us]')
+    fast = np.zeros(count, dtype=bool)
+
+    if width >= 19:
+        digits = rows[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]].astype('int64') - ord('0')
+        fast = np.all((digits >= 0) & (digits <= 9), axis=1)
+        fast &= (rows[:, 4] == ord('-')) & (rows[:, 7] == ord('-'))
+        fast &= (rows[:, 13] == ord(':')) & (rows[:, 16] == ord(':'))
+        separator = rows[:, 10]
+        fast &= (separator == ord('_')) | (separator == ord('T')) | (separator == ord(' '))
+        tail = rows[:, 19:]
+        fast &= np.all((tail == 0) | (tail == ord(' ')) | (tail == ord('Z')), axis=1)
+
+        year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        month = digits[:, 4] * 10 + digits[:, 5]
+        day = digits[:, 6] * 10 + digits[:, 7]
+        seconds = (digits[:, 8] * 10 + digits[:, 9]) * 3600 + \
+                  (digits[:, 10] * 10 + digits[:, 11]) * 60 + \
+                  (digits[:, 12] * 10 + digits[:, 13])
+        fast &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+        fast &= (digits[:, 8] * 10 + digits[:, 9] < 24) & (digits[:, 10] < 6) & (digits[:, 12] < 6)
+
+        months = (year[fast] - 1970) * 12 + month[fast] - 1
+        days = months.astype('datetime64[M]').astype('datetime64[D]') + (day[fast] - 1).astype('timedelta64[D]')
+        # Days past the end of the month rolled over, let dateutil complain about them
+        rolled = days.astype('datetime64[M]') != months.astype('datetime64[M]')
+        dt64[fast] = days.astype('datetime64[us]') + seconds[fast].astype('timedelta64[s]')
+        fast[np.where(fast)[0][rolled]] = False
+
+    for i in np.where(~fast)[0]:
+        text = bytes(bytearray(rows[i])).decode('ascii', 'ignore').strip('\x00 ')
+        dt64[i] = np.datetime64(_utc_naive(parse(text)), 'us')
+
+    units_split = units.split(' ', 2)
+    origin = np.datetime64(_utc_naive(parse(units_split[2])), 'us')
+    factor = 1e6 * Timevar._unit2sec[_standard_units(units_split[0])]
+    return (dt64 - origin).astype('int64') / factor
+
 class Timevar(np.ndarray):
 
     _unit2sec={}
@@ -38,65 +116,218 @@ class Timevar(np.ndarray):
     def __new__(self, ncfile, name='time', units=None, tzinfo=None, **kwargs):
         if type(ncfile) is str:
             ncfile = netCDF4.Dataset(ncfile)
-        self._nc = ncfile
 
-        if self._nc.variables[name].ndim > 1:
-            _str_data = self._nc.variables[name][:,:]
+        if kwargs.get('data', None) is not None:
+            # Values already read (and converted to units), see Dataset.gettimevar
+            data = np.asarray(kwargs['data'])
+        elif ncfile.variables[name].ndim > 1:
+            _str_data = ncfile.variables[name][:,:]
             if units == None:
                 units = timevar_units
-            dates = [parse(_str_data[i, :].tostring()) for i in range(len(_str_data[:,0]))]
-            data = netCDF4.date2num(dates, units)
+            data = _parse_char_times(_str_data, units)
         else:
-            data = self._nc.variables[name][:]
+            data = ncfile.variables[name][:]
 
         if units == None:
             try:
-                self._units = self._nc.variables[name].units
-            except StandardError:
-                self._units = units
-        else:
-            self._units = units
+                units = ncfile.variables[name].units
+            except Exception:
+                pass
 
         if tzinfo == None:
-            self._tzinfo = pytz.utc
-        else:
-            self._tzinfo = tzinfo
+            tzinfo = pytz.utc
 
-
-        units_split=self._units.split(' ',2)
+        units_split=units.split(' ',2)
         assert len(units_split) == 3 and units_split[1] == 'since', \
-            'units string improperly formatted\n' + self._units
-        self.origin=parse(units_split[2])
-
-        self._units = units_split[0].lower()
+            'units string improperly formatted\n' + units
 
-        # compatibility to CF convention v1.0/udunits names:
-        if self._units in ['second','sec','secs','s']:
-            self._units='seconds'
-        if self._units in ['min','minute','mins']:
-            self._units='minutes'
-        if self._units in ['h','hs','hr','hrs','hour']:
-            self._units='hours'
-        if self._units in ['day','d','ds']:
-            self._units='days'
+        # Set on the instance, every Timevar has its own units and origin
+        timevar = data.view(self)
+        timevar._nc = ncfile
+        timevar._units = _standard_units(units_split[0])
+        timevar._tzinfo = tzinfo
+        timevar.origin = parse(units_split[2])
+        if kwargs.get('axis', None) is not None:
+            timevar._axis = kwargs['axis']
+        return timevar
 
-        return data.view(self)
+    def __array_finalize__(self, obj):
+        # Views and slices keep the units and origin of what they came from
+        attrs = getattr(obj, '__dict__', None) or {}
+        for attr in ('_nc', '_units', '_tzinfo', 'origin'):
+            if attr in attrs:
+                self.__dict__[attr] = attrs[attr]
 
     def gettimestep(self):
-        return self.seconds[1] - self.seconds[0]
+        """
+        Seconds between the first two steps (in the window), or None when
+        there are fewer than two.
+        """
+        inds = self.axis[1]
+        if inds.size < 2:
+            return None
+        seconds = self.seconds
+        return seconds[inds[1]] - seconds[inds[0]]
+
+    def get_axis(self):
+        """
+        Numeric time axis, computed once per Timevar and cached.
+
+        Returns a tuple of (datenum of every step, indices of the non NaN
+        steps within the window in time order, datenum of those steps in
+        time order).  Call reset_axis after modifying the values in place.
+        """
+        axis = self.__dict__.get('_axis', None)
+        if axis is None:
+            datenum = date2num(self.origin.replace(tzinfo=None)) + self.get_days()
+            valid = self.window
+            if valid is None:
+                valid = np.arange(datenum.size)
+            valid = valid[np.isfinite(datenum[valid])]
+            order = np.argsort(datenum[valid], kind='mergesort')
+            axis = (datenum, valid[order], datenum[valid][order])
+            self._axis = axis
+        return axis
+
+    def reset_axis(self):
+        self.__dict__.pop('_axis', None)
+        self.__dict__.pop('_datetime64', None)
+
+    def get_window(self):
+        """
+        Sorted indices of the steps this Timevar was restricted to, or None
+        when it is not restricted.
+        """
+        return self.__dict__.get('_window', None)
+
+    def restrict(self, inds):
+        """
+        A Timevar over the same values restricted to the steps inds (within
+        any window this one already has).  Only the window of indices is
+        stored, the values are shared and never masked, and lookups such
+        as nearest_index only consider the steps in the window.
+        """
+        window = np.unique(np.asarray(inds, dtype='int64').ravel())
+        if self.window is not None:
+            window = np.intersect1d(self.window, window)
+        datenum, inds, values = self.axis
+        keep = np.isin(inds, window)
+        timevar = self.view()
+        timevar._window = window
+        timevar._axis = (datenum, inds[keep], values[keep])
+        if '_datetime64' in self.__dict__:
+            timevar._datetime64 = self._datetime64
+        return timevar
+
+    def get_datetime64(self):
+        """
+        datetime64[us] of every step (NaT where the value is NaN), on the
+        same wall clock as the dates property.  Computed once and cached,
+        call reset_axis after modifying the values in place.
+
+        Microseconds, rather than nanoseconds, so that unit origins
+        such as 0001-01-01 are representable.
+        """
+        dt64 = self.__dict__.get('_datetime64', None)
+        if dt64 is None:
+            seconds = np.asarray(self, dtype='float64') * self._unit2sec[self._units]
+            valid = np.isfinite(seconds)
+            offsets = np.zeros(seconds.shape, dtype='int64')
+            offsets[valid] = np.round(seconds[valid] * 1e6).astype('int64')
+            dt64 = np.datetime64(self.origin.replace(tzinfo=None), 'us') + offsets.astype('timedelta64[us]')
+            dt64[~valid] = np.datetime64('NaT')
+            self._datetime64 = dt64
+        return dt64
+
+    def date2datetime64(self, dateo):
+        """
+        Convert a datetime (or sequence of them) to datetime64[us] on this
+        Timevar's wall clock, for comparing against the datetime64 property.
+        Timezone aware datetimes are converted to this Timevar's tzinfo.
+        """
+        def convert(d):
+            if d.tzinfo is not None:
+                d = d.astimezone(self._tzinfo)
+            return np.datetime64(d.replace(tzinfo=None), 'us')
+        if isinstance(dateo, datetime.datetime):
+            return convert(dateo)
+        return np.asarray([convert(d) for d in dateo], dtype='datetime64[us]')
+
+    def datetime642date(self, values):
+        """
+        Convert datetime64 values back to timezone aware datetime objects,
+        a single datetime for a scalar or an object array otherwise.
+        NaT values become None.
+        """
+        values = np.asarray(values, dtype='datetime64[us]')
+        if values.ndim == 0:
+            date = values.item()
+            if date is None:
+                return None
+            return date.replace(tzinfo=self._tzinfo)
+        dates = values.astype(datetime.datetime)
+        return np.asarray([d if d is None else d.replace(tzinfo=self._tzinfo) for d in dates.ravel()],
+                          dtype=object).reshape(values.shape)
 
     def nearest_index(self, dateo, select='nearest'):
-        to = date2num(dateo)
+        """
+        Index of the step 'nearest' to dateo, or the last step at or
+        'before' it, or the first step at or 'after' it.  dateo may be a
+        single datetime or a sequence of them, every target is resolved
+        with one binary search of the cached time axis.
+
+        'nearest' returns a list, 'before' and 'after' return arrays
+        holding -1 and len(self) respectively where there is no such step.
+        """
+        to = np.atleast_1d(np.asarray(date2num(dateo), dtype='float64'))
+        datenum, inds, values = self.axis
+        last = values.size - 1
+        if last < 0:
+            # Nothing in the window
+            if select == 'nearest':
+                return []
+            elif select == 'before':
+                return np.zeros(to.shape, dtype='int64') - 1
+            elif select == 'after':
+                return np.zeros(to.shape, dtype='int64') + len(self)
         if select == 'nearest':
-            try:
-                return [np.where(abs(self.datenum-t) == np.nanmin(abs(self.datenum-t)))[0][0] for t in to]
-            except TypeError:
-                return [np.where(abs(self.datenum-to) == np.nanmin(abs(self.datenum-to)))[0][0]]
+            right = np.clip(np.searchsorted(values, to, side='left'), 0, last)
+            left = np.clip(right - 1, 0, last)
+            pick = np.where(np.abs(to - values[left]) <= np.abs(values[right] - to), left, right)
+            return list(inds[pick])
         elif select == 'before':
-            try:
-                return np.asarray([bisect.bisect(self.datenum, t)-1 for t in to])
-            except TypeError:
-                return np.asarray([bisect.bisect(self.datenum, to)-1])
+            pos = np.searchsorted(values, to, side='right') - 1
+            return np.where(pos >= 0, inds[np.clip(pos, 0, last)], -1)
+        elif select == 'after':
+            pos = np.searchsorted(values, to, side='left')
+            return np.where(pos <= last, inds[np.clip(pos, 0, last)], len(self))
+
+    def bracket_index(self, dateo):
+        """
+        The steps either side of dateo (a datetime or a sequence of them)
+        and the weight of the later step for interpolating linearly in
+        time, found with binary searches of the cached time axis.  Targets
+        on a step, or outside the time range, get that step (or the first
+        or last one) as both with a weight of 0.
+
+        Returns a tuple of (earlier indices, later indices, weights) arrays.
+        """
+        to = np.atleast_1d(np.asarray(date2num(dateo), dtype='float64'))
+        datenum, inds, values = self.axis
+        if values.size == 0:
+            raise ValueError("no time steps to interpolate between")
+        last = values.size - 1
+        right = np.clip(np.searchsorted(values, to, side='right'), 1, max(last, 1))
+        right = np.minimum(right, last)
+        left = np.maximum(right - 1, 0)
+        span = values[right] - values[left]
+        weight = np.zeros(to.shape, dtype='float64')
+        np.divide(to - values[left], span, out=weight, where=span > 0)
+        weight = np.clip(weight, 0., 1.)
+        left = np.where(weight >= 1., right, left)
+        right = np.where(weight <= 0., left, right)
+        weight[(weight <= 0.) | (weight >= 1.)] = 0.
+        return inds[left], inds[right], weight
 
     def nearest(self, dateo, select='nearest'):
         """
@@ -127,10 +358,10 @@ class Timevar(np.ndarray):
         return np.asarray(self,dtype='float64')*fac
 
     def get_dates(self):
-        return num2date(self, self._units + " since " + self.origin.strftime('%Y-%m-%dT%H:%M:%S'), tzinfo=self._tzinfo)
+        return self.datetime642date(self.datetime64)
 
     def get_datenum(self):
-        return date2num(self.dates)
+        return self.axis[0]
 
     datenum = property(get_datenum, None, doc="datenum in seconds since 1970-01-01")
     seconds = property(get_seconds, None, doc="seconds")
@@ -139,3 +370,6 @@ class Timevar(np.ndarray):
     days = property(get_days, None, doc="days")
     dates = property(get_dates, None, doc="datetime objects")
     timestep = property(gettimestep, None)
+    axis = property(get_axis, None, doc="cached numeric time axis")
+    datetime64 = property(get_datetime64, None, doc="cached datetime64[us] values")
+    window = property(get_window, None, doc="indices of the steps restricted to")
@@ -68,6 +68,26 @@ class SubCoordinates(object):
             self.time = kwargs["time"]
 
 
-
-
-
+class CoordinateDescriptor(object):
+    """
+    The coordinate variable names of a field variable and the positions of
+    their dimensions within it, resolved once and kept by the dataset obj.
+    """
+    def __init__(self, names, dims, shape, positions):
+        self.names = names
+        self.dims = dims
+        self.shape = shape
+        self.ndim = len(shape)
+        self.positions = positions
+
+    def size(self, common_name, i=0):
+        return self.shape[self.positions[common_name][i]]
+
+    def get_key(self):
+        """
+        The same for variables sharing their coordinate variables, dimensions
+        and shape, which therefore share their indices for any request.
+        """
+        return (tuple(sorted(self.names.items())), tuple(self.dims), tuple(self.shape))
+
+    key = property(get_key, None)
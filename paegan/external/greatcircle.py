@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 class GreatCircle(object):
     # -----------------------------------------------------------------------
@@ -125,6 +126,111 @@ class GreatCircle(object):
 
         return s, alpha12,  alpha21
 
+    @staticmethod
+    def vinc_dist_array( f, a, phi1, lembda1, phi2, lembda2, max_iterations=200 ) :
+        """
+
+        Array version of vinc_dist.  All of the arguments may be numpy
+        arrays (broadcast against each other) and every element is iterated
+        together, dropping out of the iteration as it converges.
+        lats, longs and azimuths are in radians, distance in metres.
+        Elements with a NaN coordinate return NaN.
+
+        Returns ( s, alpha12,  alpha21 ) as a tuple of arrays
+
+        """
+
+        phi1, lembda1, phi2, lembda2 = np.broadcast_arrays(*[np.asarray(x, dtype='float64') for x in (phi1, lembda1, phi2, lembda2)])
+
+        two_pi = 2.0*math.pi
+
+        b = a * (1.0 - f)
+
+        U1 = np.arctan( (1-f) * np.tan( phi1 ) )
+        U2 = np.arctan( (1-f) * np.tan( phi2 ) )
+        sinU1, cosU1 = np.sin(U1), np.cos(U1)
+        sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+        omega = np.asarray(lembda2 - lembda1)
+        lembda = omega.copy()
+
+        valid = np.isfinite(omega) & np.isfinite(U1) & np.isfinite(U2)
+        same = valid & (np.abs( phi2 - phi1 ) < 1e-8) & (np.abs( lembda2 - lembda1 ) < 1e-8)
+
+        sqr_sin_sigma = np.zeros(omega.shape)
+        Sin_sigma = np.zeros(omega.shape)
+        Cos_sigma = np.zeros(omega.shape)
+        sigma = np.zeros(omega.shape)
+        cos_sq_alpha = np.zeros(omega.shape)
+        Cos2sigma_m = np.zeros(omega.shape)
+
+        # Iterate every element that is still changing, until there is
+        # no significant change in lembda anywhere
+        active = np.array(valid & ~same)
+        for i in range(max_iterations):
+          if not active.any():
+            break
+
+          l = lembda[active]
+          su1, cu1, su2, cu2 = sinU1[active], cosU1[active], sinU2[active], cosU2[active]
+
+          sqr = (cu2 * np.sin(l))**2 + (cu1 * su2 - su1 * cu2 * np.cos(l))**2
+          ss = np.sqrt(sqr)
+          cs = su1 * su2 + cu1 * cu2 * np.cos(l)
+          sg = np.arctan2(ss, cs)
+
+          sa = np.where(ss != 0, cu1 * cu2 * np.sin(l) / np.where(ss != 0, ss, 1), 0.0)
+          ca2 = 1.0 - sa * sa
+          c2sm = np.where(ca2 != 0, cs - 2 * su1 * su2 / np.where(ca2 != 0, ca2, 1), 0.0)
+
+          C = (f/16) * ca2 * (4 + f * (4 - 3 * ca2))
+
+          new = omega[active] + (1-C) * f * sa * (sg + C * ss * \
+                (c2sm + C * cs * (-1 + 2 * c2sm**2)))
+
+          sqr_sin_sigma[active] = sqr
+          Sin_sigma[active] = ss
+          Cos_sigma[active] = cs
+          sigma[active] = sg
+          cos_sq_alpha[active] = ca2
+          Cos2sigma_m[active] = c2sm
+          lembda[active] = new
+
+          changing = (new != 0) & (np.abs(l - new) > 1.0e-9 * np.abs(new))
+          active[active] = changing
+
+        u2 = cos_sq_alpha * (a*a-b*b) / (b*b)
+
+        A = 1 + (u2/16384) * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+
+        B = (u2/1024) * (256 + u2 * (-128+ u2 * (74 - 47 * u2)))
+
+        delta_sigma = B * Sin_sigma * (Cos2sigma_m + (B/4) * \
+                (Cos_sigma * (-1 + 2 * Cos2sigma_m**2 ) - \
+                (B/6) * Cos2sigma_m * (-3 + 4 * sqr_sin_sigma) * \
+                (-3 + 4 * Cos2sigma_m**2 )))
+
+        s = b * A * (sigma - delta_sigma)
+
+        alpha12 = np.arctan2( (cosU2 * np.sin(lembda)), \
+                (cosU1 * sinU2 - sinU1 * cosU2 * np.cos(lembda)))
+
+        alpha21 = np.arctan2( (cosU1 * np.sin(lembda)), \
+                (-sinU1 * cosU2 + cosU1 * sinU2 * np.cos(lembda)))
+
+        alpha12 = np.where(alpha12 < 0.0, alpha12 + two_pi, alpha12)
+        alpha12 = np.where(alpha12 > two_pi, alpha12 - two_pi, alpha12)
+
+        alpha21 = alpha21 + two_pi / 2.0
+        alpha21 = np.where(alpha21 < 0.0, alpha21 + two_pi, alpha21)
+        alpha21 = np.where(alpha21 > two_pi, alpha21 - two_pi, alpha21)
+
+        s = np.where(same, 0.0, np.where(valid, s, np.nan))
+        alpha12 = np.where(same, 0.0, np.where(valid, alpha12, np.nan))
+        alpha21 = np.where(same, 0.0, np.where(valid, alpha21, np.nan))
+
+        return s, alpha12,  alpha21
+
 
     #----------------------------------------------------------------------------
     # Vincenty's Direct formulae                                                |
@@ -224,4 +330,100 @@ class GreatCircle(object):
                 alpha21 = alpha21 - two_pi
 
 
-        return phi2,  lembda2,  alpha21
\ No newline at end of file
+        return phi2,  lembda2,  alpha21
+
+
+    @staticmethod
+    def vinc_pt_array( f, a, phi1, lembda1, alpha12, s, max_iterations=200 ) :
+        """
+
+        Array version of vinc_pt.  All of the arguments may be numpy
+        arrays (broadcast against each other) and every element is iterated
+        together, dropping out of the iteration as it converges.
+        lats, longs and azimuths are passed in RADIANS
+
+        Returns ( phi2,  lambda2,  alpha21 ) as a tuple of arrays, all in radians
+
+        """
+
+        phi1, lembda1, alpha12, s = np.broadcast_arrays(*[np.asarray(x, dtype='float64') for x in (phi1, lembda1, alpha12, s)])
+
+        two_pi = 2.0*math.pi
+
+        alpha12 = np.where(alpha12 < 0.0, alpha12 + two_pi, alpha12)
+        alpha12 = np.where(alpha12 > two_pi, alpha12 - two_pi, alpha12)
+
+        b = a * (1.0 - f)
+
+        TanU1 = (1-f) * np.tan(phi1)
+        U1 = np.arctan( TanU1 )
+        sinU1, cosU1 = np.sin(U1), np.cos(U1)
+        sigma1 = np.arctan2( TanU1, np.cos(alpha12) )
+        Sinalpha = cosU1 * np.sin(alpha12)
+        cosalpha_sq = 1.0 - Sinalpha * Sinalpha
+
+        u2 = cosalpha_sq * (a * a - b * b ) / (b * b)
+        A = 1.0 + (u2 / 16384) * (4096 + u2 * (-768 + u2 * \
+                (320 - 175 * u2) ) )
+        B = (u2 / 1024) * (256 + u2 * (-128 + u2 * (74 - 47 * u2) ) )
+
+        # Starting with the approximation
+        first = np.asarray(s / (b * A))
+        sigma = first.copy()
+        two_sigma_m = np.asarray(2 * sigma1 + sigma)
+
+        # Elements that are not moving keep the location that was passed in.
+        still = sigma == 0
+
+        # Iterate every element that is still changing, until there is
+        # no significant change in sigma anywhere
+        active = np.array(np.isfinite(sigma) & ~still)
+        for i in range(max_iterations):
+           if not active.any():
+             break
+
+           sg = sigma[active]
+           bb = B[active]
+           tsm = 2 * sigma1[active] + sg
+
+           delta_sigma = bb * np.sin(sg) * ( np.cos(tsm) \
+                        + (bb/4) * (np.cos(sg) * \
+                        (-1 + 2 * np.cos(tsm)**2 -  \
+                        (bb/6) * np.cos(tsm) * \
+                        (-3 + 4 * np.sin(sg)**2) *  \
+                        (-3 + 4 * np.cos(tsm)**2))))
+
+           new = first[active] + delta_sigma
+           two_sigma_m[active] = tsm
+           sigma[active] = new
+
+           changing = np.abs( (sg - new) / new) > 1.0e-9
+           active[active] = changing
+
+        phi2 = np.arctan2 ( (sinU1 * np.cos(sigma) + cosU1 * np.sin(sigma) * np.cos(alpha12) ), \
+                ((1-f) * np.sqrt( Sinalpha**2 +  \
+                (sinU1 * np.sin(sigma) - cosU1 * np.cos(sigma) * np.cos(alpha12))**2)))
+
+        lembda = np.arctan2( (np.sin(sigma) * np.sin(alpha12 )), (cosU1 * np.cos(sigma) -  \
+                sinU1 *  np.sin(sigma) * np.cos(alpha12)))
+
+        C = (f/16) * cosalpha_sq * (4 + f * (4 - 3 * cosalpha_sq ))
+
+        omega = lembda - (1-C) * f * Sinalpha *  \
+                (sigma + C * np.sin(sigma) * (np.cos(two_sigma_m) + \
+                C * np.cos(sigma) * (-1 + 2 * np.cos(two_sigma_m)**2 )))
+
+        lembda2 = lembda1 + omega
+
+        alpha21 = np.arctan2 ( Sinalpha, (-sinU1 * np.sin(sigma) +  \
+                cosU1 * np.cos(sigma) * np.cos(alpha12)))
+
+        alpha21 = alpha21 + two_pi / 2.0
+        alpha21 = np.where(alpha21 < 0.0, alpha21 + two_pi, alpha21)
+        alpha21 = np.where(alpha21 > two_pi, alpha21 - two_pi, alpha21)
+
+        phi2 = np.where(still, phi1, phi2)
+        lembda2 = np.where(still, lembda1, lembda2)
+        alpha21 = np.where(still, alpha12, alpha21)
+
+        return phi2,  lembda2,  alpha21
@@ -3,6 +3,29 @@ from paegan.external.greatcircle import GreatCircle
 import numpy as np
 
 class AsaGreatCircle(object):
+    """
+        Distances and moves on the earth, selected with the 'method'
+        named argument:
+
+        'vincenty' (default) - iterative solution on the ellipsoid,
+            millimetre accuracy.
+        'haversine' - closed form solution on a sphere of the mean
+            radius (2a + b) / 3.  Within 0.6% of 'vincenty' everywhere.
+        'equirectangular' - flat earth approximation around the mean
+            latitude of the two points, no iteration and no inverse trig
+            for distances.  Within 0.6% of 'vincenty' for separations under
+            100km (up to 85 degrees of latitude), and within 0.8% under
+            1000km between 70S and 70N.  Useless for long or polar lines.
+
+        The cheap methods rank candidates in the same order as 'vincenty'
+        to within their error bound, so they are suited to coarse filters
+        where only the winners need to be measured with 'vincenty'.  The
+        distances they return are approximate, never refined here; the
+        grid searches (see Gridobj.near_xy) measure their winners again
+        with 'vincenty'.
+    """
+
+    methods = ['vincenty', 'haversine', 'equirectangular']
 
     @classmethod
     def great_circle(self, **kwargs):
@@ -11,8 +34,16 @@ class AsaGreatCircle(object):
             distance = distance to traveled
             azimuth = angle, in DECIMAL DEGREES of HEADING from NORTH
             start_point = Location4D object representing the starting point
+            OR
+            start_lats, start_lons = decimal degree numpy arrays of starting
+                points, for moving a whole ensemble of particles at once
             rmajor = radius of earth's major axis. default=6378137.0 (WGS84)
             rminor = radius of earth's minor axis. default=6356752.3142 (WGS84)
+            method = 'vincenty' (default), 'haversine' or 'equirectangular'
+
+            distance and azimuth may be numpy arrays (broadcast against the
+            starting points), in which case every move is solved together
+            and the dictionary values are arrays.
 
             Returns a dictionary with:
             'latitude' in decimal degrees
@@ -23,12 +54,32 @@ class AsaGreatCircle(object):
 
         distance = kwargs.pop('distance')
         azimuth = kwargs.pop('azimuth')
-        starting = kwargs.pop('start_point')
+        starting = kwargs.pop('start_point', None)
+        if starting is None:
+            start_lat = kwargs.pop('start_lats')
+            start_lon = kwargs.pop('start_lons')
+        else:
+            start_lat = starting.latitude
+            start_lon = starting.longitude
         rmajor = kwargs.pop('rmajor', 6378137.0)
         rminor = kwargs.pop('rminor', 6356752.3142)
+        method = kwargs.pop('method', 'vincenty')
         f = (rmajor - rminor) / rmajor
 
-        lat_result, lon_result, angle_result = GreatCircle.vinc_pt(f, rmajor, math.radians(starting.latitude), math.radians(starting.longitude), math.radians(azimuth), distance)
+        if method == 'haversine':
+            lat_result, lon_result, angle_result = self._spherical_pt((2 * rmajor + rminor) / 3, np.radians(start_lat), np.radians(start_lon), np.radians(azimuth), distance)
+            return {'latitude': np.degrees(lat_result), 'longitude': np.degrees(lon_result), 'reverse_azimuth': np.degrees(angle_result)}
+        elif method == 'equirectangular':
+            lat_result, lon_result, angle_result = self._equirectangular_pt((2 * rmajor + rminor) / 3, np.radians(start_lat), np.radians(start_lon), np.radians(azimuth), distance)
+            return {'latitude': np.degrees(lat_result), 'longitude': np.degrees(lon_result), 'reverse_azimuth': np.degrees(angle_result)}
+        elif method != 'vincenty':
+            raise ValueError("Unknown method '%s', expected one of %s" % (method, self.methods))
+
+        if starting is None or np.ndim(distance) > 0 or np.ndim(azimuth) > 0:
+            lat_result, lon_result, angle_result = GreatCircle.vinc_pt_array(f, rmajor, np.radians(start_lat), np.radians(start_lon), np.radians(azimuth), distance)
+            return {'latitude': np.degrees(lat_result), 'longitude': np.degrees(lon_result), 'reverse_azimuth': np.degrees(angle_result)}
+
+        lat_result, lon_result, angle_result = GreatCircle.vinc_pt(f, rmajor, math.radians(start_lat), math.radians(start_lon), math.radians(azimuth), distance)
 
         return {'latitude': math.degrees(lat_result), 'longitude': math.degrees(lon_result), 'reverse_azimuth': math.degrees(angle_result)}
 
@@ -38,8 +89,12 @@ class AsaGreatCircle(object):
             Named arguments:
             start_point = Location4D obect representing start point
             end_point = Location4D obect representing end point
+            OR
+            start_lats, start_lons, end_lats, end_lons = decimal degree
+                values or numpy arrays (broadcast against each other)
             rmajor = radius of earth's major axis. default=6378137.0 (WGS84)
             rminor = radius of earth's minor axis. default=6356752.3142 (WGS84)
+            method = 'vincenty' (default), 'haversine' or 'equirectangular'
 
             Returns a dictionaty with:
             'distance' in meters
@@ -57,17 +112,82 @@ class AsaGreatCircle(object):
             end_lon = kwargs.pop("end_lons")
         rmajor = kwargs.pop('rmajor', 6378137.0)
         rminor = kwargs.pop('rminor', 6356752.3142)
+        method = kwargs.pop('method', 'vincenty')
         f = (rmajor - rminor) / rmajor
 
         if start_point != None and end_point != None:
+            start_lat, start_lon = start_point.latitude, start_point.longitude
+            end_lat, end_lon = end_point.latitude, end_point.longitude
+
+        if method == 'haversine':
+            distance, angle, reverse_angle = self._spherical_dist((2 * rmajor + rminor) / 3, np.radians(start_lat), np.radians(start_lon),
+                                                                  np.radians(end_lat), np.radians(end_lon))
+        elif method == 'equirectangular':
+            distance, angle, reverse_angle = self._equirectangular_dist((2 * rmajor + rminor) / 3, np.radians(start_lat), np.radians(start_lon),
+                                                                        np.radians(end_lat), np.radians(end_lon))
+        elif method != 'vincenty':
+            raise ValueError("Unknown method '%s', expected one of %s" % (method, self.methods))
+        elif start_point != None and end_point != None:
             distance, angle, reverse_angle = GreatCircle.vinc_dist(f, rmajor, math.radians(start_point.latitude),
                                                                    math.radians(start_point.longitude),
                                                                    math.radians(end_point.latitude),
                                                                    math.radians(end_point.longitude))
         else:
-            vector_dist = np.vectorize(GreatCircle.vinc_dist)
-            distance, angle, reverse_angle = vector_dist(f, rmajor, np.radians(start_lat), np.radians(start_lon),
-                                                         np.radians(end_lat), np.radians(end_lon))
+            distance, angle, reverse_angle = GreatCircle.vinc_dist_array(f, rmajor, np.radians(start_lat), np.radians(start_lon),
+                                                                         np.radians(end_lat), np.radians(end_lon))
         return {'distance': distance, 'azimuth': np.degrees(angle), 'reverse_azimuth': np.degrees(reverse_angle)}
 
+    @staticmethod
+    def _spherical_dist(radius, phi1, lembda1, phi2, lembda2):
+        """
+            Haversine distance and forward / reverse azimuths on a sphere,
+            in radians and metres.  Same return layout as GreatCircle.vinc_dist.
+        """
+        dlembda = lembda2 - lembda1
+        a = np.sin((phi2 - phi1) / 2.)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlembda / 2.)**2
+        distance = 2. * radius * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+        alpha12 = np.arctan2(np.sin(dlembda) * np.cos(phi2),
+                             np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlembda))
+        alpha21 = np.arctan2(-np.sin(dlembda) * np.cos(phi1),
+                             np.cos(phi2) * np.sin(phi1) - np.sin(phi2) * np.cos(phi1) * np.cos(dlembda))
+        return distance, np.mod(alpha12, 2 * math.pi), np.mod(alpha21, 2 * math.pi)
+
+    @staticmethod
+    def _spherical_pt(radius, phi1, lembda1, alpha12, s):
+        """
+            Destination and reverse azimuth on a sphere, in radians and
+            metres.  Same return layout as GreatCircle.vinc_pt.
+        """
+        delta = np.asarray(s, dtype='float64') / radius
+        phi2 = np.arcsin(np.clip(np.sin(phi1) * np.cos(delta) + np.cos(phi1) * np.sin(delta) * np.cos(alpha12), -1., 1.))
+        lembda2 = lembda1 + np.arctan2(np.sin(alpha12) * np.sin(delta) * np.cos(phi1),
+                                       np.cos(delta) - np.sin(phi1) * np.sin(phi2))
+        dlembda = lembda1 - lembda2
+        alpha21 = np.arctan2(np.sin(dlembda) * np.cos(phi1),
+                             np.cos(phi2) * np.sin(phi1) - np.sin(phi2) * np.cos(phi1) * np.cos(dlembda))
+        return phi2, lembda2, np.mod(alpha21, 2 * math.pi)
 
+    @staticmethod
+    def _equirectangular_dist(radius, phi1, lembda1, phi2, lembda2):
+        """
+            Flat earth distance and forward / reverse azimuths around the
+            mean latitude, in radians and metres.  Same return layout as
+            GreatCircle.vinc_dist.
+        """
+        dlembda = np.mod(lembda2 - lembda1 + math.pi, 2 * math.pi) - math.pi
+        x = dlembda * np.cos((phi1 + phi2) / 2.)
+        y = phi2 - phi1
+        distance = radius * np.sqrt(x * x + y * y)
+        alpha12 = np.mod(np.arctan2(x, y), 2 * math.pi)
+        return distance, alpha12, np.mod(alpha12 + math.pi, 2 * math.pi)
+
+    @staticmethod
+    def _equirectangular_pt(radius, phi1, lembda1, alpha12, s):
+        """
+            Flat earth destination and reverse azimuth, in radians and
+            metres.  Same return layout as GreatCircle.vinc_pt.
+        """
+        delta = np.asarray(s, dtype='float64') / radius
+        phi2 = phi1 + delta * np.cos(alpha12)
+        lembda2 = lembda1 + delta * np.sin(alpha12) / np.cos((phi1 + phi2) / 2.)
+        return phi2, lembda2, np.mod(alpha12 + math.pi, 2 * math.pi)
@@ -1,5 +1,7 @@
 import numpy as np
+from scipy import sparse
 from scipy.interpolate import griddata
+from scipy.spatial import cKDTree, Delaunay
 
 def create_grid(lonmin, lonmax, latmin, latmax, **kwargs):
     dx, dy = kwargs.get("dx", None), kwargs.get("dy", None)
@@ -88,8 +90,8 @@ class CfGeoInterpolator(object):
             lat = lat.flatten()
 
         # Configure the z coords to provide cell by cell z value
-        if z == None:
-            if t == None:
+        if z is None:
+            if t is None:
                 dimensions = [lon, lat]
             else:
                 ndshape.append(t.shape[0])
@@ -97,7 +99,7 @@ class CfGeoInterpolator(object):
                 t, lon = np.meshgrid(t, lon, indexing='ij')
                 dimensions = [lon.flatten(), lat.flatten(), t.flatten()]
         elif len(z.shape) == 4:
-            assert t != None
+            assert t is not None
             ndshape.append(z.shape[1])
             ndshape.append(t.shape[0])
             lat = np.meshgrid(t, range(z.shape[1]), lat, indexing='ij')[-1]
@@ -106,7 +108,7 @@ class CfGeoInterpolator(object):
             dimensions = [lon.flatten(), lat.flatten(), z, t.flatten()]
         elif len(z.shape) ==  3:
             assert np.all(z.shape[1:] == latshape)
-            if t == None:
+            if t is None:
                 ndshape.append(z.shape[0])
                 lat = np.meshgrid(range(z.shape[0]), lat, indexing='ij')[-1]
                 lon = np.meshgrid(range(z.shape[0]), lon, indexing='ij')[-1]
@@ -120,7 +122,7 @@ class CfGeoInterpolator(object):
                 t, z = np.meshgrid(t, z.flatten(), indexing='ij')
                 dimensions = [lon.flatten(), lat.flatten(), z.flatten(), t.flatten()]
         elif len(z.shape) == 1:
-            if t == None:
+            if t is None:
                 ndshape.append(z.shape[0])
                 lat = np.meshgrid(z, lat, indexing='ij')[-1]
                 z, lon = np.meshgrid(z, lon, indexing='ij')
@@ -133,3 +135,324 @@ class CfGeoInterpolator(object):
                 dimensions = [lon.flatten(), lat.flatten(), z.flatten(), t.flatten()]
 
         return dimensions, ndshape[::-1]
+
+
+def axis_fractions(axis, values):
+    """
+        Where values fall along the monotonic 1-D axis, found with a binary
+        search.  Returns a tuple of (lower indices, upper indices, weights of
+        the upper neighbours, whether each value lies inside the axis).
+    """
+    axis = np.asarray(axis, dtype='float64').ravel()
+    values = np.atleast_1d(np.asarray(values, dtype='float64'))
+    if axis.size == 1:
+        lower = np.zeros(values.shape, dtype='int64')
+        return lower, lower, np.zeros(values.shape), np.isclose(values, axis[0])
+    descending = axis[-1] < axis[0]
+    if descending:
+        axis = axis[::-1]
+    lower = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, axis.size - 2)
+    weight = (values - axis[lower]) / (axis[lower + 1] - axis[lower])
+    inside = (values >= axis[0]) & (values <= axis[-1])
+    if descending:
+        lower = axis.size - 2 - lower
+        weight = 1. - weight
+    return lower, lower + 1, np.clip(weight, 0., 1.), inside
+
+def _along_axes(values, axes, targets, shape, method='linear'):
+    """
+        Interpolate values, horizontally interpolated to points already and
+        so shaped (t, z, points) without the axes that are None, to the
+        target t and z along the source axes (t, z), linearly or to the
+        nearest level.  Returns them shaped (t, z) + shape and squeezed.
+    """
+    shape = [shape]
+    axis = values.ndim - 1
+    for source, target in reversed(list(zip(axes, targets))):
+        if source is None:
+            continue
+        axis -= 1
+        if target is None:
+            shape.insert(0, (source.size,))
+            continue
+        lower, upper, weight, within = axis_fractions(source, target)
+        shape.insert(0, (weight.size,))
+        if method == 'nearest':
+            values = np.take(values, np.where(weight < 0.5, lower, upper), axis=axis)
+            continue
+        blend = [1 for i in range(values.ndim)]
+        blend[axis] = weight.size
+        below = np.where((weight < 1).reshape(blend), np.take(values, lower, axis=axis), 0.)
+        above = np.where((weight > 0).reshape(blend), np.take(values, upper, axis=axis), 0.)
+        values = below * (1. - weight).reshape(blend) + above * weight.reshape(blend)
+        values[(slice(None),) * axis + (~within,)] = np.nan
+    return np.squeeze(values.reshape(sum(shape, ())))
+
+def cell_coordinates(lon, lat, x, y, cells, tolerance=1e-6, iterations=10):
+    """
+        Fractional position of the points (x, y) inside the cells of the
+        curvilinear grid of nodes lon, lat (2-D, rows by columns), by
+        inverting the bilinear mapping of each cell with Newton iterations.
+        cells is a (rows, cols) tuple of the lower left corner of the cell
+        tried for each point.
+
+        Returns a tuple of (column fractions, row fractions, whether the
+        point lies inside its cell).  The fractions of points inside are
+        clipped to 0 - 1, those of points outside are left as they are,
+        showing which way the point lies (NaN for degenerate cells).
+    """
+    rows, cols = cells
+    corners = []
+    for dj, di in [(0, 0), (0, 1), (1, 0), (1, 1)]:
+        corners.append((lon[rows + dj, cols + di], lat[rows + dj, cols + di]))
+    (x00, y00), (x01, y01), (x10, y10), (x11, y11) = corners
+    s = np.full(np.shape(x), 0.5)
+    t = np.full(np.shape(x), 0.5)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(iterations):
+            fx = (1-s)*(1-t)*x00 + s*(1-t)*x01 + (1-s)*t*x10 + s*t*x11 - x
+            fy = (1-s)*(1-t)*y00 + s*(1-t)*y01 + (1-s)*t*y10 + s*t*y11 - y
+            dxds = (1-t)*(x01 - x00) + t*(x11 - x10)
+            dyds = (1-t)*(y01 - y00) + t*(y11 - y10)
+            dxdt = (1-s)*(x10 - x00) + s*(x11 - x01)
+            dydt = (1-s)*(y10 - y00) + s*(y11 - y01)
+            det = dxds*dydt - dxdt*dyds
+            s = s - (fx*dydt - fy*dxdt) / det
+            t = t - (fy*dxds - fx*dyds) / det
+        inside = (s >= -tolerance) & (s <= 1 + tolerance) & (t >= -tolerance) & (t <= 1 + tolerance)
+    # Points on the edges and nodes, up to round off, exactly so
+    for f in (s, t):
+        f[inside & (f < 1e-9)] = 0.
+        f[inside & (f > 1 - 1e-9)] = 1.
+    return s, t, inside
+
+def walk_cells(lon, lat, x, y, cells, steps=4, bounds=None):
+    """
+        Find the cell of the curvilinear grid of nodes lon, lat holding each
+        point (x, y), starting from the cell in cells (a (rows, cols) tuple
+        of lower left corners) and moving to the neighbouring cell that the
+        inverted bilinear mapping points to, trying at most steps cells.
+        Only cells within bounds, the (first row, last row, first column,
+        last column) of the lower left corners, are tried (the whole grid
+        by default).
+
+        Returns a tuple of (rows, columns, row fractions, column fractions,
+        found) arrays, rows and columns being -1 where no cell was found.
+    """
+    x = np.asarray(x, dtype='float64').ravel()
+    y = np.asarray(y, dtype='float64').ravel()
+    if bounds is None:
+        bounds = (0, lon.shape[0] - 2, 0, lon.shape[1] - 2)
+    rows = np.clip(np.asarray(cells[0], dtype='int64').ravel(), bounds[0], bounds[1])
+    cols = np.clip(np.asarray(cells[1], dtype='int64').ravel(), bounds[2], bounds[3])
+    fy = np.full(x.shape, np.nan)
+    fx = np.full(x.shape, np.nan)
+    found = np.zeros(x.shape, dtype=bool)
+    todo = np.arange(x.size)
+    if bounds[1] < bounds[0] or bounds[3] < bounds[2]:
+        todo = todo[:0]
+    for step in range(steps):
+        if todo.size == 0:
+            break
+        s, t, inside = cell_coordinates(lon, lat, x[todo], y[todo], (rows[todo], cols[todo]))
+        hit = todo[inside]
+        fx[hit], fy[hit] = s[inside], t[inside]
+        found[hit] = True
+        todo, s, t = todo[~inside], s[~inside], t[~inside]
+        nrows = np.clip(rows[todo] + (t > 1).astype('int64') - (t < 0), bounds[0], bounds[1])
+        ncols = np.clip(cols[todo] + (s > 1).astype('int64') - (s < 0), bounds[2], bounds[3])
+        # Points pointing off the edge of the bounds, or at nothing, are outside
+        moved = (nrows != rows[todo]) | (ncols != cols[todo])
+        rows[todo], cols[todo] = nrows, ncols
+        todo = todo[moved]
+    rows[~found] = -1
+    cols[~found] = -1
+    return rows, cols, fy, fx, found
+
+class StructuredInterpolator(object):
+    """
+        Samples data on a structured grid, rectilinear (1-D lon and lat) or
+        curvilinear (2-D lon and lat, rows by columns), with bilinear weights
+        on the four nodes around each point, and linearly along the z and t
+        axes when they are given (1-D), so trilinear with a z axis.  Nothing
+        is triangulated: rectilinear axes are binary searched, and on
+        curvilinear grids the cells around the nearest node are inverted to
+        fractional cell coordinates.
+
+        data has the dimensions (t, z, lat, lon), without t or z when those
+        are None.  Points outside the grid, or next to missing data, are NaN.
+        The same interface as CfGeoInterpolator.
+    """
+    methods = ('bilinear', 'trilinear')
+
+    def __init__(self, data, lon, lat, t=None, z=None, **kwargs):
+        self.lon = np.asarray(lon, dtype='float64')
+        self.lat = np.asarray(lat, dtype='float64')
+        if self.lon.ndim == 1:
+            assert self.lat.ndim == 1
+            gridshape = (self.lat.size, self.lon.size)
+        else:
+            assert self.lon.ndim == 2 and self.lon.shape == self.lat.shape
+            gridshape = self.lon.shape
+        self.axes = []
+        for axis in (t, z):
+            if axis is not None:
+                if np.ndim(axis) != 1:
+                    raise ValueError("Only 1-D t and z axes can be interpolated on a structured grid")
+                self.axes.append(np.asarray(axis, dtype='float64'))
+            else:
+                self.axes.append(None)
+        shape = tuple(axis.size for axis in self.axes if axis is not None) + gridshape
+        data = np.ma.filled(np.ma.asarray(data, dtype='float64'), np.nan)
+        self.data = data.reshape(shape)
+        self._tree = None
+
+    def _nodetree(self):
+        if self._tree is None:
+            nodes = np.flatnonzero(np.isfinite(self.lon) & np.isfinite(self.lat))
+            self._tree = (cKDTree(np.column_stack((self.lon.flat[nodes], self.lat.flat[nodes]))), nodes)
+        return self._tree
+
+    def locate(self, x, y):
+        """
+            The cell holding each point (x, y) and where inside it the point
+            lies.  Returns a tuple of (rows, columns, row fractions, column
+            fractions, inside) arrays, rows and columns being the lower left
+            corners of the cells.
+        """
+        x = np.asarray(x, dtype='float64').ravel()
+        y = np.asarray(y, dtype='float64').ravel()
+        if self.lon.ndim == 1:
+            cols, upper, fx, xinside = axis_fractions(self.lon, x)
+            rows, upper, fy, yinside = axis_fractions(self.lat, y)
+            return rows, cols, fy, fx, xinside & yinside
+
+        tree, nodes = self._nodetree()
+        if x.size == 0 or nodes.size == 0:
+            return walk_cells(self.lon, self.lat, x[:0], y[:0], (x[:0], x[:0]))
+        nearest = nodes[tree.query(np.column_stack((x, y)))[1].clip(0, nodes.size - 1)]
+        # A point inside the grid lies in one of the cells around its nearest node
+        return walk_cells(self.lon, self.lat, x, y, np.unravel_index(nearest, self.lon.shape))
+
+    def interpgrid(self, lon, lat, t=None, z=None, **kwargs):
+        lon = np.asarray(lon, dtype='float64')
+        lat = np.asarray(lat, dtype='float64')
+        if lon.ndim == 1:
+            lon, lat = np.meshgrid(lon, lat)
+        rows, cols, fy, fx, inside = self.locate(lon, lat)
+        values = 0.
+        for dj, di, weight in [(0, 0, (1-fy)*(1-fx)), (0, 1, (1-fy)*fx), (1, 0, fy*(1-fx)), (1, 1, fy*fx)]:
+            rj = np.minimum(rows + dj, self.data.shape[-2] - 1)
+            ri = np.minimum(cols + di, self.data.shape[-1] - 1)
+            # Corners with no weight (points on an edge or a node) do not spread missing data
+            values = values + np.where(weight > 0, self.data[..., rj, ri], 0.) * weight
+        values = np.where(inside, values, np.nan)
+        return _along_axes(values, self.axes, (t, z), lon.shape)
+
+class InterpolationPlan(object):
+    """
+        The weights taking values at scattered source points to target
+        points, found once (one Delaunay triangulation or KD-tree query)
+        and kept as a sparse matrix, so that any number of data slices on
+        the same source points are interpolated with one sparse product
+        each.  points and targets are (n, dimensions) arrays.
+
+        method = 'linear' for the barycentric weights of the triangle (or
+            simplex) holding each target, NaN outside the hull of the
+            points, as griddata's 'linear', or 'nearest' for the nearest
+            point's value
+    """
+    methods = ('nearest', 'linear')
+
+    def __init__(self, points, targets, method='linear'):
+        points = np.asarray(points, dtype='float64')
+        targets = np.asarray(targets, dtype='float64')
+        if method not in self.methods:
+            raise ValueError("No interpolation plan for method '%s'" % method)
+        self.method = method
+        self.shape = (targets.shape[0], points.shape[0])
+        # Points with missing coordinates take no part
+        valid = np.flatnonzero(np.isfinite(points).all(axis=1))
+        count = targets.shape[0]
+        if valid.size == 0:
+            rows, cols, weights = [np.zeros(0, dtype='int64')] * 2 + [np.zeros(0)]
+            self.outside = np.ones(count, dtype=bool)
+        elif method == 'nearest':
+            nearest = cKDTree(points[valid]).query(targets)[1]
+            rows, cols, weights = np.arange(count), valid[nearest], np.ones(count)
+            self.outside = np.zeros(count, dtype=bool)
+        else:
+            ndim = points.shape[1]
+            triangulation = Delaunay(points[valid])
+            simplex = triangulation.find_simplex(targets)
+            self.outside = simplex < 0
+            inside = np.flatnonzero(~self.outside)
+            transform = triangulation.transform[simplex[inside]]
+            b = np.einsum('ijk,ik->ij', transform[:, :ndim], targets[inside] - transform[:, ndim])
+            weights = np.column_stack((b, 1. - b.sum(axis=1))).ravel()
+            rows = np.repeat(inside, ndim + 1)
+            cols = valid[triangulation.simplices[simplex[inside]]].ravel()
+        self.weights = sparse.csr_matrix((weights, (rows, cols)), shape=self.shape)
+        # Vertices with no weight (targets on an edge or a point) do not spread missing data
+        self.weights.eliminate_zeros()
+
+    def apply(self, data):
+        """
+            Interpolate data, shaped (..., source points), to the targets.
+            Missing (masked or NaN) source values make the targets that
+            depend on them NaN.  Returns an array shaped (..., targets).
+        """
+        data = np.ma.filled(np.ma.asarray(data, dtype='float64'), np.nan)
+        assert data.shape[-1] == self.shape[1]
+        slices = data.reshape(-1, self.shape[1])
+        values = np.asarray(self.weights.dot(slices.T)).T
+        values[:, self.outside] = np.nan
+        return values.reshape(data.shape[:-1] + (self.shape[0],))
+
+class ScatteredInterpolator(object):
+    """
+        Interpolates data on a horizontal grid of any shape with the
+        weights of an InterpolationPlan from the (lon, lat) nodes to the
+        target points, applied to every t and z slice, then along 1-D z
+        and t axes (linearly, or to the nearest level) when they are given.
+        The plan of the last interpgrid is kept as the plan attribute and
+        can be passed back in, with the same nodes and target points, to
+        skip building it.
+
+        data has the dimensions (t, z, lat, lon), without t or z when those
+        are None, or (t, z, nodes) for scattered=True, when lon and lat are
+        the 1-D positions of unstructured nodes instead of axes.  The same
+        interface as CfGeoInterpolator.
+    """
+    methods = InterpolationPlan.methods
+
+    def __init__(self, data, lon, lat, t=None, z=None, method='linear', plan=None, **kwargs):
+        self.lon = np.asarray(lon, dtype='float64')
+        self.lat = np.asarray(lat, dtype='float64')
+        if self.lon.ndim == 1 and not kwargs.get('scattered', False):
+            # Rectilinear axes
+            self.lon, self.lat = np.meshgrid(self.lon, self.lat)
+        assert self.lon.shape == self.lat.shape
+        self.axes = []
+        for axis in (t, z):
+            if axis is not None:
+                if np.ndim(axis) != 1:
+                    raise ValueError("Only 1-D t and z axes can be interpolated with a plan")
+                self.axes.append(np.asarray(axis, dtype='float64'))
+            else:
+                self.axes.append(None)
+        shape = tuple(axis.size for axis in self.axes if axis is not None) + (self.lon.size,)
+        self.data = np.ma.asarray(data).reshape(shape)
+        self.method = method
+        self.plan = plan
+
+    def interpgrid(self, lon, lat, t=None, z=None, **kwargs):
+        lon = np.asarray(lon, dtype='float64')
+        lat = np.asarray(lat, dtype='float64')
+        if lon.ndim == 1:
+            lon, lat = np.meshgrid(lon, lat)
+        if self.plan is None or self.plan.shape != (lon.size, self.lon.size):
+            self.plan = InterpolationPlan(np.column_stack((self.lon.ravel(), self.lat.ravel())),
+                                          np.column_stack((lon.ravel(), lat.ravel())), method=self.method)
+        values = self.plan.apply(self.data)
+        return _along_axes(values, self.axes, (t, z), lon.shape, method=self.method)
@@ -1,7 +1,9 @@
 import math
 import unittest
 import numpy as np
-from paegan.utils.asainterpolate import GenInterpolator, CfGeoInterpolator, create_grid
+from scipy.interpolate import griddata
+from paegan.utils.asainterpolate import GenInterpolator, CfGeoInterpolator, StructuredInterpolator, create_grid
+from paegan.utils.asainterpolate import InterpolationPlan, ScatteredInterpolator
 
 class CfInterpolator(unittest.TestCase):
     def test_interpolator_2d(self):
@@ -107,6 +109,87 @@ class CfInterpolator(unittest.TestCase):
         data2 = i.interpgrid(lon, lat, z=z, t=t)
         assert np.all(data==data2)
 
+class StructuredInterpolatorTest(unittest.TestCase):
+    def linear(self, lon, lat, z=0, t=0):
+        # Reproduced exactly by bilinear (and linear in z and t) weights
+        return 3 * lon - 2 * lat + 0.5 * z + 0.1 * t
+
+    def test_rectilinear_4d(self):
+        lon, lat = create_grid(-70, -60, 50, 40, nx=21, ny=11)
+        z = np.asarray([0., 5., 20., 50.])
+        t = np.arange(3.) * 10
+        tt, zz, yy, xx = np.meshgrid(t, z, lat, lon, indexing='ij')
+        i = StructuredInterpolator(self.linear(xx, yy, zz, tt), lon, lat, z=z, t=t, method='trilinear')
+        plon, plat = np.linspace(-69.9, -60.1, 7), np.linspace(40.2, 49.9, 5)
+        pz, pt = np.asarray([1., 30.]), np.asarray([5., 15., 20.])
+        data = i.interpgrid(plon, plat, z=pz, t=pt)
+        tt, zz, yy, xx = np.meshgrid(pt, pz, plat, plon, indexing='ij')
+        assert data.shape == (3, 2, 5, 7)
+        assert np.allclose(data, self.linear(xx, yy, zz, tt))
+        # Outside of the grid
+        assert np.isnan(i.interpgrid(np.asarray([-80.]), np.asarray([45.]), z=pz, t=pt)).all()
+
+    def test_curvilinear(self):
+        j, i = np.mgrid[0:20, 0:25].astype(float)
+        lon = -70 + 0.05 * i - 0.02 * j
+        lat = 40 + 0.02 * i + 0.05 * j
+        interpolator = StructuredInterpolator(self.linear(lon, lat), lon, lat, method='bilinear')
+        cols, rows = np.random.uniform(0, 24, 100), np.random.uniform(0, 19, 100)
+        plon, plat = -70 + 0.05 * cols - 0.02 * rows, 40 + 0.02 * cols + 0.05 * rows
+        found_rows, found_cols, fy, fx, inside = interpolator.locate(plon, plat)
+        assert inside.all()
+        assert (found_rows == np.floor(rows)).all() and (found_cols == np.floor(cols)).all()
+        assert np.allclose(fx, cols - np.floor(cols)) and np.allclose(fy, rows - np.floor(rows))
+        data = interpolator.interpgrid(plon.reshape(10, 10), plat.reshape(10, 10))
+        assert np.allclose(data, self.linear(plon, plat).reshape(10, 10))
+
+    def test_missing_data(self):
+        lon, lat = create_grid(-70, -60, 40, 50, nx=11, ny=11)
+        xx, yy = np.meshgrid(lon, lat)
+        data = np.ma.masked_array(self.linear(xx, yy), mask=np.zeros(xx.shape, dtype=bool))
+        data[5, 5] = np.ma.masked
+        i = StructuredInterpolator(data, lon, lat, method='bilinear')
+        values = i.interpgrid(lon, lat)
+        # Only the cells touching the missing node are missing
+        assert np.isnan(values[5, 5]) and np.isfinite(values[5, 4]) and np.isfinite(values[4, 5])
+        values = i.interpgrid(np.asarray([-65.5, -63.5]), np.asarray([44.5]))
+        assert np.isnan(values[0]) and np.isclose(values[1], self.linear(-63.5, 44.5))
+
+class InterpolationPlanTest(unittest.TestCase):
+    def test_matches_griddata(self):
+        rs = np.random.RandomState(0)
+        points = rs.rand(500, 2)
+        targets = rs.uniform(-0.1, 1.1, (200, 2))
+        data = rs.rand(6, 500)
+        for method in InterpolationPlan.methods:
+            plan = InterpolationPlan(points, targets, method=method)
+            values = plan.apply(data)
+            assert values.shape == (6, 200)
+            expected = np.asarray([griddata(points, d, targets, method=method) for d in data])
+            assert np.allclose(values, expected, equal_nan=True)
+
+    def test_missing_points(self):
+        points = np.asarray([[0., 0.], [1., 0.], [0., 1.], [1., 1.], [np.nan, np.nan]])
+        plan = InterpolationPlan(points, [[0.25, 0.25], [1., 0.5], [2., 2.]], method='linear')
+        values = plan.apply(np.ma.masked_array([1., 2., 3., 4., 5.], mask=[0, 0, 0, 0, 1]))
+        assert np.allclose(values[:2], [1.75, 3.]) and np.isnan(values[2])
+        # Only the targets depending on a missing value are missing
+        values = plan.apply([np.nan, 2., 3., 4., 5.])
+        assert np.isnan(values[0]) and np.isclose(values[1], 3.)
+
+    def test_reused_plan(self):
+        lon, lat = create_grid(-70, -60, 40, 50, nx=21, ny=11)
+        xx, yy = np.meshgrid(lon, lat)
+        z = np.asarray([0., 10.])
+        data = np.asarray([3 * xx - 2 * yy + level for level in z])
+        plon, plat = np.linspace(-69, -61, 5), np.linspace(41, 49, 4)
+        i = ScatteredInterpolator(data, lon, lat, z=z, method='linear')
+        values = i.interpgrid(plon, plat, z=[5.])
+        pxx, pyy = np.meshgrid(plon, plat)
+        assert values.shape == (4, 5) and np.allclose(values, 3 * pxx - 2 * pyy + 5)
+        again = ScatteredInterpolator(data + 1, lon, lat, z=z, method='linear', plan=i.plan)
+        assert np.allclose(again.interpgrid(plon, plat, z=[5.]), values + 1) and again.plan is i.plan
+
 class GeneralInterpolator(unittest.TestCase):
     def test_interpolator_2d(self):
         lonbounds = [-70, -60]
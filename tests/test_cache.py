@@ -0,0 +1,307 @@
+import os
+import shutil
+import tempfile
+import unittest
+import netCDF4
+import numpy as np
+from paegan.cdm import readplan
+from paegan.cdm.cache import SlabCache, DiskSlabCache, CoordinateCache, dataset_version
+from paegan.cdm.gridvar import Gridobj
+from paegan.cdm.timevar import Timevar
+from paegan.cdm.depthvar import Depthvar
+from paegan.location4d import Location4D
+
+class SlabCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.tmpdir, "slabs.nc")
+        nc = netCDF4.Dataset(self.datafile, "w")
+        nc.createDimension("time", 10)
+        nc.createDimension("node", 100)
+        zeta = nc.createVariable("zeta", "f8", ("time", "node"))
+        self.data = np.arange(1000, dtype='f8').reshape(10, 100)
+        zeta[:] = self.data
+        nc.close()
+        self.nc = netCDF4.Dataset(self.datafile)
+
+    def tearDown(self):
+        self.nc.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_superset_hit(self):
+        cache = SlabCache()
+        cache.put("zeta", ((0, 10), (0, 50)), self.data[:, :50])
+        assert cache.get("zeta", ((0, 10), (0, 51))) is None
+        assert cache.get("temp", ((0, 10), (0, 50))) is None
+        slab = cache.get("zeta", ((2, 4), (10, 20)))
+        assert (slab == self.data[2:4, 10:20]).all()
+        assert cache.stats["hits"] == 1 and cache.stats["misses"] == 2
+
+    def test_lru_eviction(self):
+        slab = self.data[:, :10]
+        cache = SlabCache(max_bytes=2 * slab.nbytes)
+        cache.put("zeta", ((0, 10), (0, 10)), slab)
+        cache.put("zeta", ((0, 10), (10, 20)), self.data[:, 10:20])
+        # Touch the first slab so the second one is the least recently used
+        assert cache.get("zeta", ((0, 10), (0, 10))) is not None
+        cache.put("zeta", ((0, 10), (20, 30)), self.data[:, 20:30])
+        assert len(cache) == 2 and cache.evictions == 1
+        assert cache.nbytes == 2 * slab.nbytes
+        assert cache.get("zeta", ((0, 10), (10, 20))) is None
+        assert cache.get("zeta", ((0, 10), (0, 10))) is not None
+        # Too large to ever fit
+        cache.put("zeta", ((0, 10), (0, 100)), self.data)
+        assert len(cache) == 2
+
+    def test_read_through_cache(self):
+        var = self.nc.variables['zeta']
+        cache = SlabCache()
+        first = readplan.read(var, [np.arange(0, 10), np.arange(20, 80)], cache=cache, name="zeta")
+        assert (first == self.data[:, 20:80]).all()
+        assert cache.stats["misses"] == 1 and len(cache) == 1
+
+        second = readplan.read(var, [np.asarray([7, 3]), np.asarray([60, 25, 25])], cache=cache, name="zeta")
+        assert (second == self.data[np.ix_([7, 3], [60, 25, 25])]).all()
+        assert cache.stats["hits"] == 1 and len(cache) == 1
+
+        # Results are copies, the cached slab is untouched
+        first[:] = -1
+        third = readplan.read(var, [np.arange(0, 10), np.arange(20, 80)], cache=cache, name="zeta")
+        assert (third == self.data[:, 20:80]).all()
+
+class DiskSlabCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, "cache")
+        # A local file standing in for the remote dataset
+        self.datafile = os.path.join(self.tmpdir, "remote.nc")
+        self.write(np.arange(1000, dtype='f8').reshape(10, 100))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data):
+        nc = netCDF4.Dataset(self.datafile, "w")
+        nc.createDimension("time", 10)
+        nc.createDimension("node", 100)
+        zeta = nc.createVariable("zeta", "f8", ("time", "node"), fill_value=-999.)
+        zeta[:] = data
+        zeta[0, 0] = np.ma.masked
+        nc.close()
+        self.data = data
+
+    def read(self, indices):
+        nc = netCDF4.Dataset(self.datafile)
+        try:
+            cache = SlabCache(backing=DiskSlabCache(self.cachedir, self.datafile, nc=nc))
+            return readplan.read(nc.variables['zeta'], indices, cache=cache, name="zeta"), cache
+        finally:
+            nc.close()
+
+    def test_survives_restart(self):
+        first, cache = self.read([np.arange(0, 10), np.arange(0, 50)])
+        assert cache.backing.misses == 1 and len(os.listdir(self.cachedir)) == 1
+
+        # A new cache, as after a restart, reads the slab from disk
+        second, cache = self.read([np.arange(2, 5), np.arange(0, 50)[::-1]])
+        assert cache.backing.misses == 1
+        second, cache = self.read([np.arange(0, 10), np.arange(0, 50)])
+        assert cache.backing.hits == 1
+        assert (second == first).all() and second.mask[0, 0] and not second.mask[0, 1]
+
+    def test_changed_dataset(self):
+        first, cache = self.read([np.arange(0, 10), np.arange(0, 50)])
+        self.write(self.data + 1)
+        os.utime(self.datafile, (1, 1))
+        second, cache = self.read([np.arange(0, 10), np.arange(0, 50)])
+        assert cache.backing.hits == 0
+        assert (second[:, 1:] == self.data[:, 1:50]).all()
+
+    def test_remote_version(self):
+        nc = netCDF4.Dataset(self.datafile)
+        try:
+            url = "http://example.com/thredds/dodsC/remote.nc"
+            assert dataset_version(url, nc) is None and dataset_version(nc) is None
+            assert dataset_version(self.datafile) is not None
+            assert dataset_version(os.path.join(self.tmpdir, "*.nc")) == dataset_version(self.datafile)
+            # Nothing is cached without a version
+            disk = DiskSlabCache(self.cachedir, url, nc=nc)
+            disk.put("zeta", ((0, 10), (0, 10)), self.data[:, :10])
+            assert disk.get("zeta", ((0, 10), (0, 10))) is None and len(os.listdir(self.cachedir)) == 0
+            # unless one is given
+            disk = DiskSlabCache(self.cachedir, url, version='"etag-1"')
+            disk.put("zeta", ((0, 10), (0, 10)), self.data[:, :10])
+            assert (disk.get("zeta", ((0, 10), (0, 10))) == self.data[:, :10]).all()
+            assert DiskSlabCache(self.cachedir, url, version='"etag-2"').get("zeta", ((0, 10), (0, 10))) is None
+        finally:
+            nc.close()
+
+    def test_shared_directory(self):
+        os.makedirs(self.cachedir)
+        nc = netCDF4.Dataset(self.datafile)
+        try:
+            sidecar = os.path.join(self.cachedir, "0" * 40 + ".coords.npz")
+            coords = CoordinateCache(sidecar, self.datafile)
+            coords.put(("depth", "z"), {"data" : np.arange(3.)})
+            np.savez(os.path.join(self.cachedir, "mine.npz"), data=np.arange(3.))
+            others = sorted(os.listdir(self.cachedir))
+            disk = DiskSlabCache(self.cachedir, self.datafile, nc=nc)
+            assert disk.nbytes == 0
+            disk.put("zeta", ((0, 10), (0, 10)), self.data[:, :10])
+            disk.max_bytes = disk.nbytes
+            disk.put("zeta", ((0, 10), (10, 20)), self.data[:, 10:20])
+            assert disk.evictions == 1 and len(os.listdir(self.cachedir)) == len(others) + 1
+            disk.clear()
+            assert sorted(os.listdir(self.cachedir)) == others
+            assert CoordinateCache(sidecar, self.datafile).get(("depth", "z")) is not None
+        finally:
+            nc.close()
+
+    def test_no_pickles(self):
+        disk = DiskSlabCache(self.cachedir, self.datafile)
+        disk.put("zeta", ((0, 10), (0, 10)), self.data[:, :10])
+        path, = [os.path.join(self.cachedir, f) for f in os.listdir(self.cachedir)]
+        # A file holding an object array in place of the slab is not loaded
+        with open(path, "wb") as f:
+            np.savez(f, data=np.asarray([{}, None], dtype=object))
+        assert disk.get("zeta", ((0, 10), (0, 10))) is None and disk.misses == 1
+
+    def test_counts_bytes_once(self):
+        disk = DiskSlabCache(self.cachedir, self.datafile)
+        disk.put("zeta", ((0, 10), (0, 10)), self.data[:, :10])
+        disk.put("zeta", ((0, 10), (10, 20)), self.data[:, 10:20])
+        # Writing the same slab again replaces it
+        disk.put("zeta", ((0, 10), (10, 20)), self.data[:, 10:20])
+        sizes = [os.path.getsize(os.path.join(self.cachedir, f)) for f in os.listdir(self.cachedir)]
+        assert len(sizes) == 2 and disk.nbytes == sum(sizes)
+        listdir = os.listdir
+        calls = []
+        def counting(path):
+            calls.append(path)
+            return listdir(path)
+        os.listdir = counting
+        try:
+            disk.put("zeta", ((0, 10), (20, 30)), self.data[:, 20:30])
+            assert len(calls) == 0
+            # Another process sees what is on disk
+            assert DiskSlabCache(self.cachedir, self.datafile).nbytes == disk.nbytes
+            assert len(calls) == 1
+            disk.max_bytes = disk.nbytes
+            disk.put("zeta", ((0, 10), (30, 40)), self.data[:, 30:40])
+            assert len(calls) == 2 and disk.evictions == 1
+        finally:
+            os.listdir = listdir
+        assert disk.nbytes == sum(os.path.getsize(os.path.join(self.cachedir, f)) for f in os.listdir(self.cachedir))
+
+    def test_size_limit(self):
+        nc = netCDF4.Dataset(self.datafile)
+        disk = DiskSlabCache(self.cachedir, self.datafile, nc=nc)
+        nc.close()
+        slab = self.data[:, :10]
+        disk.put("zeta", ((0, 10), (0, 10)), slab)
+        disk.max_bytes = int(disk.nbytes * 2.5)
+        disk.put("zeta", ((0, 10), (10, 20)), self.data[:, 10:20])
+        for path in os.listdir(self.cachedir):
+            os.utime(os.path.join(self.cachedir, path), (1, 1))
+        assert disk.get("zeta", ((0, 10), (0, 10))) is not None
+        disk.put("zeta", ((0, 10), (20, 30)), self.data[:, 20:30])
+        assert disk.evictions == 1 and len(os.listdir(self.cachedir)) == 2
+        assert disk.get("zeta", ((0, 10), (10, 20))) is None
+        assert (disk.get("zeta", ((0, 10), (0, 10))) == slab).all()
+
+class CoordinateCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.tmpdir, "grid.nc")
+        self.sidecar = self.datafile + ".coords.npz"
+        nc = netCDF4.Dataset(self.datafile, "w")
+        nc.createDimension("time", 24)
+        nc.createDimension("s_rho", 3)
+        nc.createDimension("eta_rho", 20)
+        nc.createDimension("xi_rho", 25)
+        time = nc.createVariable("ocean_time", "f8", ("time",))
+        time.units = "seconds since 2012-01-01 00:00:00"
+        time[:] = np.arange(24) * 3600.
+        s_rho = nc.createVariable("s_rho", "f8", ("s_rho",))
+        s_rho.units = "m"
+        s_rho.positive = "up"
+        s_rho[:] = [-0.9, -0.5, -0.1]
+        j, i = np.mgrid[0:20, 0:25].astype(float)
+        lon = nc.createVariable("lon_rho", "f8", ("eta_rho", "xi_rho"))
+        lon[:] = -70 + 0.05 * i - 0.02 * j
+        lat = nc.createVariable("lat_rho", "f8", ("eta_rho", "xi_rho"))
+        lat[:] = 40 + 0.02 * i + 0.05 * j
+        nc.close()
+        self.nc = netCDF4.Dataset(self.datafile)
+
+    def tearDown(self):
+        self.nc.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        cache = CoordinateCache(self.sidecar, self.datafile, nc=self.nc)
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        cache.put(("grid", "lon_rho", "lat_rho"), {"xarray" : grid._xarray, "yarray" : grid._yarray,
+                                                   "bbox" : grid.bbox})
+        time = Timevar(self.nc, "ocean_time")
+        cache.put(("time", "ocean_time"), {"data" : np.asarray(time), "axis" : time.axis,
+                                           "units" : "%s since %s" % (time._units, time.origin.isoformat())})
+        depth = Depthvar(self.nc, "s_rho")
+        cache.put(("depth", "s_rho"), {"data" : np.asarray(depth), "axis" : depth.axis})
+
+        # As another process would
+        cache = CoordinateCache(self.sidecar, self.datafile, nc=self.nc)
+        entry = cache.get(("grid", "lon_rho", "lat_rho"))
+        cached = Gridobj(self.nc, "lon_rho", "lat_rho", **entry)
+        # The index and polygon are rebuilt from the arrays
+        assert cached._spatialindex is None and cached._boundingpolygon is None
+        assert cached.bbox == grid.bbox and cached.boundingpolygon.equals(grid.boundingpolygon)
+        point = Location4D(latitude=40.4, longitude=-69.5)
+        assert cached.near_xy(point=point) == grid.near_xy(point=point)
+
+        entry = cache.get(("time", "ocean_time"))
+        cached = Timevar(self.nc, "ocean_time", units=entry["units"], data=entry["data"], axis=entry["axis"])
+        assert (cached.dates == time.dates).all()
+        assert cached.nearest_index(time.dates[5]) == [5]
+
+        entry = cache.get(("depth", "s_rho"))
+        cached = Depthvar(self.nc, "s_rho", data=entry["data"], axis=entry["axis"])
+        assert (cached == depth).all() and cached._positive == "up"
+
+    def test_no_pickles(self):
+        cache = CoordinateCache(self.sidecar, self.datafile, nc=self.nc)
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        self.assertRaises(TypeError, cache.put, ("grid", "lon_rho", "lat_rho"), {"spatialindex" : grid.spatialindex})
+        self.assertRaises(TypeError, cache.put, ("grid", "lon_rho", "lat_rho"), {"boundingpolygon" : grid.boundingpolygon})
+        assert not os.path.exists(self.sidecar)
+        x = np.ma.masked_invalid([1., np.nan, 3.])
+        cache.put(("depth", "z"), {"data" : x, "axis" : (x.data, np.arange(2)), "units" : "m", "step" : 0.5})
+        with np.load(self.sidecar, allow_pickle=False) as stored:
+            assert all(stored[name].dtype.kind != 'O' for name in stored.files)
+        entry = CoordinateCache(self.sidecar, self.datafile, nc=self.nc).get(("depth", "z"))
+        assert (entry["data"].mask == [False, True, False]).all() and entry["data"][2] == 3
+        assert np.isnan(entry["axis"][0][1]) and (entry["axis"][1] == [0, 1]).all()
+        assert entry["units"] == "m" and entry["step"] == 0.5
+
+    def test_entries_are_copies(self):
+        cache = CoordinateCache(self.sidecar, self.datafile, nc=self.nc)
+        x = np.arange(5.)
+        cache.put(("grid", "x", "y"), {"xarray" : x, "yarray" : x})
+        x[:] = np.nan
+        entry = cache.get(("grid", "x", "y"))
+        entry["xarray"][:] = np.nan
+        assert np.isfinite(cache.get(("grid", "x", "y"))["xarray"]).all()
+
+    def test_changed_dataset(self):
+        cache = CoordinateCache(self.sidecar, self.datafile, nc=self.nc)
+        cache.put(("depth", "s_rho"), {"data" : np.zeros(3), "axis" : None})
+        assert CoordinateCache(self.sidecar, self.datafile, nc=self.nc).get(("depth", "s_rho")) is not None
+        os.utime(self.datafile, (1, 1))
+        assert CoordinateCache(self.sidecar, self.datafile, nc=self.nc).get(("depth", "s_rho")) is None
+        # A corrupt sidecar is ignored
+        with open(self.sidecar, "wb") as f:
+            f.write(b"garbage")
+        assert CoordinateCache(self.sidecar, self.datafile, nc=self.nc).get(("depth", "s_rho")) is None
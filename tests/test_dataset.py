@@ -1,5 +1,6 @@
 from paegan.cdm.dataset import CommonDataset
-import unittest, os, pytz
+import unittest, os, pytz, tempfile, shutil
+import netCDF4
 from datetime import datetime
 import numpy as np
 from shapely.geometry import Polygon, box
@@ -306,3 +307,245 @@ class DatasetTest(unittest.TestCase):
         assert pd._datasettype == 'rgrid'
         values = pd.get_values(var="u", bbox=[-149, 59, -144, 61.5], timeinds=0)
         assert values.size > 0
+
+
+class SyntheticDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.tmpdir, "cgrid.nc")
+        nc = netCDF4.Dataset(self.datafile, "w")
+        nc.createDimension("ocean_time", 5)
+        nc.createDimension("s_rho", 3)
+        nc.createDimension("eta_rho", 20)
+        nc.createDimension("xi_rho", 25)
+        time = nc.createVariable("ocean_time", "f8", ("ocean_time",))
+        time.units = "seconds since 2012-01-01 00:00:00"
+        time[:] = np.arange(5) * 3600.
+        s_rho = nc.createVariable("s_rho", "f8", ("s_rho",))
+        s_rho.positive = "up"
+        s_rho[:] = [-0.9, -0.5, -0.1]
+        j, i = np.mgrid[0:20, 0:25].astype(float)
+        lon = nc.createVariable("lon_rho", "f8", ("eta_rho", "xi_rho"))
+        lon[:] = -70 + 0.05 * i - 0.01 * j
+        lat = nc.createVariable("lat_rho", "f8", ("eta_rho", "xi_rho"))
+        lat[:] = 40 + 0.01 * i + 0.05 * j
+        self.data = {}
+        for name, offset in [("temp", 0.), ("salt", 0.5)]:
+            var = nc.createVariable(name, "f4", ("ocean_time", "s_rho", "eta_rho", "xi_rho"))
+            var.coordinates = "lon_rho lat_rho s_rho ocean_time"
+            self.data[name] = np.arange(5 * 3 * 20 * 25, dtype='f4').reshape(5, 3, 20, 25) + offset
+            var[:] = self.data[name]
+        h = nc.createVariable("h", "f4", ("eta_rho", "xi_rho"))
+        h.coordinates = "lon_rho lat_rho"
+        h[:] = i + 100 * j
+        nc.close()
+        self.ds = CommonDataset.open(self.datafile)
+
+    def tearDown(self):
+        self.ds.closenc()
+        shutil.rmtree(self.tmpdir)
+
+    def test_restrict_vars_drops_descriptors(self):
+        ds = self.ds
+        assert ds.get_coord_descriptor("salt").shape == (5, 3, 20, 25)
+        assert ds.get_coord_descriptor("temp").shape == (5, 3, 20, 25)
+        temp = ds.restrict_vars(["temp"])
+        assert "salt" not in temp._current_variables and "salt" not in temp._descriptorcache
+        assert "temp" in temp._current_variables and "ocean_time" in temp._current_variables
+        # The dataset it came from keeps them
+        assert "salt" in ds._current_variables and "salt" in ds._descriptorcache
+        assert (temp.get_values("temp") == self.data["temp"]).all()
+
+    def test_shared_coordinate_objects(self):
+        ds = self.ds
+        grid = ds.getgridobj("temp")
+        assert ds.getgridobj("salt") is grid and ds.getgridobj("h") is grid
+        assert ds.gettimevar("salt") is ds.gettimevar("temp")
+        assert ds.getdepthvar("salt") is ds.getdepthvar("temp")
+        # Restricted views share the restricted objects in the same way
+        view = ds.restrict_time((datetime(2012, 1, 1, 1, tzinfo=pytz.utc), datetime(2012, 1, 1, 3, tzinfo=pytz.utc)))
+        assert view.gettimevar("salt") is view.gettimevar("temp")
+        assert view.gettimevar("temp") is not ds.gettimevar("temp")
+        assert view.getgridobj("h") is grid
+
+    def test_views_leave_parent_unchanged(self):
+        ds = self.ds
+        full = ds.get_values("temp")
+        timevar = ds.gettimevar("temp")
+        view = ds.restrict_time((datetime(2012, 1, 1, 1, tzinfo=pytz.utc), datetime(2012, 1, 1, 2, tzinfo=pytz.utc)))
+        view = view.restrict_vars(["temp"])
+        assert (view.get_values("temp") == self.data["temp"][1:3]).all()
+        assert ds.gettimevar("temp") is timevar and timevar.window is None
+        assert (ds.get_values("temp") == full).all() and "salt" in ds._current_variables
+        assert ds.gettimebounds("temp")[1] == datetime(2012, 1, 1, 4, tzinfo=pytz.utc)
+
+    def test_empty_restrictions(self):
+        ds = self.ds
+        assert ds.gettimestep("temp") == 3600
+        assert ds.getdepthbounds("temp") == (-0.9, -0.1)
+        later = ds.restrict_time((datetime(2012, 2, 1, tzinfo=pytz.utc), datetime(2012, 3, 1, tzinfo=pytz.utc)))
+        assert later.gettimebounds("temp") is None and later.gettimebounds("temp", units="hours since 2012-01-01") is None
+        assert later.gettimestep("temp") is None
+        single = ds.restrict_time((datetime(2012, 1, 1, 2, tzinfo=pytz.utc), datetime(2012, 1, 1, 2, tzinfo=pytz.utc)))
+        assert single.gettimestep("temp") is None
+        assert single.gettimebounds("temp") == (datetime(2012, 1, 1, 2, tzinfo=pytz.utc),) * 2
+        deeper = ds.restrict_depth((-5, -2))
+        assert deeper.getdepthbounds("temp") is None and deeper.getdepthbounds("temp", units="m") is None
+
+    def test_views_outlive_closed_parent(self):
+        view = self.ds.restrict_depth((-0.6, 0))
+        self.ds.closenc()
+        assert self.ds.nc is None
+        # The view opens the file again
+        assert (view.get_values("temp") == self.data["temp"][:, 1:]).all()
+        again = view.restrict_vars(["salt"])
+        view.closenc()
+        assert (again.get_values("salt", timeinds=[2]) == self.data["salt"][2, 1:]).all()
+        again.closenc()
+
+    def test_chained_restrictions_match_eager(self):
+        ds = self.ds
+        times = (datetime(2012, 1, 1, 1, tzinfo=pytz.utc), datetime(2012, 1, 1, 3, tzinfo=pytz.utc))
+        depths = (-0.6, 0)
+        bbox = (-69.6, 40.2, -69.2, 40.6)
+        eager = ds.get_values("temp", timebounds=times, zbounds=depths, bbox=bbox)
+        rows, cols = ds.get_xyind_from_bbox("temp", bbox)[0][0]
+        assert eager.shape == (3, 2, rows.size, cols.size) and rows.size > 1 and cols.size > 1
+        assert (eager == self.data["temp"][1:4, 1:][:, :, rows][:, :, :, cols]).all()
+        # In any order, and the same again from the other variables
+        chains = [ds.restrict_time(times).restrict_depth(depths).restrict_bbox(bbox),
+                  ds.restrict_bbox(bbox).restrict_time(times).restrict_depth(depths),
+                  ds.restrict_depth(depths).restrict_bbox(bbox).restrict_time(times)]
+        for chained in chains:
+            assert chained.get_values("salt").shape == eager.shape
+            assert (chained.get_values("temp") == eager).all()
+            coords = chained.sub_coords("temp")
+            eager_coords = ds.sub_coords("temp", timebounds=times, zbounds=depths, bbox=bbox)
+            assert (coords.x == eager_coords.x).all() and (coords.time == eager_coords.time).all()
+            assert (np.asarray(coords.z) == np.asarray(eager_coords.z)).all()
+        # Restrictions only ever narrow
+        narrower = chains[0].restrict_time((times[0], times[0]))
+        assert (narrower.get_values("temp") == eager[0:1]).all()
+
+    def test_get_many_values(self):
+        ds = self.ds
+        times = (datetime(2012, 1, 1, 1, tzinfo=pytz.utc), datetime(2012, 1, 1, 3, tzinfo=pytz.utc))
+        bbox = (-69.6, 40.2, -69.2, 40.6)
+        names = ["temp", "salt", "h"]
+        single = dict((name, ds.get_values(name, timebounds=times, bbox=bbox)) for name in names)
+        many = ds.get_values(names, timebounds=times, bbox=bbox)
+        # From a fresh dataset so the threads do the reads themselves
+        fresh = CommonDataset.open(self.datafile)
+        threaded = fresh.get_many_values(names * 4, timebounds=times, bbox=bbox, workers=4)
+        fresh.closenc()
+        assert sorted(many.keys()) == sorted(names) and sorted(threaded.keys()) == sorted(names)
+        for name in names:
+            assert many[name].shape == single[name].shape and (many[name] == single[name]).all()
+            assert (threaded[name] == single[name]).all()
+        assert single["temp"].shape[0] == 3 and (single["salt"] == single["temp"] + 0.5).all()
+
+    def test_iter_values_alongside_reads(self):
+        ds = self.ds
+        bbox = (-69.6, 40.2, -69.2, 40.6)
+        rows, cols = ds.get_xyind_from_bbox("temp", bbox)[0][0]
+        expected = self.data["temp"][:, :, rows][:, :, :, cols]
+        blocks = []
+        for dates, block in ds.iter_values("temp", steps=2, readahead=2, bbox=bbox):
+            # The caller reads the same file while the next blocks are read
+            for tind in range(5):
+                assert (ds.get_values("salt", timeinds=[tind]) == self.data["salt"][tind]).all()
+            blocks.append(block)
+        assert [b.shape[0] for b in blocks] == [2, 2, 1]
+        assert (np.concatenate(blocks) == expected).all()
+
+    def test_field_window_alongside_reads(self):
+        ds = self.ds
+        view = ds.restrict_depth((-0.6, 0))
+        window = view.field_window(["temp", "salt"], ahead=3)
+        try:
+            for step in window.steps:
+                # Reads of the same file from the caller, and from a view
+                # sharing the handle, while the window reads ahead
+                with ds.lock:
+                    h = ds.nc.variables["h"][:]
+                assert (ds.get_values("h") == h).all()
+                assert (view.get_values("temp", timeinds=[4 - step]) == self.data["temp"][4 - step, 1:]).all()
+                fields = window.get(step)
+                assert (fields["temp"] == self.data["temp"][step, 1:]).all()
+                assert (fields["salt"] == self.data["salt"][step, 1:]).all()
+        finally:
+            window.close()
+
+    def test_values_on_grid_with_layered_depths(self):
+        import paegan.cdm.dataset as dataset
+        ds = self.ds
+        calls = []
+
+        class Recorder(object):
+            def __init__(self, data, lon, lat, t=None, z=None, **kwargs):
+                calls.append((np.shape(data), np.shape(z), kwargs["method"]))
+            def interpgrid(self, lon, lat, t=None, z=None, **kwargs):
+                return "griddata"
+
+        sub_coords = ds.sub_coords
+        def layered(var, **kwargs):
+            # s-coordinate depths, one per layer and node
+            coords = sub_coords(var, **kwargs)
+            coords.z = np.asarray(coords.z)[:, None, None] * np.ones(coords.x.shape)
+            return coords
+
+        lon, lat = np.linspace(-69.5, -69.3, 3), np.linspace(40.3, 40.5, 4)
+        regular = ds.get_values_on_grid("temp", lon, lat, method="bilinear")
+        assert regular.shape == (5, 3, 4, 3)
+        ds.sub_coords = layered
+        original = dataset.CfGeoInterpolator
+        dataset.CfGeoInterpolator = Recorder
+        try:
+            for method in ["nearest", "linear", "bilinear"]:
+                assert ds.get_values_on_grid("temp", lon, lat, method=method) == "griddata"
+        finally:
+            dataset.CfGeoInterpolator = original
+        assert [c[2] for c in calls] == ["nearest", "linear", "linear"]
+        assert all(len(c[1]) == 3 and c[0][1:] == c[1] for c in calls)
+
+
+class SyntheticNCellTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.tmpdir, "ncell.nc")
+        nc = netCDF4.Dataset(self.datafile, "w")
+        nc.createDimension("time", 4)
+        nc.createDimension("node", 400)
+        rs = np.random.RandomState(0)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "days since 2013-01-01"
+        time[:] = np.arange(4) * 0.5
+        lon = nc.createVariable("lon", "f8", ("node",))
+        lon[:] = -70 + rs.rand(400)
+        lat = nc.createVariable("lat", "f8", ("node",))
+        lat[:] = 40 + rs.rand(400)
+        zeta = nc.createVariable("zeta", "f8", ("time", "node"))
+        zeta.coordinates = "time lat lon"
+        # Linear in lon and lat, so linear interpolation is exact
+        zeta[:] = np.arange(4)[:, None] + 10 * (lon[:] + 70) + 100 * (lat[:] - 40)
+        nc.close()
+        self.ds = CommonDataset.open(self.datafile)
+
+    def tearDown(self):
+        self.ds.closenc()
+        shutil.rmtree(self.tmpdir)
+
+    def test_structured_methods(self):
+        ds = self.ds
+        assert ds._datasettype == 'ncell'
+        lon, lat = np.linspace(-69.7, -69.3, 5), np.linspace(40.3, 40.7, 4)
+        expected = np.arange(4)[:, None, None] + 10 * (lon + 70)[None, None, :] + 100 * (lat - 40)[None, :, None]
+        linear = ds.get_values_on_grid("zeta", lon, lat, method="linear")
+        # Only the nodes inside the bounds are read, the edges may be NaN
+        inside = np.isfinite(linear)
+        assert linear.shape == (4, 4, 5) and inside[:, 1:-1, 1:-1].all()
+        assert np.allclose(linear[inside], expected[inside])
+        for method in ["bilinear", "trilinear"]:
+            assert np.allclose(ds.get_values_on_grid("zeta", lon, lat, method=method), linear, equal_nan=True)
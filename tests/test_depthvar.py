@@ -1,4 +1,4 @@
-import unittest, os, netCDF4, pytz
+import unittest, os, netCDF4, pytz, tempfile, shutil
 from datetime import timedelta, datetime, tzinfo
 from paegan.cdm.depthvar import Depthvar
 import numpy as np
@@ -32,3 +32,73 @@ class DepthvarTest(unittest.TestCase):
       cents = dvar.centimeters
       assert ((data * 100) == cents).all()
 
+
+
+class DepthvarIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.tmpdir, "depths.nc")
+        nc = netCDF4.Dataset(self.datafile, "w")
+        nc.createDimension("depth", 6)
+        depth = nc.createVariable("depth", "f8", ("depth",))
+        depth.units = "cm"
+        depth.positive = "down"
+        depth[:] = [500., 0., 2000., 1000., 250., 5000.]
+        nc.createDimension("height", 3)
+        height = nc.createVariable("height", "f8", ("height",))
+        height.units = "m"
+        height.positive = "up"
+        height[:] = [0., 5., 10.]
+        nc.close()
+        self.nc = netCDF4.Dataset(self.datafile)
+
+    def tearDown(self):
+        self.nc.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_nearest_index(self):
+        dvar = Depthvar(self.nc, 'depth')
+        assert dvar._positive == 'down'
+        assert (dvar.axis[2] == [0., 2.5, 5., 10., 20., 50.]).all()
+        assert dvar.nearest_index(4.)[0] == 0
+        assert dvar.nearest_index(100.)[0] == 5
+        assert dvar.nearest(12.) == 10.
+        assert (dvar.nearest_index(np.array([-3., 1., 19., 36.])) == [1, 1, 2, 5]).all()
+        # Depths given as positive up are flipped
+        assert (dvar.nearest_index([-19., 21.], positive='up') == [2, 1]).all()
+
+    def test_opposite_positive(self):
+        dvar = Depthvar(self.nc, 'depth')
+        height = Depthvar(self.nc, 'height')
+        # Neither takes the units or positive of the other
+        assert dvar._positive == 'down' and height._positive == 'up'
+        assert dvar._units == 'centimeters' and height._units == 'meters'
+        assert dvar.nearest_index(10., positive='down')[0] == 3
+        assert height.nearest_index(10., positive='up')[0] == 2
+        assert height.nearest_index(-5., positive='down')[0] == 1
+        # Slices and views keep them
+        assert dvar[1:3]._positive == 'down' and dvar.restrict([0, 1])._units == 'centimeters'
+
+    def test_nearest_index_ignores_nan(self):
+        dvar = Depthvar(self.nc, 'depth')
+        dvar[0] = np.nan
+        dvar.reset_axis()
+        assert dvar.nearest_index(4.)[0] == 4
+
+    def test_bounds_index(self):
+        dvar = Depthvar(self.nc, 'depth')
+        inds = dvar.bounds_index([250., 2000.])[0]
+        data = self.nc.variables['depth'][:]
+        assert (inds == np.where((data >= 250.) & (data <= 2000.))[0]).all()
+        assert (dvar.bounds_index([-2000., -250.], positive='up')[0] == inds).all()
+        assert dvar.bounds_index([6000., 7000.])[0].size == 0
+
+    def test_restrict(self):
+        dvar = Depthvar(self.nc, 'depth')
+        restricted = dvar.restrict(dvar.bounds_index([250., 2000.])[0])
+        assert dvar.window is None
+        assert (restricted.window == [0, 2, 3, 4]).all()
+        assert np.may_share_memory(restricted, dvar)
+        assert restricted.nearest_index(100.)[0] == 2
+        assert (restricted.bounds_index([0., 600.])[0] == [0, 4]).all()
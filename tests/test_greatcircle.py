@@ -1,5 +1,6 @@
 import math
 import unittest
+import numpy as np
 from paegan.utils.asagreatcircle import AsaGreatCircle
 from paegan.utils.asamath import AsaMath
 from paegan.location4d import Location4D
@@ -40,3 +41,82 @@ class GreatCircleTest(unittest.TestCase):
         # We should have gone up and to the left
         assert new_pt.latitude > starting.latitude + 0.45
         assert new_pt.longitude < starting.longitude - 0.45
+
+    def test_great_distance_arrays_match_scalar(self):
+        lats = np.asarray([40.0, 40.5, -33.2, 0.0, 40.0])
+        lons = np.asarray([-76.0, -70.2, 151.1, 10.0, -76.0])
+        end = Location4D(latitude=40.0, longitude=-76.0)
+
+        result = AsaGreatCircle.great_distance(start_lats=lats, start_lons=lons,
+                                               end_lats=end.latitude, end_lons=end.longitude)
+        for i in range(lats.size):
+            single = AsaGreatCircle.great_distance(start_point=Location4D(latitude=lats[i], longitude=lons[i]), end_point=end)
+            assert np.allclose(result['distance'][i], single['distance'], atol=1e-6)
+            assert np.allclose(result['azimuth'][i], single['azimuth'])
+            assert np.allclose(result['reverse_azimuth'][i], single['reverse_azimuth'])
+        # Same start and end point
+        assert result['distance'][-1] == 0
+
+        lats[1] = np.nan
+        result = AsaGreatCircle.great_distance(start_lats=lats, start_lons=lons,
+                                               end_lats=end.latitude, end_lons=end.longitude)
+        assert np.isnan(result['distance'][1])
+        assert np.isfinite(result['distance'][0])
+
+    def test_great_circle_arrays_match_scalar(self):
+        starting = Location4D(latitude=40.00, longitude=-76.00, depth=0)
+        azimuths = np.asarray([0, 45, 90, 180, 270, 315])
+        distances = np.asarray([111000, 5000, 0, 250000, 1, 111000])
+
+        result = AsaGreatCircle.great_circle(distance=distances, azimuth=azimuths, start_point=starting)
+        for i in range(azimuths.size):
+            single = AsaGreatCircle.great_circle(distance=distances[i], azimuth=azimuths[i], start_point=starting)
+            assert np.allclose(result['latitude'][i], single['latitude'])
+            assert np.allclose(result['longitude'][i], single['longitude'])
+            assert np.allclose(result['reverse_azimuth'][i], single['reverse_azimuth'])
+
+    def test_great_circle_ensemble(self):
+        lats = np.asarray([40.0, 41.5, -12.0, 60.25])
+        lons = np.asarray([-76.0, -70.0, 45.0, -150.5])
+        azimuths = np.asarray([10, 100, 200, 300])
+        distances = np.asarray([1000, 25000, 0, 111000])
+
+        result = AsaGreatCircle.great_circle(distance=distances, azimuth=azimuths, start_lats=lats, start_lons=lons)
+        assert result['latitude'].shape == lats.shape
+        for i in range(lats.size):
+            starting = Location4D(latitude=lats[i], longitude=lons[i])
+            single = AsaGreatCircle.great_circle(distance=distances[i], azimuth=azimuths[i], start_point=starting)
+            assert np.allclose(result['latitude'][i], single['latitude'])
+            assert np.allclose(result['longitude'][i], single['longitude'])
+            assert np.allclose(result['reverse_azimuth'][i], single['reverse_azimuth'])
+
+        # A single heading and distance applied to every particle
+        result = AsaGreatCircle.great_circle(distance=111000, azimuth=0, start_lats=lats, start_lons=lons)
+        assert np.all(result['latitude'] > lats + 0.9)
+        assert np.allclose(result['longitude'], lons)
+
+    def test_cheap_methods_within_error_bounds(self):
+        rs = np.random.RandomState(0)
+        lats = rs.uniform(-70, 70, 1000)
+        lons = rs.uniform(-180, 180, 1000)
+        azimuths = rs.uniform(0, 360, 1000)
+        distances = rs.uniform(10, 100000, 1000)
+        ends = AsaGreatCircle.great_circle(distance=distances, azimuth=azimuths, start_lats=lats, start_lons=lons)
+
+        for method in ['haversine', 'equirectangular']:
+            result = AsaGreatCircle.great_distance(start_lats=lats, start_lons=lons,
+                                                   end_lats=ends['latitude'], end_lons=ends['longitude'], method=method)
+            assert np.all(np.abs(result['distance'] - distances) / distances < 0.006)
+
+            moved = AsaGreatCircle.great_circle(distance=distances, azimuth=azimuths, start_lats=lats, start_lons=lons, method=method)
+            result = AsaGreatCircle.great_distance(start_lats=lats, start_lons=lons,
+                                                   end_lats=moved['latitude'], end_lons=moved['longitude'])
+            assert np.all(np.abs(result['distance'] - distances) / distances < 0.006)
+
+        starting = Location4D(latitude=40.00, longitude=-76.00)
+        new_gc = AsaGreatCircle.great_circle(distance=111000, azimuth=90, start_point=starting, method='haversine')
+        assert new_gc['longitude'] > starting.longitude + 0.9
+        assert np.allclose(new_gc['reverse_azimuth'], 270, atol=1)
+
+        with self.assertRaises(ValueError):
+            AsaGreatCircle.great_distance(start_point=starting, end_point=starting, method='flat')
@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+import unittest
+import netCDF4
+import numpy as np
+from paegan.cdm.gridvar import Gridobj
+from paegan.location4d import Location4D
+from paegan.utils.asagreatcircle import AsaGreatCircle
+
+class GridobjTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.tmpdir, "curvilinear.nc")
+        nc = netCDF4.Dataset(self.datafile, "w")
+        nc.createDimension("eta_rho", 30)
+        nc.createDimension("xi_rho", 40)
+        nc.createDimension("node", 500)
+        j, i = np.mgrid[0:30, 0:40].astype(float)
+        angle = np.radians(25)
+        lon = nc.createVariable("lon_rho", "f8", ("eta_rho", "xi_rho"))
+        lon[:] = -70 + 0.05 * (i * np.cos(angle) - j * np.sin(angle))
+        lat = nc.createVariable("lat_rho", "f8", ("eta_rho", "xi_rho"))
+        lat[:] = 40 + 0.05 * (i * np.sin(angle) + j * np.cos(angle))
+        rs = np.random.RandomState(42)
+        lon = nc.createVariable("lon", "f8", ("node",))
+        lon[:] = -70 + rs.rand(500)
+        lat = nc.createVariable("lat", "f8", ("node",))
+        lat[:] = 40 + rs.rand(500)
+        nc.close()
+        self.nc = netCDF4.Dataset(self.datafile)
+
+    def tearDown(self):
+        self.nc.close()
+        shutil.rmtree(self.tmpdir)
+
+    def brute_force(self, grid, point):
+        distance = AsaGreatCircle.great_distance(start_lats=grid._yarray, start_lons=grid._xarray,
+                                                 end_lats=point.latitude, end_lons=point.longitude)["distance"]
+        return np.where(distance == np.nanmin(distance))
+
+    def test_near_xy_cgrid(self):
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        for lat, lon in [(40.5, -69.5), (41.1, -68.8), (40.01, -70.2), (42.0, -67.0)]:
+            point = Location4D(latitude=lat, longitude=lon)
+            yinds, xinds = grid.near_xy(point=point)
+            byinds, bxinds = self.brute_force(grid, point)
+            assert np.all(yinds == byinds)
+            assert np.all(xinds == bxinds)
+        assert grid.spatialindex[0].n == grid._xarray.size
+
+    def test_near_xy_ncell(self):
+        grid = Gridobj(self.nc, "lon", "lat")
+        point = Location4D(latitude=40.3, longitude=-69.6)
+        xinds, yinds = grid.near_xy(point=point, ncell=True)
+        assert np.all(xinds[0] == self.brute_force(grid, point)[0])
+
+        xinds, yinds = grid.near_xy(point=point, num=5, ncell=True)
+        distance = AsaGreatCircle.great_distance(start_lats=grid._yarray, start_lons=grid._xarray,
+                                                 end_lats=point.latitude, end_lons=point.longitude)["distance"]
+        assert np.all(xinds[0] == np.argsort(distance)[:5])
+
+    def test_near_xy_ignores_nan_nodes(self):
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        point = Location4D(latitude=40.5, longitude=-69.5)
+        yinds, xinds = grid.near_xy(point=point)
+        grid._xarray[yinds, xinds] = np.nan
+        grid.reset_spatialindex()
+        yinds2, xinds2 = grid.near_xy(point=point)
+        assert not (yinds2[0] == yinds[0] and xinds2[0] == xinds[0])
+        assert grid.spatialindex[0].n == grid._xarray.size - 1
+
+    def test_near_xy_methods(self):
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        for lat, lon in [(40.5, -69.5), (41.1, -68.8)]:
+            point = Location4D(latitude=lat, longitude=lon)
+            yinds, xinds = grid.near_xy(point=point)
+            for method in ['haversine', 'equirectangular']:
+                myinds, mxinds = grid.near_xy(point=point, method=method)
+                assert np.all(myinds == yinds) and np.all(mxinds == xinds)
+
+    def test_methods_refined_with_vincenty(self):
+        # Nodes whose spherical and ellipsoidal orders differ: a 0.3% longer
+        # north-south separation is nearer on the ellipsoid at 45N
+        nodes = np.asarray([[45.5, -70.], [45., -70.7055]])
+        grid = Gridobj(None, xarray=nodes[:, 1], yarray=nodes[:, 0])
+        point = Location4D(latitude=45., longitude=-70.)
+        distance = AsaGreatCircle.great_distance(start_lats=nodes[:, 0], start_lons=nodes[:, 1],
+                                                 end_lats=45., end_lons=-70.)["distance"]
+        expected = np.argmin(distance)
+        for method in ['vincenty', 'haversine', 'equirectangular']:
+            cheap = AsaGreatCircle.great_distance(start_lats=nodes[:, 0], start_lons=nodes[:, 1],
+                                                  end_lats=45., end_lons=-70., method=method)["distance"]
+            assert method == 'vincenty' or np.argmin(cheap) != expected
+            xinds, yinds = grid.near_xy(point=point, ncell=True, method=method)
+            assert xinds[0][0] == expected
+            xinds, yinds = grid.nearest_xy_indices([-70.], [45.], ncell=True, method=method)
+            assert xinds[0][0] == expected
+
+    def test_many_candidates_within_tolerance(self):
+        # A ring of nodes at (almost) the same spherical distance, closest
+        # on the sphere in bearing order, but nearest on the ellipsoid due
+        # south: more nodes could win than the few candidates per point
+        lat0, lon0 = np.radians(45.), np.radians(-70.)
+        bearing = np.radians(np.arange(0, 360, 30.))
+        d = np.radians(0.5) * (1 + 1e-6 * np.arange(bearing.size))
+        lat = np.arcsin(np.sin(lat0) * np.cos(d) + np.cos(lat0) * np.sin(d) * np.cos(bearing))
+        lon = lon0 + np.arctan2(np.sin(bearing) * np.sin(d) * np.cos(lat0), np.cos(d) - np.sin(lat0) * np.sin(lat))
+        grid = Gridobj(None, xarray=np.degrees(lon), yarray=np.degrees(lat))
+        distance = AsaGreatCircle.great_distance(start_lats=grid._yarray, start_lons=grid._xarray,
+                                                 end_lats=45., end_lons=-70.)["distance"]
+        assert np.argmin(distance) == 6
+        point = Location4D(latitude=45., longitude=-70.)
+        for method in ['vincenty', 'haversine', 'equirectangular']:
+            assert grid.near_xy(point=point, ncell=True, method=method)[0][0][0] == 6
+            xinds, yinds = grid.nearest_xy_indices([-70., -70.], [45., 46.], ncell=True, method=method)
+            assert xinds[0][0] == 6 and xinds[0][1] == np.argmax(grid._yarray)
+
+    def test_restrict(self):
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        rows, cols = np.arange(5, 15), np.arange(10, 30)
+        restricted = grid.restrict((rows, cols), (rows, cols))
+        assert grid._xwindow is None and grid.xwindow[0].size == 30
+        assert restricted._xarray is grid._xarray
+        assert restricted.xmin == np.min(grid._xarray[5:15, 10:30])
+        assert restricted.ymax == np.max(grid._yarray[5:15, 10:30])
+        assert restricted.spatialindex[0].n == rows.size * cols.size
+
+        # Nearest nodes are only looked for inside the window
+        point = Location4D(latitude=float(grid._yarray[0, 0]), longitude=float(grid._xarray[0, 0]))
+        yinds, xinds = restricted.near_xy(point=point)
+        assert yinds[0] in rows and xinds[0] in cols
+        inside = Location4D(latitude=float(grid._yarray[8, 20]), longitude=float(grid._xarray[8, 20]))
+        assert restricted.near_xy(point=inside) == grid.near_xy(point=inside)
+
+        xbool = restricted.get_xbool_from_bbox((-180, -90, 180, 90))
+        assert xbool.sum() == rows.size * cols.size and xbool[5:15, 10:30].all()
+        assert (restricted.restrict((rows[:3], cols), (rows[:3], cols)).xwindow[0] == [5, 6, 7]).all()
+
+    def test_nearest_xy_indices(self):
+        rs = np.random.RandomState(7)
+        lon = -70.6 + 2 * rs.rand(50)
+        lat = 39.9 + 2 * rs.rand(50)
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        xinds, yinds = grid.nearest_xy_indices(lon, lat)
+        ncell = Gridobj(self.nc, "lon", "lat")
+        nodes, nodes = ncell.nearest_xy_indices(lon, lat, ncell=True)
+        for i in range(lon.size):
+            point = Location4D(latitude=lat[i], longitude=lon[i])
+            rows, cols = grid.near_xy(point=point)
+            assert xinds[0][i] == rows[0] and xinds[1][i] == cols[0]
+            assert nodes[0][i] == ncell.near_xy(point=point, ncell=True)[0][0][0]
+
+    def test_locate_cells(self):
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        x, y = grid._xarray, grid._yarray
+        rs = np.random.RandomState(3)
+        rows, cols = rs.randint(0, 29, 200), rs.randint(0, 39, 200)
+        fy, fx = rs.rand(200), rs.rand(200)
+        def position(a, rows, cols, fy, fx):
+            return (1 - fy) * (1 - fx) * a[rows, cols] + (1 - fy) * fx * a[rows, cols + 1] + \
+                   fy * (1 - fx) * a[rows + 1, cols] + fy * fx * a[rows + 1, cols + 1]
+        lon, lat = position(x, rows, cols, fy, fx), position(y, rows, cols, fy, fx)
+        found_rows, found_cols, found_fy, found_fx, found = grid.locate_cells(lon, lat)
+        assert found.all()
+        assert (found_rows == rows).all() and (found_cols == cols).all()
+        assert np.allclose(found_fy, fy) and np.allclose(found_fx, fx)
+
+        # From the cells of the last step, and from wrong or missing hints
+        moved = grid.locate_cells(lon + 0.02, lat - 0.01, hint=(found_rows, found_cols))
+        hints = (np.where(rs.rand(200) < 0.5, -1, 0), np.zeros(200, dtype=int))
+        again = grid.locate_cells(lon + 0.02, lat - 0.01, hint=hints)
+        cold = grid.locate_cells(lon + 0.02, lat - 0.01)
+        for a, b, c in zip(moved, again, cold):
+            assert np.allclose(a, b, equal_nan=True) and np.allclose(a, c, equal_nan=True)
+        ok = moved[4]
+        assert np.allclose(position(x, *[m[ok] for m in moved[:4]]), lon[ok] + 0.02)
+
+        outside = grid.locate_cells([-75.], [30.], hint=([3], [4]))
+        assert outside[0] == [-1] and not outside[4][0]
+        # Only cells inside the windows
+        window = grid.restrict([np.arange(5, 10), np.arange(5, 12)], [np.arange(5, 10), np.arange(5, 12)])
+        inside = window.locate_cells(lon, lat)[4]
+        assert (inside == ((rows >= 5) & (rows < 9) & (cols >= 5) & (cols < 11))).all()
@@ -0,0 +1,84 @@
+import threading
+import unittest
+import time
+from paegan.cdm.prefetch import ReadAhead, FieldWindow
+
+class ReadAheadTest(unittest.TestCase):
+
+    def test_order_and_depth(self):
+        lock = threading.Lock()
+        started = []
+        def read(item):
+            with lock:
+                started.append(item)
+            return item * 10
+        results = []
+        for item, result in ReadAhead(read, range(20), depth=2):
+            results.append((item, result))
+            # Never more than depth reads done ahead, plus the one blocked on the queue
+            assert len(started) <= item + 4
+        assert results == [(i, i * 10) for i in range(20)]
+
+    def test_errors(self):
+        def read(item):
+            if item == 3:
+                raise IOError("bad read")
+            return item
+        seen = []
+        try:
+            for item, result in ReadAhead(read, range(10)):
+                seen.append(item)
+        except IOError:
+            pass
+        else:
+            raise AssertionError("the read error was not raised")
+        assert seen == [0, 1, 2]
+
+    def test_stop_early(self):
+        ahead = ReadAhead(lambda item: item, range(1000), depth=1)
+        for item, result in ahead:
+            break
+        ahead._thread.join(5)
+        assert not ahead._thread.is_alive()
+
+class FieldWindowTest(unittest.TestCase):
+
+    def wait_for(self, window, cached):
+        for i in range(500):
+            if window.cached == cached:
+                return
+            time.sleep(0.01)
+        raise AssertionError("%s != %s" % (window.cached, cached))
+
+    def test_slides_forward_and_backward(self):
+        reads = []
+        def read(step):
+            reads.append(step)
+            return {"u" : step * 2}
+        window = FieldWindow(read, [5, 4, 3, 2, 1], ahead=2)
+        try:
+            assert window.get(5) == {"u" : 10}
+            self.wait_for(window, [5, 4, 3])
+            assert window.get(4) == {"u" : 8}
+            self.wait_for(window, [4, 3, 2])
+            # Jumping moves the window, and nothing is read twice
+            assert window.get(1) == {"u" : 2}
+            self.wait_for(window, [1])
+            assert sorted(reads) == [1, 2, 3, 4, 5]
+            self.assertRaises(ValueError, window.get, 0)
+        finally:
+            window.close()
+
+    def test_errors(self):
+        failures = [3]
+        def read(step):
+            if step in failures:
+                failures.remove(step)
+                raise IOError("bad read")
+            return step
+        window = FieldWindow(read, range(5), ahead=1)
+        try:
+            self.assertRaises(IOError, window.get, 3)
+            assert window.get(3) == 3
+        finally:
+            window.close()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+import netCDF4
+import numpy as np
+from paegan.cdm.readplan import ReadPlan, read, _runs
+
+class CountingVariable(object):
+    """ Wraps a netCDF4 variable and records every read made from it """
+    def __init__(self, var):
+        self.var = var
+        self.shape = var.shape
+        self.dtype = var.dtype
+        self.reads = []
+
+    def __getitem__(self, item):
+        self.reads.append(item)
+        return self.var[item]
+
+class ReadPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.tmpdir, "slabs.nc")
+        nc = netCDF4.Dataset(self.datafile, "w")
+        nc.createDimension("time", 6)
+        nc.createDimension("depth", 4)
+        nc.createDimension("lat", 30)
+        nc.createDimension("lon", 40)
+        u = nc.createVariable("u", "f4", ("time", "depth", "lat", "lon"), fill_value=-999.)
+        self.data = np.arange(6 * 4 * 30 * 40, dtype='f4').reshape(6, 4, 30, 40)
+        u[:] = self.data
+        u[0, 0, 0, 0] = np.ma.masked
+        nc.close()
+        self.nc = netCDF4.Dataset(self.datafile)
+        self.var = CountingVariable(self.nc.variables['u'])
+
+    def tearDown(self):
+        self.nc.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_runs(self):
+        runs = _runs(np.r_[0:10, 20:40:2, 50, 60, 70, 90:95])
+        assert runs == [slice(0, 10, 1), slice(20, 39, 2), slice(50, 71, 10), slice(90, 95, 1)]
+        assert _runs(np.asarray([3, 7, 8, 9])) == [slice(3, 4, 1), slice(7, 10, 1)]
+        assert _runs(np.asarray([5])) == [slice(5, 6, 1)]
+
+    def test_contiguous_read(self):
+        # The defaults Dataset.get_indices builds run one past the end
+        indices = [np.arange(0, 7), np.arange(0, 5), np.arange(0, 12), np.arange(0, 41)]
+        data = read(self.var, indices)
+        assert len(self.var.reads) == 1
+        assert data.shape == (6, 4, 12, 40)
+        assert (data[:, :, :, 1:] == self.data[:, :, :12, 1:]).all()
+        assert data.mask[0, 0, 0, 0] and not data.mask[0, 0, 0, 1]
+
+    def test_orthogonal_selection(self):
+        indices = [np.asarray([4, 1, 1]), 2, np.asarray([0, 1, 2, 20, 22, 24]), np.asarray([39, 5])]
+        for overhead in [0, 10**9]:
+            self.var.reads = []
+            plan = ReadPlan(self.var.shape, indices, itemsize=4, overhead=overhead)
+            data = plan.read(self.var)
+            assert data.shape == (3, 6, 2)
+            expected = self.data[np.ix_([4, 1, 1], [2], [0, 1, 2, 20, 22, 24], [39, 5])][:, 0]
+            assert (data == expected).all()
+            if plan.slab:
+                assert len(self.var.reads) == 1
+            else:
+                assert len(self.var.reads) == plan.requests == 2 * 2 * 2
+        assert ReadPlan(self.var.shape, indices, itemsize=4, overhead=0).slab is False
+        assert ReadPlan(self.var.shape, indices, itemsize=4, overhead=10**9).slab is True
+
+    def test_scalars_and_empty(self):
+        data = read(self.var, [2, 3, 10, 11])
+        assert np.ndim(data) == 0 and data == self.data[2, 3, 10, 11]
+        data = read(self.var, [np.arange(6), 0, np.asarray([], dtype=int), 0])
+        assert data.shape == (6, 0)
+        assert len(self.var.reads) == 1
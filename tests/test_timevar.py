@@ -1,4 +1,4 @@
-import unittest, os, netCDF4, pytz
+import unittest, os, netCDF4, pytz, tempfile, shutil
 from datetime import timedelta, datetime, tzinfo
 from paegan.cdm.timevar import Timevar
 import numpy as np
@@ -120,3 +120,153 @@ class TimevarTest(unittest.TestCase):
         assert (jds == tvar.dates).all()
 
         ds.close()
+
+class TimevarIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        datafile = os.path.join(self.tmpdir, "hourly.nc")
+        nc = netCDF4.Dataset(datafile, "w")
+        nc.createDimension("time", 48)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "hours since 2012-04-01 00:00:00"
+        time[:] = np.arange(48)
+        nc.close()
+        self.nc = netCDF4.Dataset(datafile)
+        self.tvar = Timevar(self.nc, name='time')
+
+    def tearDown(self):
+        self.nc.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_nearest_index(self):
+        assert self.tvar.nearest_index(datetime(2012,4,1,5,20, tzinfo=pytz.utc)) == [5]
+        assert self.tvar.nearest_index(datetime(2012,4,1,5,40, tzinfo=pytz.utc)) == [6]
+        # Outside of the time range snaps to the ends
+        assert self.tvar.nearest_index(datetime(2012,3,1, tzinfo=pytz.utc)) == [0]
+        assert self.tvar.nearest_index(datetime(2012,5,1, tzinfo=pytz.utc)) == [47]
+
+        targets = [datetime(2012,4,1,h,m, tzinfo=pytz.utc) for h in range(0, 24, 3) for m in (0, 29, 31)]
+        inds = self.tvar.nearest_index(targets)
+        assert inds == [t.hour + (t.minute > 30) for t in targets]
+
+    def test_before_after_index(self):
+        targets = [datetime(2012,4,1,5,20, tzinfo=pytz.utc), datetime(2012,4,1,7, tzinfo=pytz.utc),
+                   datetime(2012,3,1, tzinfo=pytz.utc), datetime(2012,5,1, tzinfo=pytz.utc)]
+        assert (self.tvar.nearest_index(targets, select='before') == [5, 7, -1, 47]).all()
+        assert (self.tvar.nearest_index(targets, select='after') == [6, 7, 0, 48]).all()
+
+    def test_bracket_index(self):
+        targets = [datetime(2012,4,1,5,15, tzinfo=pytz.utc), datetime(2012,4,1,7, tzinfo=pytz.utc),
+                   datetime(2012,3,1, tzinfo=pytz.utc), datetime(2012,5,1, tzinfo=pytz.utc)]
+        earlier, later, weight = self.tvar.bracket_index(targets)
+        assert (earlier == [5, 7, 0, 47]).all()
+        assert (later == [6, 7, 0, 47]).all()
+        assert np.allclose(weight, [0.25, 0, 0, 0])
+        # Within a restricted window
+        earlier, later, weight = self.tvar.restrict(np.arange(10, 20)).bracket_index(targets[0])
+        assert earlier == [10] and later == [10] and weight == [0]
+
+    def test_nearest_index_skips_nan(self):
+        self.tvar[:10] = np.nan
+        self.tvar.reset_axis()
+        assert self.tvar.nearest_index(datetime(2012,4,1,2, tzinfo=pytz.utc)) == [10]
+        assert np.isnan(self.tvar.datenum[:10]).all()
+
+    def test_restrict(self):
+        restricted = self.tvar.restrict(np.arange(10, 20))
+        assert self.tvar.window is None
+        assert (restricted.window == np.arange(10, 20)).all()
+        # Values are shared, not masked
+        assert np.may_share_memory(restricted, self.tvar)
+        assert np.isfinite(np.asarray(restricted)).all()
+        assert restricted.nearest_index(datetime(2012,4,1,2, tzinfo=pytz.utc)) == [10]
+        assert restricted.nearest_index(datetime(2012,4,2, tzinfo=pytz.utc)) == [19]
+        assert (restricted.nearest_index([datetime(2012,4,1,9,30, tzinfo=pytz.utc)], select='after') == [10]).all()
+        # Windows only ever narrow
+        again = restricted.restrict([5, 12, 13, 30])
+        assert (again.window == [12, 13]).all()
+        assert again.restrict([0]).nearest_index(datetime(2012,4,1, tzinfo=pytz.utc)) == []
+
+    def test_empty_window(self):
+        assert self.tvar.timestep == 3600
+        assert self.tvar.restrict(np.arange(10, 20)).timestep == 3600
+        assert self.tvar.restrict([5]).timestep is None
+        empty = self.tvar.restrict([])
+        assert empty.timestep is None and empty.window.size == 0
+        assert empty.nearest_index(datetime(2012,4,1, tzinfo=pytz.utc)) == []
+
+    def test_units_per_instance(self):
+        datafile = os.path.join(self.tmpdir, "daily.nc")
+        nc = netCDF4.Dataset(datafile, "w")
+        nc.createDimension("time", 3)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "days since 2000-01-01 00:00:00"
+        time[:] = np.arange(3)
+        nc.close()
+        nc = netCDF4.Dataset(datafile)
+        hourly = Timevar(self.nc, name='time')
+        daily = Timevar(nc, name='time', tzinfo=pytz.timezone("US/Eastern"))
+        # The cached axes are built after both exist
+        assert hourly.dates[5] == datetime(2012,4,1,5, tzinfo=pytz.utc)
+        assert hourly.nearest_index(datetime(2012,4,1,5, tzinfo=pytz.utc)) == [5]
+        assert hourly._units == 'hours' and daily._units == 'days'
+        assert hourly.origin == datetime(2012,4,1) and daily.origin == datetime(2000,1,1)
+        assert hourly._tzinfo is pytz.utc and daily._tzinfo is not pytz.utc
+        assert not hasattr(Timevar, 'origin') and not hasattr(Timevar, '_units')
+        # and views keep them
+        assert hourly[2:4]._units == 'hours' and hourly.restrict([3]).origin == datetime(2012,4,1)
+        assert np.allclose(daily.restrict([1, 2]).hours[1:], [24, 48])
+        nc.close()
+
+    def test_datetime64_per_instance(self):
+        datafile = os.path.join(self.tmpdir, "daily.nc")
+        nc = netCDF4.Dataset(datafile, "w")
+        nc.createDimension("time", 3)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "days since 2000-01-01 00:00:00"
+        time[:] = np.arange(3)
+        nc.close()
+        nc = netCDF4.Dataset(datafile)
+        daily = Timevar(nc, name='time')
+        # Built after another Timevar with other units exists
+        assert self.tvar.datetime64[5] == np.datetime64('2012-04-01T05:00:00')
+        assert (daily.datetime64 == np.datetime64('2000-01-01') + np.arange(3).astype('timedelta64[D]')).all()
+        assert self.tvar.restrict([5]).datetime642date(self.tvar.datetime64[5]) == datetime(2012,4,1,5, tzinfo=pytz.utc)
+        nc.close()
+
+    def test_datetime64(self):
+        dt64 = self.tvar.datetime64
+        assert dt64.dtype == np.dtype('datetime64[us]')
+        assert dt64[0] == np.datetime64('2012-04-01T00:00:00')
+        assert dt64[-1] == np.datetime64('2012-04-02T23:00:00')
+
+        dates = self.tvar.dates
+        assert dates[5] == datetime(2012,4,1,5, tzinfo=pytz.utc)
+        assert self.tvar.datetime642date(dt64[5]) == datetime(2012,4,1,5, tzinfo=pytz.utc)
+
+        # Timezone aware datetimes are compared on the Timevar's clock
+        eastern = pytz.timezone("US/Eastern")
+        local = eastern.localize(datetime(2012,4,1,1))
+        assert self.tvar.date2datetime64(local) == np.datetime64('2012-04-01T05:00:00')
+
+    def test_char_times(self):
+        datafile = os.path.join(self.tmpdir, "wrf.nc")
+        strings = ['2012-04-01_00:00:00', '2012-04-01T01:00:00', '2012-04-01 02:00:00', 'April 1 2012 03:00   ', '2012-04-01T04:00:00Z']
+        nc = netCDF4.Dataset(datafile, "w")
+        nc.createDimension("Time", len(strings))
+        nc.createDimension("DateStrLen", 21)
+        times = nc.createVariable("Times", "S1", ("Time", "DateStrLen"))
+        times[:] = np.asarray([s.ljust(21) for s in strings], dtype='S21').view('S1').reshape(len(strings), 21)
+        nc.close()
+
+        nc = netCDF4.Dataset(datafile)
+        tvar = Timevar(nc, name='Times')
+        assert (tvar.datetime64 == np.datetime64('2012-04-01T00:00:00') + np.arange(5).astype('timedelta64[h]')).all()
+        assert np.allclose(np.diff(tvar.hours), 1)
+        nc.close()
+
+        nc = netCDF4.Dataset(datafile)
+        tvar = Timevar(nc, name='Times', units='hours since 2012-03-31 00:00:00')
+        assert np.allclose(tvar, [24, 25, 26, 27, 28])
+        nc.close()